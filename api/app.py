@@ -3,12 +3,15 @@ Aplicación FastAPI del backend BD2.
 
 Expone rutas para gestión de usuarios, bases de datos, tablas,
 registros, consultas SQL, importación CSV, SPIMI y multimedia.
-Configura CORS para desarrollo local o según variables de entorno.
+Configura CORS para desarrollo local o según variables de entorno
+(`DISABLE_CORS` lo desactiva por completo).
 """
 from __future__ import annotations
 
+import hashlib
 import os
-from fastapi import FastAPI
+import orjson
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from .users import router as users_router
@@ -18,44 +21,96 @@ from .records import router as records_router
 from .sql import router as sql_router
 from .csv_import import router as import_router
 from .spimi import router as spimi_router
+from .deps import AppJSONResponse, create_engine
+
+# Multimedia depende de opencv/librosa/scikit-learn; si no están instaladas
+# el resto de la API sigue funcionando sin esas rutas.
+try:
+    from .multimedia import router as multimedia_router
+    _HAS_MM = True
+except ImportError:
+    multimedia_router = None
+    _HAS_MM = False
+
+_ROUTERS = (
+    users_router,
+    db_router,
+    tables_router,
+    records_router,
+    sql_router,
+    import_router,
+    spimi_router,
+) + ((multimedia_router,) if _HAS_MM else ())
+
+# Respuesta de /healthz precalculada: sin serialización por petición y
+# cacheable por proxies/sondas durante 1 s.
+_HEALTHZ_BODY = orjson.dumps({"ok": True})
+_HEALTHZ_ETAG = '"' + hashlib.sha1(_HEALTHZ_BODY).hexdigest()[:16] + '"'
+_HEALTHZ_HEADERS = {"Cache-Control": "max-age=1", "ETag": _HEALTHZ_ETAG}
+
+
+def _check_unique_routes(routes) -> None:
+    """Falla al arrancar si dos rutas comparten método y path.
+
+    include_router no lo detecta: un router duplicado pasaría en silencio
+    y solo la primera ruta recibiría peticiones.
+    """
+    seen = set()
+    dupes = []
+    for route in routes:
+        for method in getattr(route, "methods", None) or ():
+            key = (method, route.path)
+            if key in seen:
+                dupes.append(f"{method} {route.path}")
+            seen.add(key)
+    if dupes:
+        raise RuntimeError("Rutas duplicadas: " + ", ".join(sorted(dupes)))
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Proyecto BD2 Backend", version="1.0.0")
-
-    # Configura CORS: por defecto orígenes locales; puede ajustarse por env
-    env_origins = os.getenv("CORS_ALLOWED_ORIGINS")
-    if env_origins:
-        allowed_origins = [o.strip() for o in env_origins.split(",") if o.strip()]
-    else:
-        allowed_origins = [
-            "http://localhost:3000",
-            "http://127.0.0.1:3000",
-        ]
-
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=allowed_origins,
-        allow_credentials=True,
-        allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-        allow_headers=["*"],
+    app = FastAPI(
+        title="Proyecto BD2 Backend",
+        version="1.0.0",
+        default_response_class=AppJSONResponse,
     )
 
-    # Registro de routers del sistema
-    app.include_router(users_router)
-    app.include_router(db_router)
-    app.include_router(tables_router)
-    app.include_router(records_router)
-    app.include_router(sql_router)
-    app.include_router(import_router)
-    app.include_router(spimi_router)
-    from .multimedia import router as multimedia_router
-    app.include_router(multimedia_router)
+    # Motor compartido por todas las peticiones (ver deps.get_engine)
+    app.state.engine = create_engine()
+
+    # Configura CORS: por defecto orígenes locales; puede ajustarse por env.
+    # Con DISABLE_CORS (frontend servido desde el mismo origen) no se instala
+    # ningún middleware y cada petición evita ese salto.
+    if not os.getenv("DISABLE_CORS"):
+        env_origins = os.getenv("CORS_ALLOWED_ORIGINS")
+        if env_origins:
+            allowed_origins = [o.strip() for o in env_origins.split(",") if o.strip()]
+        else:
+            allowed_origins = [
+                "http://localhost:3000",
+                "http://127.0.0.1:3000",
+            ]
+
+        app.add_middleware(
+            CORSMiddleware,
+            allow_origins=allowed_origins,
+            allow_credentials=True,
+            allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+            allow_headers=["*"],
+        )
+
+    # Registro de routers del sistema. include_router reconstruye cada
+    # APIRoute (costo único al arrancar) y mantiene `app.dependency_overrides`
+    # aplicable a todas las rutas, que es lo que usan los tests.
+    for r in _ROUTERS:
+        app.include_router(r)
 
     @app.get("/healthz")
-    def healthz():
-        return {"ok": True}
+    def healthz(request: Request):
+        if request.headers.get("if-none-match") == _HEALTHZ_ETAG:
+            return Response(status_code=304, headers=_HEALTHZ_HEADERS)
+        return Response(content=_HEALTHZ_BODY, media_type="application/json", headers=_HEALTHZ_HEADERS)
 
+    _check_unique_routes(app.router.routes)
     return app
 
 
@@ -1,12 +1,20 @@
 """
 Sistema de autenticación basado en JWT para proteger endpoints de la API.
-Implementa hashing de contraseñas con bcrypt y generación/validación de tokens JWT.
+Implementa hashing de contraseñas con argon2 (bcrypt heredado) y generación/validación de tokens JWT.
 """
 
+import asyncio
+import hashlib
+import hmac
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
+from typing import Optional, Tuple
+import jwt
+from jwt.exceptions import PyJWTError as JWTError
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -19,20 +27,76 @@ SECRET_KEY = os.getenv(
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Clave y algoritmos preconvertidos una sola vez (evita str->bytes por llamada)
+_SECRET = SECRET_KEY.encode("utf-8")
+_ALGS = (ALGORITHM,)
+
+# Contraseñas de usuario: argon2 por defecto; los hashes bcrypt previos se
+# siguen verificando y se re-hashean con argon2 en el siguiente login.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+    bcrypt__rounds=12,
+)
 security = HTTPBearer()
 
+# Instancia única de PyJWT (HMAC vía `cryptography`/OpenSSL)
+_jwt = jwt.PyJWT(options={"verify_aud": False})
+
+# Caché LRU de tokens ya validados: blake2b(token) -> (exp, payload)
+_TOKEN_CACHE_MAX = 4096
+_token_cache: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# Pool de procesos para el hashing (se crea al primer uso, no al importar)
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_pool_lock = threading.Lock()
+
+
+def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verifica una contraseña contra su hash.
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifica si una contraseña en texto plano coincide con su hash bcrypt."""
-    return pwd_context.verify(plain_password, hashed_password)
+    Retorna `(ok, nuevo_hash)`; `nuevo_hash` no es None cuando el hash
+    almacenado usa un esquema o coste obsoleto y debe reemplazarse.
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    """Genera un hash bcrypt de una contraseña."""
+    """Genera un hash argon2 de una contraseña."""
     return pwd_context.hash(password)
 
 
+def same_user(user_id: str, current_user: str) -> bool:
+    """Compara en tiempo constante el user_id de la ruta con el del token."""
+    return hmac.compare_digest(user_id.encode("utf-8"), current_user.encode("utf-8"))
+
+
+def _get_hash_pool() -> ProcessPoolExecutor:
+    """Devuelve el pool de procesos de hashing, creándolo en el primer uso."""
+    global _hash_pool
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                _hash_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _hash_pool
+
+
+async def averify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Versión asíncrona de `verify_password`: el hashing corre fuera del event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hash_pool(), verify_password, plain_password, hashed_password)
+
+
+async def aget_password_hash(password: str) -> str:
+    """Versión asíncrona de `get_password_hash`: el hashing corre fuera del event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hash_pool(), get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Crea un token JWT con los datos proporcionados y tiempo de expiración."""
     to_encode = data.copy()
@@ -43,15 +107,33 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = _jwt.encode(to_encode, _SECRET, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def _token_key(token: str) -> bytes:
+    """Clave de caché del token (evita guardar el JWT en claro en memoria)."""
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+
 def decode_token(token: str) -> dict:
-    """Decodifica y valida un token JWT, lanzando excepción si es inválido."""
+    """Decodifica y valida un token JWT, lanzando excepción si es inválido.
+
+    Los tokens válidos se memorizan hasta su `exp`, así las peticiones
+    repetidas con el mismo bearer evitan la verificación HMAC.
+    """
+    key = _token_key(token)
+    now = time.time()
+    with _token_cache_lock:
+        hit = _token_cache.get(key)
+        if hit is not None:
+            if hit[0] > now:
+                _token_cache.move_to_end(key)
+                return hit[1]
+            del _token_cache[key]
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        payload = _jwt.decode(token, _SECRET, algorithms=_ALGS)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -59,6 +141,15 @@ def decode_token(token: str) -> dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        with _token_cache_lock:
+            _token_cache[key] = (float(exp), payload)
+            _token_cache.move_to_end(key)
+            while len(_token_cache) > _TOKEN_CACHE_MAX:
+                _token_cache.popitem(last=False)
+    return payload
+
 
 async def get_current_user(
         credentials: HTTPAuthorizationCredentials = Depends(security)
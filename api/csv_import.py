@@ -6,21 +6,56 @@ de tipos de datos y construcción de índices.
 from __future__ import annotations
 
 import csv
+import io
 import os
 import json
-from typing import Dict, Any, List
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Query
+import re
+import shutil
+import threading
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile, File, Depends, Query, Response
 
-from .auth import get_current_user
+from .auth import get_current_user, same_user
 from engine import DatabaseEngine
-from indexes.spimi import build_spimi_blocks, merge_blocks
-import shutil
+from .deps import AppJSONResponse, get_engine
+from indexes.spimi import SpimiBlockWriter, build_blocks_from_datafile, merge_blocks_atomic, replace_dir
+
+# pyarrow es opcional: si está instalado, el CSV se tokeniza en C por bloques.
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    _HAS_ARROW = True
+except ImportError:
+    pa = None
+    pa_csv = None
+    _HAS_ARROW = False
+
+router = APIRouter(prefix="/users/{user_id}/databases/{db_name}/tables/{table_name}", tags=["import"], default_response_class=AppJSONResponse)
+
+# Bytes por bloque que tokeniza Arrow (ver _read_arrow_rows)
+_ARROW_BLOCK = 8 << 20
+
+# Filas por lote al insertar en modo bulk (memoria acotada por lote)
+_CSV_BATCH = int(os.environ.get("CSV_BATCH", 50_000))
+
+# Literales que el CSV usa para "sin valor" (comparados en minúsculas)
+_NULLS = frozenset(("none", "null", "nan"))
+
+# Fusiones SPIMI de fondo por directorio de tabla:
+# [lock de fusión/publicación, última carga iniciada, última carga publicada]
+_ft_merges: Dict[str, list] = {}
+_ft_merges_lock = threading.Lock()
 
-router = APIRouter(prefix="/users/{user_id}/databases/{db_name}/tables/{table_name}", tags=["import"])
+# Todo lo que no sea dígito (equivale a ''.join(re.findall(r"\d+", s)))
+_NON_DIGITS_RE = re.compile(r"\D+")
 
 
-def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
-    if user_id != current_user:
+async def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
+    if not same_user(user_id, current_user):
         raise HTTPException(
             status_code=403,
             detail="You don't have permission to access this user's data"
@@ -28,54 +63,368 @@ def _verify_user_access(user_id: str, current_user: str = Depends(get_current_us
     return current_user
 
 
-def _parse_csv_value(value: Any, column_type: str) -> Any:
-    """Convierte valores de CSV al tipo de dato apropiado según el esquema de la tabla."""
-    if value is None:
-        s = ""
+def _parse_float_array(s: str) -> List[float]:
+    """Parsea un vector '[1.0, 2.0, ...]' con el parser C de NumPy.
+
+    Si NumPy no consume el texto completo (elementos vacíos o inválidos)
+    se recurre al parseo elemento a elemento, que reporta el error.
+    """
+    s_arr = s.strip('[]')
+    if not s_arr.strip():
+        return []
+    try:
+        arr = np.fromstring(s_arr, dtype=np.float64, sep=',')
+        if arr.size == s_arr.count(',') + 1:
+            return arr.tolist()
+    except (ValueError, DeprecationWarning):
+        pass
+    try:
+        return [float(x.strip()) for x in s_arr.split(',') if x.strip() != ""]
+    except ValueError as e:
+        raise ValueError(f"Cannot parse array value '{s}': {e}")
+
+
+def _clean_cell(value: Optional[str]) -> str:
+    """Normaliza una celda: recorta espacios y trata 'none'/'null'/'nan' como vacío.
+
+    Los lectores (csv/Arrow) entregan `str` o None (fila corta), así que
+    `str()` queda solo como respaldo. `lower()` solo se evalúa para celdas
+    de 3-4 caracteres, las únicas que pueden ser un literal nulo.
+    """
+    if value.__class__ is str:
+        s = value.strip()
+    elif value is None:
+        return ""
     else:
-        s = str(value)
-    s = s.strip()
-    if s.lower() in ("none", "null", "nan"):
-        s = ""
+        s = str(value).strip()
+    if 3 <= len(s) <= 4 and s.lower() in _NULLS:
+        return ""
+    return s
 
-    if column_type == 'ARRAY_FLOAT' or (isinstance(column_type, str) and column_type.startswith('ARRAY')):
-        s_arr = s.strip('[]')
-        try:
-            return [float(x.strip()) for x in s_arr.split(',') if x.strip() != ""]
-        except ValueError as e:
-            raise ValueError(f"Cannot parse array value '{s}': {e}")
 
-    if column_type == "INT":
-        if s == "" or s.lower() in ("none", "null", "nan"):
-            return "0"
-        if not s.isdigit():
-            import re
-            digits = ''.join(re.findall(r"\d+", s))
-            return digits if digits != "" else "0"
+def _parse_int_cell(value: Optional[str]) -> str:
+    s = _clean_cell(value)
+    if s == "":
+        return "0"
+    if not s.isdigit():
+        return _NON_DIGITS_RE.sub("", s) or "0"
+    return s
+
+
+def _parse_float_cell(value: Optional[str]) -> str:
+    s = _clean_cell(value)
+    if s == "":
+        return "0.0"
+    try:
+        float(s)
         return s
+    except Exception:
+        return "0.0"
+
+
+def _parse_array_cell(value: Optional[str]) -> List[float]:
+    return _parse_float_array(_clean_cell(value))
+
+
+def _make_parser(column_type: str) -> Callable[[Optional[str]], Any]:
+    """Devuelve el parser especializado para un tipo de columna.
+
+    Se resuelve una vez por columna al cargar el CSV, de modo que el
+    bucle por celda no vuelve a despachar por tipo.
+    """
+    if column_type == 'ARRAY_FLOAT' or (isinstance(column_type, str) and column_type.startswith('ARRAY')):
+        return _parse_array_cell
+    if column_type == "INT":
+        return _parse_int_cell
     if column_type == "FLOAT":
-        if s == "" or s.lower() in ("none", "null", "nan"):
-            return "0.0"
+        return _parse_float_cell
+    return _clean_cell
+
+
+def _parse_csv_value(value: Optional[str], column_type: str) -> Any:
+    """Convierte valores de CSV al tipo de dato apropiado según el esquema de la tabla."""
+    return _make_parser(column_type)(value)
+
+
+def _detect_dialect(sample: str):
+    """Elige el dialecto CSV de la muestra.
+
+    Se prueba primero `csv.excel` (coma); solo si la primera fila queda en
+    una única columna se recurre a `csv.Sniffer`, que es lento.
+    """
+    first_row = next(csv.reader(io.StringIO(sample), csv.excel), [])
+    if len(first_row) > 1:
+        return csv.excel
+    try:
+        return csv.Sniffer().sniff(sample)
+    except Exception:
+        return csv.excel
+
+
+def _read_header(raw, csv_dialect) -> List[str]:
+    """Lee la cabecera (primera línea) con `csv` y rebobina el archivo."""
+    line = raw.readline()
+    raw.seek(0)
+    return next(csv.reader([line.decode("utf-8-sig", errors="replace")], csv_dialect), [])
+
+
+def _csv_rows_after(raw, csv_dialect, keep: List[int], skip: int):
+    """Filas de `csv.reader` proyectadas a `keep`, saltando las `skip` primeras no vacías.
+
+    Respaldo de `_read_arrow_rows` cuando Arrow rechaza un bloque a mitad
+    de archivo: retoma en la misma fila con las reglas de `csv.reader`
+    (filas cortas con None, UTF-8 inválido reemplazado).
+    """
+    raw.seek(0)
+    text_stream = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        reader = csv.reader(text_stream, dialect=csv_dialect)
+        next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            n = len(row)
+            yield tuple(row[i] if i < n else None for i in keep)
+    finally:
+        # No cerrar el archivo subido al liberar el wrapper
+        text_stream.detach()
+
+
+def _read_arrow_rows(raw, csv_dialect, column_types: Dict[str, str]):
+    """Lee el CSV en streaming con `pyarrow.csv.open_csv`.
+
+    Arrow tokeniza bloques de `_ARROW_BLOCK` bytes en C y las filas se
+    entregan lote a lote, con memoria acotada. Solo se leen las columnas
+    del esquema (`include_columns`), todas como texto, para que los parsers
+    por columna apliquen las mismas reglas que con `csv.reader` y ninguna
+    inferencia de tipos falle a mitad de archivo. Si un bloque posterior
+    no es válido para Arrow (fila de ancho irregular, UTF-8 inválido...),
+    la lectura sigue desde esa fila con `csv.reader`.
+
+    Devuelve (cabecera, filas) con ambas alineadas, o None si el dialecto
+    no es representable en Arrow o el primer bloque no es válido, en cuyo
+    caso el llamador usa el lector de `csv`.
+    """
+    delimiter = csv_dialect.delimiter
+    quotechar = csv_dialect.quotechar
+    if len(delimiter) != 1 or (quotechar is not None and len(quotechar) != 1):
+        return None
+    names = _read_header(raw, csv_dialect)
+    keep = [i for i, n in enumerate(names) if n in column_types and n not in names[:i]]
+    if not keep:
+        return None
+    header = [names[i] for i in keep]
+    try:
+        arrow_reader = pa_csv.open_csv(
+            raw,
+            read_options=pa_csv.ReadOptions(block_size=_ARROW_BLOCK),
+            parse_options=pa_csv.ParseOptions(
+                delimiter=delimiter,
+                quote_char=quotechar or False,
+                double_quote=csv_dialect.doublequote,
+                escape_char=csv_dialect.escapechar or False,
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=header,
+                column_types={name: pa.string() for name in header},
+                strings_can_be_null=False,
+            ),
+        )
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        raw.seek(0)
+        return None
+
+    def rows():
+        done = 0
+        try:
+            for rb in arrow_reader:
+                cols = [rb.column(i).to_pylist() for i in range(len(header))]
+                yield from zip(*cols)
+                done += rb.num_rows
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            yield from _csv_rows_after(raw, csv_dialect, keep, done)
+
+    return header, rows()
+
+
+def _open_spimi_writers(table, ft_cols: List[str]) -> Dict[str, SpimiBlockWriter]:
+    """Prepara un escritor de bloques SPIMI por columna full-text.
+
+    Cada carga escribe en sus propios directorios de bloques (sufijo
+    aleatorio): la fusión de fondo de una carga anterior puede seguir
+    leyendo los suyos. Los bloques se siembran con los registros que la
+    tabla ya tenía, para que el índice resultante cubra toda la tabla. La
+    siembra se reparte por rangos de páginas en un pool de procesos cuando
+    la tabla es grande.
+    """
+    load_id = uuid.uuid4().hex[:12]
+    writers: Dict[str, SpimiBlockWriter] = {}
+    block_dirs: Dict[str, str] = {}
+    try:
+        for col in ft_cols:
+            block_dir = os.path.join(table.base_dir, f"spimi_blocks_{col}.{load_id}")
+            writers[col] = SpimiBlockWriter(block_dir, block_max_docs=200, do_stem=True)
+            block_dirs[col] = block_dir
+
         try:
-            float(s)
-            return s
+            pc = table.datafile.page_count()
         except Exception:
-            return "0.0"
+            pc = 0
+        if pc == 0:
+            return writers
 
-    return s
+        targets = {col: (block_dir, col) for col, block_dir in block_dirs.items()}
+        counts = build_blocks_from_datafile(table.data_path, table.page_size, pc, targets, block_max_docs=200, prefix="seed")
+    except Exception:
+        _drop_blocks(block_dirs.values())
+        raise
+
+    # Los documentos sembrados cuentan para N del índice final
+    for col, n in counts.items():
+        writers[col].total_docs += n
+    return writers
+
+
+def _drop_blocks(block_dirs: Iterable[str]) -> None:
+    for block_dir in block_dirs:
+        shutil.rmtree(block_dir, ignore_errors=True)
+
+
+def _ft_merge_state(table_dir: str) -> list:
+    with _ft_merges_lock:
+        return _ft_merges.setdefault(table_dir, [threading.Lock(), 0, 0])
+
+
+def _next_ft_load(table_dir: str) -> int:
+    """Numera las cargas con índice full-text de una tabla, en orden de escritura."""
+    state = _ft_merge_state(table_dir)
+    with _ft_merges_lock:
+        state[1] += 1
+        return state[1]
+
+
+def _append_batch(table, batch: List[Dict[str, Any]], spimi_writers: Dict[str, SpimiBlockWriter]) -> int:
+    """Inserta un lote en el DataFile y pasa cada texto a su escritor SPIMI."""
+    if not spimi_writers:
+        return len(table.append_records(batch))
+    count = 0
+    for rid, rec in table.append_records_iter(batch):
+        count += 1
+        for col, writer in spimi_writers.items():
+            text = rec.get(col)
+            if text is not None:
+                writer.add(text, rid)
+    return count
+
+
+def _merge_spimi_columns(jobs: List[Tuple[str, str, int]]) -> None:
+    """Fusiona los índices de varias columnas en paralelo, uno por proceso.
+
+    Cada columna es independiente; con una sola no se paga el arranque del pool.
+    """
+    if len(jobs) == 1:
+        merge_blocks_atomic(*jobs[0])
+        return
+    workers = min(len(jobs), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(merge_blocks_atomic, *job) for job in jobs]
+        for f in as_completed(futures):
+            f.result()
+
+
+def _publish_index(index_dir: str, canonical_index: str) -> None:
+    """Publica `index_dir` como índice canónico sin copiar bytes.
+
+    Los archivos se enlazan con hardlinks (copia normal si el sistema de
+    archivos no lo permite) en un directorio temporal que luego reemplaza
+    al canónico con `os.replace`, de modo que los lectores nunca ven un
+    índice a medio copiar.
+    """
+    tmp = canonical_index + ".new"
+    shutil.rmtree(tmp, ignore_errors=True)
+    try:
+        shutil.copytree(index_dir, tmp, copy_function=os.link)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.copytree(index_dir, tmp)
+    replace_dir(tmp, canonical_index)
+
+
+def _build_ft_indexes(jobs: List[Tuple[str, str, int]], canonical_index: str, table_dir: str, load_seq: int) -> None:
+    """Fusiona y publica los índices SPIMI (tarea en segundo plano de load-csv).
+
+    Mientras corre, los lectores siguen viendo el índice anterior: cada
+    directorio se reemplaza de forma atómica al terminar. Las fusiones de
+    una misma tabla se serializan, y si una carga posterior ya publicó (sus
+    bloques incluyen estas filas) esta no vuelve a publicar. Los bloques
+    de la carga se borran al terminar.
+    """
+    state = _ft_merge_state(table_dir)
+    try:
+        with state[0]:
+            if load_seq < state[2]:
+                return
+            try:
+                _merge_spimi_columns(jobs)
+            except Exception:
+                print("⚠️ Error building SPIMI index:")
+                traceback.print_exc()
+                return
+            state[2] = load_seq
+            try:
+                _publish_index(jobs[-1][1], canonical_index)
+            except Exception:
+                print("⚠️ Warning: couldn't copy SPIMI index to canonical path:")
+                traceback.print_exc()
+    finally:
+        _drop_blocks(block_dir for block_dir, _, _ in jobs)
+
+
+def _spimi_jobs(table, spimi_writers: Dict[str, SpimiBlockWriter]) -> List[Tuple[str, str, int]]:
+    """Cierra los escritores SPIMI (último bloque a disco) y arma los trabajos de fusión."""
+    return [
+        (writer.block_dir, os.path.join(table.base_dir, f"spimi_index_{col}"), writer.close())
+        for col, writer in spimi_writers.items()
+    ]
+
+
+def _rollback_load(table, mark, spimi_writers: Dict[str, SpimiBlockWriter], reindex: bool) -> None:
+    """Deja la tabla como estaba antes de un load-csv fallido (todo o nada).
+
+    El DataFile vuelve a `mark` y los bloques SPIMI de la carga se
+    descartan; con `reindex` (inserción incremental, o índices ya
+    reconstruidos) los índices se rehacen desde el DataFile restaurado.
+    """
+    _drop_blocks(w.block_dir for w in spimi_writers.values())
+    table.rollback_to(mark, reindex=reindex)
 
 
 @router.post("/load-csv")
-async def load_csv(
+def load_csv(
         user_id: str,
         db_name: str,
         table_name: str,
+        background_tasks: BackgroundTasks,
+        response: Response,
         file: UploadFile = File(...),
         bulk: bool = Query(True, description="Use bulk insert mode (faster, recommended)"),
+        dialect: Optional[str] = Query(None, description="CSV dialect (excel, excel-tab, unix); auto-detected if omitted"),
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
-    """Carga un archivo CSV en una tabla, con soporte para inserción masiva y construcción de índices."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
+    """Carga un archivo CSV en una tabla, con soporte para inserción masiva y construcción de índices.
+
+    El archivo se lee en streaming (sin materializarlo en memoria) y se
+    inserta en lotes de `_CSV_BATCH` filas. Si la tabla tiene índices
+    full-text, la fusión SPIMI queda en segundo plano y se responde 202
+    con `spimi_status: "scheduled"`.
+    """
+    if dialect and dialect not in csv.list_dialects():
+        raise HTTPException(status_code=400, detail=f"Unknown CSV dialect '{dialect}'")
+
     db = engine.get_database(user_id, db_name)
     if db is None:
         raise HTTPException(status_code=404, detail="Database not found")
@@ -84,94 +433,110 @@ async def load_csv(
     if table is None:
         raise HTTPException(status_code=404, detail="Table not found")
 
+    text_stream = None
     try:
-        content = await file.read()
-        text = content.decode("utf-8", errors="replace")
-        try:
-            sample = text[:10000]
-            dialect = csv.Sniffer().sniff(sample)
-        except Exception:
-            class _DefaultDialect(csv.Dialect):
-                delimiter = ','
-                quotechar = '"'
-                doublequote = True
-                escapechar = None
-                lineterminator = '\n'
-                quoting = csv.QUOTE_MINIMAL
-            dialect = _DefaultDialect()
-        lines = text.splitlines()
-        reader = csv.DictReader(lines, dialect=dialect)
-
-        column_types = {col.name: col.col_type.name for col in table.schema.columns}
-
-        rows: List[Dict[str, Any]] = []
-        for row_num, row in enumerate(reader, start=2):
-            parsed_row = {}
-            try:
-                for col_name, value in row.items():
-                    if col_name in column_types:
-                        col_type = column_types[col_name]
-                        parsed_row[col_name] = _parse_csv_value(value, col_type)
-                    else:
-                        continue
-                rows.append(parsed_row)
-            except Exception as e:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Error parsing row {row_num}, column '{col_name}': {str(e)}"
-                )
-
-        if not rows:
-            raise HTTPException(status_code=400, detail="CSV file is empty")
-
-        if bulk:
-            rids = table.insert_bulk(rows, rebuild_indexes=True)
-            inserted = len(rids)
-            try:
+        raw = file.file
+        if dialect:
+            csv_dialect = csv.get_dialect(dialect)
+        else:
+            sample = raw.read(10000).decode("utf-8-sig", errors="replace")
+            raw.seek(0)
+            csv_dialect = _detect_dialect(sample)
+        column_types = table.column_type_map
+        arrow_rows = _read_arrow_rows(raw, csv_dialect, column_types) if _HAS_ARROW else None
+        if arrow_rows is not None:
+            header, reader = arrow_rows
+        else:
+            text_stream = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="")
+            reader = csv.reader(text_stream, dialect=csv_dialect)
+            header = next(reader, None) or []
+
+        # Plan posicional: (índice en el CSV, columna, parser) solo para columnas del esquema
+        col_plan = [(i, name, _make_parser(column_types[name])) for i, name in enumerate(header) if name in column_types]
+        # Ancho mínimo de fila que cubre todo el plan (las filas cortas se rellenan con None)
+        width = col_plan[-1][0] + 1 if col_plan else 0
+
+        # La carga es todo o nada: el lock de la tabla excluye otras
+        # escrituras mientras dura (las búsquedas por índice esperan) y ante
+        # cualquier error el DataFile vuelve a `mark`.
+        with table.lock:
+            mark = table.datafile.mark()
+
+            # Índices full-text: sus bloques SPIMI se construyen en la misma pasada
+            # de inserción (ver _append_batch), sin releer el DataFile después.
+            spimi_writers: Dict[str, SpimiBlockWriter] = {}
+            if bulk:
                 ft_cols = [c for c, t in table.schema.indexes.items() if t.name.lower() in ("fulltext", "inverted")]
                 if ft_cols:
-                    for col in ft_cols:
-                        block_dir = os.path.join(table.base_dir, f"spimi_blocks_{col}")
-                        index_dir = os.path.join(table.base_dir, f"spimi_index_{col}")
-                        os.makedirs(block_dir, exist_ok=True)
-                        os.makedirs(index_dir, exist_ok=True)
+                    try:
+                        spimi_writers = _open_spimi_writers(table, ft_cols)
+                    except Exception:
+                        print("⚠️ Error building SPIMI index:")
+                        traceback.print_exc()
+                        spimi_writers = {}
+            load_seq = _next_ft_load(table.base_dir) if spimi_writers else 0
 
+            inserted = 0
+            indexes_touched = not bulk  # en modo incremental cada insert actualiza los índices
+            batch: List[Dict[str, Any]] = []
+            spimi_status = None
+            try:
+                # row_num cuenta filas físicas (cabecera = 1), incluidas las vacías
+                for row_num, row in enumerate(reader, start=2):
+                    if not row:
+                        continue
+                    if len(row) < width:
+                        row = list(row) + [None] * (width - len(row))
+                    try:
+                        parsed_row = {col_name: parse(row[i]) for i, col_name, parse in col_plan}
+                    except Exception:
+                        # Camino lento, solo ante error: ubicar la celda que falló
+                        for i, col_name, parse in col_plan:
+                            try:
+                                parse(row[i])
+                            except Exception as e:
+                                raise HTTPException(
+                                    status_code=400,
+                                    detail=f"Error parsing row {row_num}, column '{col_name}': {str(e)}"
+                                )
+                        raise
+                    if bulk:
+                        batch.append(parsed_row)
+                        if len(batch) >= _CSV_BATCH:
+                            inserted += _append_batch(table, batch, spimi_writers)
+                            batch.clear()
+                    else:
+                        table.insert(parsed_row)
+                        inserted += 1
+                if batch:
+                    inserted += _append_batch(table, batch, spimi_writers)
+                    batch.clear()
+
+                if inserted == 0:
+                    raise HTTPException(status_code=400, detail="CSV file is empty")
+
+                if bulk:
+                    indexes_touched = True
+                    table.build_indexes_from_datafile()
+                    if spimi_writers:
+                        # Se cierran aquí (último bloque a disco); la fusión y la
+                        # publicación corren tras enviar la respuesta.
                         try:
-                            pc = table.datafile.page_count()
-                        except Exception:
-                            pc = 0
-
-                        def doc_iter():
-                            for pid in range(pc):
-                                page = table.datafile.read_page(pid)
-                                records = page.iter_records()
-                                for slot, rec in enumerate(records):
-                                    rid = (pid, slot)
-                                    text = rec.get(col)
-                                    if text is None:
-                                        continue
-                                    yield (text, rid)
-
-                        total_docs = build_spimi_blocks(doc_iter(), block_dir, block_max_docs=200, do_stem=True)
-                        merge_blocks(block_dir, index_dir, total_docs=total_docs)
-                        canonical_index = os.path.join(table.base_dir, "spimi_index")
-                        try:
-                            if os.path.exists(canonical_index):
-                                shutil.rmtree(canonical_index)
-                            shutil.copytree(index_dir, canonical_index)
+                            jobs = _spimi_jobs(table, spimi_writers)
                         except Exception:
-                            import traceback
-                            print("⚠️ Warning: couldn't copy SPIMI index to canonical path:")
+                            print("⚠️ Error building SPIMI index:")
                             traceback.print_exc()
-            except Exception:
-                import traceback
-                print("⚠️ Error building SPIMI index:")
-                traceback.print_exc()
-        else:
-            inserted = 0
-            for row in rows:
-                table.insert(row)
-                inserted += 1
+                            _drop_blocks(w.block_dir for w in spimi_writers.values())
+                            spimi_status = "failed"
+                        else:
+                            # El índice canónico corresponde a la última columna full-text
+                            canonical_index = os.path.join(table.base_dir, "spimi_index")
+                            background_tasks.add_task(_build_ft_indexes, jobs, canonical_index, table.base_dir, load_seq)
+                            response.status_code = 202
+                            spimi_status = "scheduled"
+            except BaseException:
+                _rollback_load(table, mark, spimi_writers, reindex=indexes_touched and inserted > 0)
+                raise
 
     except csv.Error as e:
         raise HTTPException(status_code=400, detail=f"CSV parsing error: {str(e)}")
@@ -179,10 +544,15 @@ async def load_csv(
         raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error loading CSV: {str(e)}")
+    finally:
+        if text_stream is not None:
+            # No cerrar el archivo subido al liberar el wrapper
+            text_stream.detach()
 
     return {
         "ok": True,
         "inserted": inserted,
         "mode": "bulk" if bulk else "incremental",
+        "spimi_status": spimi_status,
         "message": f"Successfully inserted {inserted} rows using {'bulk' if bulk else 'incremental'} mode"
     }
\ No newline at end of file
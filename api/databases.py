@@ -5,19 +5,52 @@ Permite crear, listar, obtener y eliminar bases de datos con verificación de pe
 from __future__ import annotations
 
 import os
-from typing import List
-from fastapi import APIRouter, HTTPException, Depends, status
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, status
 
 from .schemas import DatabaseCreate, DatabaseOut
-from .auth import get_current_user
+from .auth import get_current_user, same_user
 from engine import DatabaseEngine
+from .deps import AppJSONResponse, get_engine, invalidate_tables
 
-router = APIRouter(prefix="/users/{user_id}/databases", tags=["databases"])
+router = APIRouter(prefix="/users/{user_id}/databases", tags=["databases"], default_response_class=AppJSONResponse)
 
+# Caché de listados por directorio de usuario: path -> (instante, nombres).
+# Se invalida al crear/eliminar desde la API; el TTL cubre cambios externos.
+_LIST_TTL = 5.0
+_list_cache: Dict[str, Tuple[float, Tuple[str, ...]]] = {}
+_list_cache_lock = threading.Lock()
 
-def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
+
+def _list_database_names(user_dir: str) -> Tuple[str, ...]:
+    """Nombres de las bases de datos en `user_dir` (scandir + caché con TTL)."""
+    now = time.monotonic()
+    with _list_cache_lock:
+        hit = _list_cache.get(user_dir)
+    if hit is not None and now - hit[0] < _LIST_TTL:
+        return hit[1]
+    try:
+        with os.scandir(user_dir) as it:
+            names = tuple(e.name for e in it if e.is_dir())
+    except (FileNotFoundError, NotADirectoryError):
+        names = ()
+    with _list_cache_lock:
+        _list_cache[user_dir] = (now, names)
+    return names
+
+
+def _invalidate_list(user_dir: str) -> None:
+    with _list_cache_lock:
+        _list_cache.pop(user_dir, None)
+
+
+async def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
     """Verifica que el usuario autenticado tenga acceso a los recursos del user_id solicitado."""
-    if user_id != current_user:
+    if not same_user(user_id, current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have permission to access this user's databases"
@@ -29,41 +62,38 @@ def _verify_user_access(user_id: str, current_user: str = Depends(get_current_us
 def create_database(
         user_id: str,
         payload: DatabaseCreate,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ) -> DatabaseOut:
     """Crea una nueva base de datos para el usuario."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
     db = engine.create_database(user_id, payload.name)
+    _invalidate_list(engine.databases_dir(user_id))
     return DatabaseOut(name=db.name)
 
 
 @router.get("", response_model=List[DatabaseOut])
 def list_databases(
         user_id: str,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ) -> List[DatabaseOut]:
-    """Lista todas las bases de datos del usuario."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    user_dir = os.path.join(engine.root_dir, "data", "users", user_id, "databases")
-
-    if not os.path.isdir(user_dir):
-        return []
+    """Lista todas las bases de datos del usuario.
 
-    out = []
-    for name in os.listdir(user_dir):
-        if os.path.isdir(os.path.join(user_dir, name)):
-            out.append(DatabaseOut(name=name))
-    return out
+    Se devuelve la respuesta ya serializada con orjson: `response_model`
+    queda solo para la documentación OpenAPI y no se re-valida cada item.
+    """
+    names = _list_database_names(engine.databases_dir(user_id))
+    return AppJSONResponse([{"name": name} for name in names])
 
 
 @router.get("/{db_name}", response_model=DatabaseOut)
 def get_database(
         user_id: str,
         db_name: str,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ) -> DatabaseOut:
     """Obtiene información de una base de datos específica."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
     db = engine.get_database(user_id, db_name)
 
     if db is None:
@@ -76,15 +106,30 @@ def get_database(
 def delete_database(
         user_id: str,
         db_name: str,
+        background_tasks: BackgroundTasks,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
-    """Elimina permanentemente una base de datos y todos sus archivos."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db_dir = os.path.join(engine.root_dir, "data", "users", user_id, "databases", db_name)
+    """Elimina permanentemente una base de datos y todos sus archivos.
+
+    El directorio se renombra (atómico) a `data/.trash` y el borrado real
+    se hace en segundo plano, así la respuesta no espera al `rmtree`.
+    """
+    user_dir = engine.databases_dir(user_id)
+    db_dir = os.path.join(user_dir, db_name)
 
     if not os.path.exists(db_dir):
         raise HTTPException(status_code=404, detail="Database not found")
 
-    import shutil
-    shutil.rmtree(db_dir, ignore_errors=True)
-    return {"ok": True, "message": f"Database '{db_name}' deleted successfully"}
\ No newline at end of file
+    trash_dir = os.path.join(engine.root_dir, "data", ".trash")
+    os.makedirs(trash_dir, exist_ok=True)
+    doomed = os.path.join(trash_dir, uuid.uuid4().hex)
+    try:
+        os.replace(db_dir, doomed)
+    except OSError:
+        # Otro sistema de archivos o directorio en uso: borrado directo
+        doomed = db_dir
+    _invalidate_list(user_dir)
+    invalidate_tables(db_dir)
+    background_tasks.add_task(shutil.rmtree, doomed, ignore_errors=True)
+    return {"ok": True, "message": f"Database '{db_name}' deleted successfully"}
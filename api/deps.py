@@ -1,21 +1,239 @@
 """Dependencias y utilidades compartidas para los endpoints de la API.
 
-Proporciona funciones helper para obtener instancias del motor de base de datos.
+Proporciona funciones helper para obtener instancias del motor de base de datos,
+tablas cacheadas entre peticiones y la clase de respuesta JSON por defecto
+de la aplicación.
 """
 from __future__ import annotations
 
+import hashlib
 import os
-from typing import Generator
-from fastapi import Depends
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generator, Optional, Tuple, Type, TypeVar
+import orjson
+from fastapi import Depends, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ValidationError
 
 from engine import DatabaseEngine
+from metrics import stats
+from storage.database import Database
+from storage.table import Table
 
 
 ROOT_DIR = os.path.dirname(__file__)
 
 
-def get_engine(root_dir: str = None) -> DatabaseEngine:
-    """Obtiene una instancia del motor de base de datos."""
+def create_engine(root_dir: str = None) -> DatabaseEngine:
+    """Crea una instancia del motor de base de datos en la raíz del proyecto."""
     rd = root_dir or os.path.dirname(os.path.abspath(__file__))
     proj_root = os.path.dirname(rd)
     return DatabaseEngine(proj_root)
+
+
+async def get_engine(request: Request) -> DatabaseEngine:
+    """Dependencia FastAPI: motor compartido creado una vez en `create_app`.
+
+    Es `async` porque no bloquea: así FastAPI no la despacha al threadpool.
+    """
+    return request.app.state.engine
+
+
+# Caché de tablas abiertas: dir de la tabla -> (firma en disco, Table).
+# Abrir una tabla deserializa todos sus índices; la firma (mtime/tamaño de
+# los archivos de la tabla y del catálogo) detecta cualquier escritura, hecha
+# por este proceso o por otro, y fuerza una recarga. La misma Table se
+# comparte entre peticiones concurrentes: sus escrituras y accesos a índices
+# se serializan con `Table.lock`.
+_TABLE_CACHE_MAX = 256
+_table_cache: "OrderedDict[str, Tuple[tuple, Table]]" = OrderedDict()
+_table_cache_lock = threading.Lock()
+
+
+def _stat_sig(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _table_signature(db_dir: str, table_dir: str) -> tuple:
+    """Firma barata (solo stat) del estado en disco de una tabla."""
+    idx = []
+    try:
+        with os.scandir(os.path.join(table_dir, "indexes")) as it:
+            for e in it:
+                st = e.stat()
+                idx.append((e.name, st.st_mtime_ns, st.st_size))
+    except OSError:
+        pass
+    idx.sort()
+    return (
+        _stat_sig(os.path.join(db_dir, "metadata.json")),
+        _stat_sig(os.path.join(table_dir, "schema.json")),
+        _stat_sig(os.path.join(table_dir, "data.dat")),
+        tuple(idx),
+    )
+
+
+def get_table_or_404(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str) -> Table:
+    """Devuelve la tabla (cacheada mientras no cambie en disco) o responde 404."""
+    return get_table_with_version(engine, user_id, db_name, table_name)[0]
+
+
+def get_table_with_version(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str) -> Tuple[Table, tuple]:
+    """Como `get_table_or_404`, más la firma en disco de la tabla.
+
+    La firma cambia con cualquier escritura, así que sirve de versión para
+    cachear resultados derivados de la tabla.
+    """
+    db_dir = os.path.join(engine.databases_dir(user_id), db_name)
+    if not os.path.isdir(db_dir):
+        raise HTTPException(status_code=404, detail="Database not found")
+    table_dir = os.path.join(db_dir, "tables", table_name)
+
+    sig = _table_signature(db_dir, table_dir)
+    with _table_cache_lock:
+        hit = _table_cache.get(table_dir)
+        if hit is not None and hit[0] == sig:
+            _table_cache.move_to_end(table_dir)
+            return hit[1], sig
+
+    # Firma antes y después de abrir: si difieren, o alguien escribió
+    # mientras se abría o la propia apertura creó archivos (índices vacíos).
+    # Se reintenta una vez; si sigue sin ser estable, la tabla se entrega sin
+    # cachear para no guardar un objeto viejo bajo una firma nueva.
+    for _ in range(2):
+        table = engine.get_table(user_id, db_name, table_name)
+        if table is None:
+            raise HTTPException(status_code=404, detail="Table not found")
+        after = _table_signature(db_dir, table_dir)
+        if after == sig:
+            break
+        sig = after
+    else:
+        return table, sig
+    with _table_cache_lock:
+        _table_cache[table_dir] = (sig, table)
+        _table_cache.move_to_end(table_dir)
+        while len(_table_cache) > _TABLE_CACHE_MAX:
+            _table_cache.popitem(last=False)
+    return table, sig
+
+
+def table_etag(version: tuple, *params: Any) -> str:
+    """ETag débil de una lectura: versión de la tabla + parámetros de la consulta.
+
+    Es débil (`W/`) porque el cuerpo incluye tiempos y métricas que cambian
+    entre peticiones aunque las filas sean las mismas.
+    """
+    digest = hashlib.blake2b(repr((version, params)).encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True si el `If-None-Match` del cliente ya incluye `etag`."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Comparación débil: se ignora el prefijo W/ de ambos lados
+    tag = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+def open_database(engine: DatabaseEngine, user_id: str, db_name: str) -> Optional[Database]:
+    """Como `engine.get_database`, pero armando el catálogo con tablas cacheadas.
+
+    `Database` abre todas sus tablas (y sus índices) al construirse; aquí
+    cada una sale de la caché de `get_table_or_404` si no cambió en disco.
+    """
+    db_dir = os.path.join(engine.databases_dir(user_id), db_name)
+    if not os.path.isdir(db_dir):
+        return None
+
+    def open_table(table_name: str, _table_dir: str) -> Optional[Table]:
+        try:
+            return get_table_or_404(engine, user_id, db_name, table_name)
+        except HTTPException:
+            return None
+
+    return Database(db_dir, db_name, open_table=open_table)
+
+
+def invalidate_tables(path_prefix: str) -> None:
+    """Descarta las tablas cacheadas bajo `path_prefix` (tabla o base de datos)."""
+    prefix = os.path.abspath(path_prefix)
+    with _table_cache_lock:
+        for key in [k for k in _table_cache if k == prefix or k.startswith(prefix + os.sep)]:
+            del _table_cache[key]
+
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def json_body(model: Type[M]) -> Callable[[Request], Any]:
+    """Dependencia que valida el cuerpo crudo con `model.model_validate_json`.
+
+    pydantic-core parsea y valida el JSON en una sola pasada, sin el
+    `json.loads` intermedio que hace FastAPI para un parámetro de cuerpo.
+    Los errores salen como 422 con el mismo formato (`loc` bajo "body").
+    Usar junto a `json_body_openapi(model)` para documentar el cuerpo.
+    """
+    async def dependency(request: Request) -> M:
+        body = await request.body()
+        try:
+            return model.model_validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)],
+                body=body,
+            )
+    return dependency
+
+
+def json_body_openapi(model: Type[BaseModel]) -> Dict[str, Any]:
+    """`openapi_extra` que documenta el cuerpo leído con `json_body`."""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": model.model_json_schema()}},
+        }
+    }
+
+
+def disk_metrics(index_metrics: Any) -> dict:
+    """Bloque `metrics` de las respuestas: accesos a disco de la petición actual."""
+    r = stats.get_counter("disk.reads")
+    w = stats.get_counter("disk.writes")
+    return {
+        "total_disk_accesses": r + w,
+        "disk_reads": r,
+        "disk_writes": w,
+        "indexes": index_metrics,
+    }
+
+
+def dumps_json(content: Any) -> bytes:
+    """Serializa como `AppJSONResponse` (para cuerpos construidos a mano)."""
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+class AppJSONResponse(ORJSONResponse):
+    """Respuesta JSON serializada con orjson.
+
+    Acepta arrays/escalares de NumPy y claves de dict no string (como
+    hacía `json` de la stdlib) para no romper endpoints existentes.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
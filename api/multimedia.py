@@ -5,25 +5,50 @@ y buscar imágenes/audio similares usando SIFT, MFCC y k-means.
 """
 from fastapi import APIRouter, UploadFile, File, Query, Body
 from fastapi.responses import FileResponse
-from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel, Field
 import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import numpy as np
 import mimetypes
 import hashlib
 import cv2
 
-from multimedia.features_image import extract_sift_descriptors
-from multimedia.features_audio import extract_mfcc_descriptors
-from multimedia.codebook import load_codebook, sample_descriptors, train_codebook, save_codebook
-from multimedia.bow import quantize_descriptors, compute_df, save_bow_artifacts
+try:  # opcional (llega con matplotlib): leer solo la cabecera para elegir la reducción
+    from PIL import Image
+    _HAS_PIL = True
+except ImportError:
+    Image = None
+    _HAS_PIL = False
+
+from multimedia.features_image import extract_sift_descriptors, extract_sift_descriptors_from_bytes
+from multimedia.features_audio import extract_mfcc_descriptors, extract_mfcc_descriptors_from_bytes
+from multimedia.codebook import load_centroids, train_codebook_streaming, save_codebook
+from multimedia.bow import quantize_descriptors, quantize_batch, centroid_half_norms, compute_df, save_bow_artifacts
 from multimedia.knn_sequential import search_sequential
 from multimedia.inv_index import search_inverted
 from multimedia.inv_index import build_inverted_index
+from .deps import AppJSONResponse
 
 
-router = APIRouter(prefix="/multimedia", tags=["multimedia"])
+router = APIRouter(prefix="/multimedia", tags=["multimedia"], default_response_class=AppJSONResponse)
+
+# Centroides y 0.5*||c||² por codebook; se recargan cuando cambia el mtime del pickle
+_CODEBOOKS: Dict[str, Tuple[int, np.ndarray, np.ndarray]] = {}
+
+
+def _get_centroids(codebook_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    mtime = os.stat(codebook_path).st_mtime_ns
+    hit = _CODEBOOKS.get(codebook_path)
+    if hit is not None and hit[0] == mtime:
+        return hit[1], hit[2]
+    centroids = load_centroids(codebook_path)
+    c_half = centroid_half_norms(centroids)
+    _CODEBOOKS[codebook_path] = (mtime, centroids, c_half)
+    return centroids, c_half
 
 
 @router.post("/search")
@@ -42,26 +67,17 @@ async def multimedia_search(
             "error": f"Missing codebook at {codebook_path}. Train it via /multimedia/train-codebook",
         }
     try:
-        km, meta = load_codebook(codebook_path)
+        centroids, c_half = _get_centroids(codebook_path)
     except Exception as e:
         return {"ok": False, "error": f"Failed to load codebook: {e}"}
-    centroids = km.cluster_centers_.astype(np.float32)
 
     bytes_data = await file.read()
-    tmp = os.path.join(base_dir, "_tmp_input")
-    os.makedirs(tmp, exist_ok=True)
-    tmp_path = os.path.join(tmp, file.filename)
-    with open(tmp_path, "wb") as f:
-        f.write(bytes_data)
-
     if modality == "image":
-        desc = extract_sift_descriptors(tmp_path)
+        desc = extract_sift_descriptors_from_bytes(bytes_data)
     else:
-        desc = extract_mfcc_descriptors(tmp_path)
-
-    os.remove(tmp_path)
+        desc = extract_mfcc_descriptors_from_bytes(bytes_data, suffix=os.path.splitext(file.filename or "")[1])
 
-    hist = quantize_descriptors(desc, centroids)
+    hist = quantize_descriptors(desc, centroids, c_half=c_half)
 
     if strategy == "sequential":
         bow_dir = os.path.join(base_dir, "bow")
@@ -87,7 +103,7 @@ async def multimedia_search(
                 "hint": "Train codebook and rebuild BoW + inverted index with the same k."
             }
 
-    return {"ok": True, "results": [{"doc_id": doc_id, "score": score} for doc_id, score in results]}
+    return AppJSONResponse({"ok": True, "results": [{"doc_id": doc_id, "score": score} for doc_id, score in results]})
 
 
 class TrainCodebookRequest(BaseModel):
@@ -98,6 +114,67 @@ class TrainCodebookRequest(BaseModel):
     global_cap: int = Field(200_000, ge=1000, le=2_000_000)
 
 
+_EXTENSIONS = {
+    "image": frozenset((".jpg", ".jpeg", ".png")),
+    "audio": frozenset((".mp3", ".wav", ".flac", ".ogg")),
+}
+
+
+def _collect_paths(data_root: str, modality: str) -> List[str]:
+    """Archivos de `data_root` (recursivo) con extensión de la modalidad.
+
+    Recorre con `os.scandir` en el mismo orden que `os.walk` (archivos del
+    directorio y luego subdirectorios, sin seguir enlaces a directorios);
+    el tipo de cada entrada viene del propio listado, sin un stat extra.
+    """
+    exts = _EXTENSIONS[modality]
+    out: List[str] = []
+    stack = [data_root]
+    while stack:
+        top = stack.pop()
+        try:
+            with os.scandir(top) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in exts and entry.is_file():
+                    out.append(entry.path)
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+    return out
+
+
+def _extract_one(path: str, modality: str) -> np.ndarray:
+    """Extrae los descriptores de un archivo (a nivel de módulo para poder enviarse a otro proceso)."""
+    if modality == "image":
+        return extract_sift_descriptors(path, max_keypoints=2000)
+    return extract_mfcc_descriptors(path, sr=22050, duration=10.0, n_mfcc=20, hop_length=512)
+
+
+def _iter_descriptors(paths: List[str], modality: str):
+    """Extrae descriptores en paralelo (un proceso por núcleo) conservando el orden de `paths`.
+
+    Es un generador: si el consumidor deja de iterar, las tareas pendientes
+    se cancelan al cerrar el pool.
+    """
+    workers = min(os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        for p in paths:
+            yield _extract_one(p, modality)
+        return
+    ex = ProcessPoolExecutor(max_workers=workers)
+    try:
+        yield from ex.map(_extract_one, paths, [modality] * len(paths), chunksize=8)
+    finally:
+        ex.shutdown(wait=True, cancel_futures=True)
+
+
 @router.post("/train-codebook")
 async def multimedia_train_codebook(
     payload: Optional[TrainCodebookRequest] = Body(None),
@@ -122,28 +199,23 @@ async def multimedia_train_codebook(
         k = k_q or 512
         per_object_cap = per_object_cap_q or 500
         global_cap = global_cap_q or 200_000
-    paths: List[str] = []
-    for root, _, files in os.walk(data_root):
-        for f in files:
-            if modality == "image" and f.lower().endswith((".jpg", ".jpeg", ".png")):
-                paths.append(os.path.join(root, f))
-            elif modality == "audio" and f.lower().endswith((".mp3", ".wav", ".flac", ".ogg")):
-                paths.append(os.path.join(root, f))
+    paths = _collect_paths(data_root, modality)
     if not paths:
         return {"ok": False, "error": "No files found in data_root"}
 
-    descs: List[np.ndarray] = []
-    if modality == "image":
-        from multimedia.features_image import batch_extract_sift
-        _, descs = batch_extract_sift(paths, max_keypoints=2000)
-    else:
-        from multimedia.features_audio import batch_extract_mfcc
-        _, descs = batch_extract_mfcc(paths, sr=22050, duration=10.0, n_mfcc=20, hop_length=512)
-    if not descs:
-        return {"ok": False, "error": "Descriptor extraction returned empty"}
-
-    samples = sample_descriptors(descs, per_object_cap=per_object_cap, global_cap=global_cap)
-    km = train_codebook(samples, k=k, batch_size=max(1000, k*2), seed=42)
+    # Orden aleatorio para que los primeros mini-batches mezclen objetos
+    shuffled = [paths[i] for i in np.random.default_rng(42).permutation(len(paths))]
+    try:
+        km = train_codebook_streaming(
+            _iter_descriptors(shuffled, modality),
+            k=k,
+            per_object_cap=per_object_cap,
+            global_cap=global_cap,
+            batch_size=max(1024, k*2),
+            seed=42,
+        )
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}
     base_dir = os.path.join("data", "multimedia", modality)
     os.makedirs(base_dir, exist_ok=True)
     dim = 128 if modality == "image" else 20
@@ -177,29 +249,22 @@ async def multimedia_build_index(
         index_type = index_type_q or "inverted"
     base_dir = os.path.join("data", "multimedia", modality)
     codebook_path = os.path.join(base_dir, "codebook.pkl")
-    km, meta = load_codebook(codebook_path)
-    centroids = km.cluster_centers_.astype(np.float32)
-
-    paths: List[str] = []
-    for root, _, files in os.walk(data_root):
-        for f in files:
-            if modality == "image" and f.lower().endswith((".jpg", ".jpeg", ".png")):
-                paths.append(os.path.join(root, f))
-            elif modality == "audio" and f.lower().endswith((".mp3", ".wav", ".flac", ".ogg")):
-                paths.append(os.path.join(root, f))
+    centroids, c_half = _get_centroids(codebook_path)
+
+    paths = _collect_paths(data_root, modality)
     if not paths:
         return {"ok": False, "error": "No files found in data_root"}
 
-    if modality == "image":
-        from multimedia.features_image import batch_extract_sift
-        doc_ids, descs = batch_extract_sift(paths, max_keypoints=2000)
-    else:
-        from multimedia.features_audio import batch_extract_mfcc
-        doc_ids, descs = batch_extract_mfcc(paths, sr=22050, duration=10.0, n_mfcc=20, hop_length=512)
+    doc_ids: List[str] = []
+    descs: List[np.ndarray] = []
+    for p, d in zip(paths, _iter_descriptors(paths, modality)):
+        if d.shape[0] > 0:
+            doc_ids.append(p)
+            descs.append(d)
     if not descs:
         return {"ok": False, "error": "Descriptor extraction returned empty"}
 
-    hists = [quantize_descriptors(d, centroids) for d in descs]
+    hists = list(quantize_batch(descs, centroids, c_half=c_half))
 
     if index_type == "bow":
         df = compute_df(hists)
@@ -228,38 +293,75 @@ async def multimedia_status(modality: Optional[str] = Query(None, regex="^(image
         return {"image": check("image"), "audio": check("audio")}
 
 
+@lru_cache(maxsize=8192)
 def _thumb_path(modality: str, doc_id: str) -> str:
+    """Ruta de la miniatura en caché (pura: el directorio se crea solo al generarla)."""
     base_dir = os.path.join("data", "multimedia", modality)
     out_dir = os.path.join(base_dir, "thumbnails")
-    os.makedirs(out_dir, exist_ok=True)
     name = hashlib.sha1(doc_id.encode("utf-8")).hexdigest() + ".jpg"
     return os.path.join(out_dir, name)
 
 
+_THUMB_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 80, cv2.IMWRITE_JPEG_PROGRESSIVE, 1, cv2.IMWRITE_JPEG_OPTIMIZE, 0]
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def _reduced_read_flag(path: str, min_side: int = 512) -> int:
+    """Flag de imread que decodifica a 1/2, 1/4 o 1/8 si el lado mayor sigue siendo >= min_side.
+
+    libjpeg escala durante la IDCT, así que una foto grande se decodifica
+    a una fracción del costo antes del INTER_AREA final.
+    """
+    if not _HAS_PIL:
+        return cv2.IMREAD_COLOR
+    try:
+        with Image.open(path) as im:
+            longest = max(im.size)
+    except Exception:
+        return cv2.IMREAD_COLOR
+    for factor, flag in _REDUCED_FLAGS:
+        if longest // factor >= min_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def _make_thumb(doc_id: str, thumb: str) -> Optional[str]:
+    """Genera la miniatura de 256x256 en `thumb`; retorna un mensaje de error o None."""
+    if not os.path.exists(doc_id):
+        return "File not found"
+    img = cv2.imread(doc_id, _reduced_read_flag(doc_id))
+    if img is None:
+        return "Failed to read image"
+    h, w = img.shape[:2]
+    target = 256
+    if h > w:
+        new_h = target
+        new_w = max(1, int(w * (target / h)))
+    else:
+        new_w = target
+        new_h = max(1, int(h * (target / w)))
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    canvas = np.zeros((target, target, 3), dtype=np.uint8)
+    y0 = (target - new_h) // 2
+    x0 = (target - new_w) // 2
+    canvas[y0:y0+new_h, x0:x0+new_w] = resized
+    os.makedirs(os.path.dirname(thumb), exist_ok=True)
+    cv2.imwrite(thumb, canvas, _THUMB_JPEG_PARAMS)
+    return None
+
+
 @router.get("/thumbnail")
 async def multimedia_thumbnail(modality: str = Query(..., regex="^(image)$"), doc_id: str = Query(...)):
-    """Genera o retorna una miniatura en caché para una imagen."""
+    """Genera o retorna una miniatura en caché para una imagen.
+
+    La decodificación y el redimensionado (OpenCV libera el GIL) corren en
+    el threadpool para no bloquear el event loop.
+    """
     thumb = _thumb_path(modality, doc_id)
     if not os.path.exists(thumb):
-        if not os.path.exists(doc_id):
-            return {"ok": False, "error": "File not found"}
-        img = cv2.imread(doc_id)
-        if img is None:
-            return {"ok": False, "error": "Failed to read image"}
-        h, w = img.shape[:2]
-        target = 256
-        if h > w:
-            new_h = target
-            new_w = max(1, int(w * (target / h)))
-        else:
-            new_w = target
-            new_h = max(1, int(h * (target / w)))
-        resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        canvas = np.zeros((target, target, 3), dtype=np.uint8)
-        y0 = (target - new_h) // 2
-        x0 = (target - new_w) // 2
-        canvas[y0:y0+new_h, x0:x0+new_w] = resized
-        cv2.imwrite(thumb, canvas)
+        error = await run_in_threadpool(_make_thumb, doc_id, thumb)
+        if error:
+            return {"ok": False, "error": error}
     return FileResponse(thumb, media_type="image/jpeg")
 
 
@@ -5,21 +5,100 @@ incluidas búsquedas espaciales con RTree.
 """
 from __future__ import annotations
 
-import os
+import logging
+import threading
 import time
-from typing import Any, Dict, List
-from fastapi import APIRouter, HTTPException, Query, Depends
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple
 
-from .schemas import RecordInsert, SpatialRange, SpatialKNN
-from .auth import get_current_user
+import anyio
+from fastapi import APIRouter, HTTPException, Header, Query, Depends
+from fastapi.responses import Response, StreamingResponse
+
+from .schemas import RecordInsert, RecordInsertBulk, SpatialRange, SpatialKNN
+from .auth import get_current_user, same_user
 from engine import DatabaseEngine
+from .deps import (
+    AppJSONResponse, disk_metrics, dumps_json, etag_matches, get_engine, get_table_or_404,
+    get_table_with_version, json_body, json_body_openapi, table_etag,
+)
 from metrics import stats
 
-router = APIRouter(prefix="/users/{user_id}/databases/{db_name}/tables/{table_name}/records", tags=["records"])
-
-
-def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
-    if user_id != current_user:
+logger = logging.getLogger(__name__)
+
+# Lecturas de página en vuelo durante los recorridos de list_records
+_PREFETCH_PAGES = 8
+
+# Resultados de /search ya serializados, por tabla y solo para su versión
+# (firma en disco) más reciente: dir de la tabla -> [versión, {(columna,
+# clave): (JSON de rows, count)}]. Cachear una versión nueva descarta las
+# entradas de la anterior, aunque la escritura no haya pasado por este
+# router (SQL, load-csv). La memoria se acota por bytes en total.
+_SEARCH_CACHE_BUDGET = 32 * 1024 * 1024
+_SEARCH_CACHE_MAX_BYTES = 256 * 1024
+_search_cache: Dict[str, list] = {}
+# (dir de la tabla, columna, clave) -> bytes de la entrada, en orden LRU
+_search_lru: "OrderedDict[Tuple[str, str, str], int]" = OrderedDict()
+_search_cache_bytes = 0
+_search_cache_lock = threading.Lock()
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+def _search_cache_get(table_dir: str, version: tuple, column: str, key: str) -> Optional[Tuple[bytes, int]]:
+    with _search_cache_lock:
+        entry = _search_cache.get(table_dir)
+        if entry is None or entry[0] != version:
+            return None
+        hit = entry[1].get((column, key))
+        if hit is not None:
+            _search_lru.move_to_end((table_dir, column, key))
+        return hit
+
+
+def _search_cache_put(table_dir: str, version: tuple, column: str, key: str, rows_json: bytes, count: int) -> None:
+    global _search_cache_bytes
+    size = len(rows_json)
+    if size > _SEARCH_CACHE_MAX_BYTES:
+        return
+    with _search_cache_lock:
+        entry = _search_cache.get(table_dir)
+        if entry is None or entry[0] != version:
+            _search_cache_drop_locked(table_dir)
+            entry = _search_cache[table_dir] = [version, {}]
+        lru_key = (table_dir, column, key)
+        _search_cache_bytes += size - _search_lru.get(lru_key, 0)
+        entry[1][(column, key)] = (rows_json, count)
+        _search_lru[lru_key] = size
+        _search_lru.move_to_end(lru_key)
+        while _search_cache_bytes > _SEARCH_CACHE_BUDGET:
+            (old_dir, old_col, old_key), old_size = _search_lru.popitem(last=False)
+            _search_cache_bytes -= old_size
+            old = _search_cache[old_dir]
+            del old[1][(old_col, old_key)]
+            if not old[1]:
+                del _search_cache[old_dir]
+
+
+def _search_cache_drop_locked(table_dir: str) -> None:
+    global _search_cache_bytes
+    entry = _search_cache.pop(table_dir, None)
+    if entry is not None:
+        for column, key in entry[1]:
+            _search_cache_bytes -= _search_lru.pop((table_dir, column, key))
+
+
+def _search_cache_drop(table_dir: str) -> None:
+    with _search_cache_lock:
+        _search_cache_drop_locked(table_dir)
+
+router = APIRouter(prefix="/users/{user_id}/databases/{db_name}/tables/{table_name}/records", tags=["records"], default_response_class=AppJSONResponse)
+
+
+async def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
+    if not same_user(user_id, current_user):
         raise HTTPException(
             status_code=403,
             detail="You don't have permission to access this user's data"
@@ -27,239 +106,322 @@ def _verify_user_access(user_id: str, current_user: str = Depends(get_current_us
     return current_user
 
 
-@router.post("", status_code=201)
-def insert_record(
+@router.post("", status_code=201, openapi_extra=json_body_openapi(RecordInsert))
+async def insert_record(
         user_id: str,
         db_name: str,
         table_name: str,
-        payload: RecordInsert,
+        payload: RecordInsert = Depends(json_body(RecordInsert)),
+        echo: Optional[Literal["fetch"]] = Query(None, description="`fetch`: releer el registro del disco para devolverlo"),
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
-    """Inserta un nuevo registro en la tabla."""
+    """Inserta un nuevo registro en la tabla.
+
+    `record` es el registro normalizado que se escribió (sin releer la
+    página); con `echo=fetch` se relee del DataFile.
+    """
+    return await anyio.to_thread.run_sync(_insert_record, engine, user_id, db_name, table_name, payload, echo)
+
+
+def _insert_record(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str, payload: RecordInsert, echo: Optional[str]) -> AppJSONResponse:
     start_time = time.perf_counter()
     stats.reset()
 
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
+    t = get_table_or_404(engine, user_id, db_name, table_name)
 
-    rid = t.insert(payload.values)
-    inserted_record = t.fetch_by_rid(rid)
+    rid, inserted_record = t.insert_returning(payload.values)
+    _search_cache_drop(t.base_dir)
+    if echo == "fetch":
+        inserted_record = t.fetch_by_rid(rid)
 
     execution_time_ms = (time.perf_counter() - start_time) * 1000
 
-    print(f"🔍 stats.counters = {stats.counters}")
-    print(f"🔍 stats.timers = {list(stats.timers.keys())}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("insert rid=%s stats.counters=%s timers=%s", rid, stats.counters, list(stats.timers))
 
     index_metrics = t.get_query_stats()
 
     response = {
         "ok": True,
-        "rid": list(rid) if isinstance(rid, tuple) else rid,
+        "rid": rid,
         "record": inserted_record,
         "execution_time_ms": round(execution_time_ms, 2),
-        "metrics": {
-            "total_disk_accesses": stats.get_counter("disk.reads") + stats.get_counter("disk.writes"),
-            "disk_reads": stats.get_counter("disk.reads"),
-            "disk_writes": stats.get_counter("disk.writes"),
-            "indexes": index_metrics
-        }
+        "metrics": disk_metrics(index_metrics)
     }
 
-    return response
+    return AppJSONResponse(response, status_code=201)
+
+
+@router.post("/bulk", status_code=201, openapi_extra=json_body_openapi(RecordInsertBulk))
+async def insert_records_bulk(
+        user_id: str,
+        db_name: str,
+        table_name: str,
+        payload: RecordInsertBulk = Depends(json_body(RecordInsertBulk)),
+        engine: DatabaseEngine = Depends(get_engine),
+        current_user: str = Depends(_verify_user_access)
+):
+    """Inserta varios registros en una sola operación.
+
+    Una apertura del DataFile, páginas escritas una vez y un solo guardado
+    de índices para todo el lote. Si algún registro es inválido no se
+    inserta ninguno.
+    """
+    return await anyio.to_thread.run_sync(_insert_records_bulk, engine, user_id, db_name, table_name, payload)
+
+
+def _insert_records_bulk(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str, payload: RecordInsertBulk) -> AppJSONResponse:
+    start_time = time.perf_counter()
+    stats.reset()
+
+    t = get_table_or_404(engine, user_id, db_name, table_name)
+
+    try:
+        rids = t.insert_many(payload.rows)
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid record: {e}")
+    _search_cache_drop(t.base_dir)
+
+    execution_time_ms = (time.perf_counter() - start_time) * 1000
+    index_metrics = t.get_query_stats()
+
+    return AppJSONResponse({
+        "ok": True,
+        "inserted": len(rids),
+        "rids": rids,
+        "execution_time_ms": round(execution_time_ms, 2),
+        "metrics": disk_metrics(index_metrics)
+    }, status_code=201)
 
 
 @router.get("")
-def list_records(
+async def list_records(
         user_id: str,
         db_name: str,
         table_name: str,
         limit: int = Query(100, ge=1, le=1000),
         offset: int = Query(0, ge=0),
+        with_count: bool = Query(True, description="Contar el total de registros (recorre toda la tabla)"),
+        stream: bool = Query(False, description="Emitir las filas a medida que se leen las páginas"),
+        if_none_match: Optional[str] = Header(None),
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
-    """Lista registros de una tabla con paginación."""
+    """Lista registros de una tabla con paginación.
+
+    Solo se decodifican las páginas que caen en la ventana
+    [offset, offset + limit); el resto solo se cuenta. Con
+    `with_count=false` el recorrido termina al completar la ventana y
+    `count` es null. Con `stream=true` el cuerpo `{"rows": [...]}` se
+    envía página a página y se corta al completar la ventana (sin `count`
+    ni métricas).
+
+    Las respuestas no streaming llevan un ETag (débil) derivado de la
+    versión en disco de la tabla y de los parámetros; si el cliente lo
+    envía en `If-None-Match` y la tabla no cambió se responde 304 sin
+    recorrer páginas.
+    """
+    if stream:
+        t = await anyio.to_thread.run_sync(get_table_or_404, engine, user_id, db_name, table_name)
+        return StreamingResponse(_stream_records(t, limit, offset), media_type="application/json")
+    return await anyio.to_thread.run_sync(_list_records, engine, user_id, db_name, table_name, limit, offset, with_count, if_none_match)
+
+
+def _list_records(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str, limit: int, offset: int, with_count: bool, if_none_match: Optional[str]) -> Response:
     start_time = time.perf_counter()
     stats.reset()
 
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
+    t, version = get_table_with_version(engine, user_id, db_name, table_name)
+    etag = table_etag(version, "list", limit, offset, with_count)
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
 
     out: List[Dict[str, Any]] = []
-    pc = t.datafile.page_count()
-    for pid in range(pc):
-        stats.inc("disk.reads")
-        page = t.datafile.read_page(pid)
-        out.extend(page.iter_records())
+    end = offset + limit
+    seen = 0
+    pages_read = 0
+    for _pid, page in t.datafile.iter_pages(prefetch=_PREFETCH_PAGES):
+        pages_read += 1
+        n = page.record_count()
+        if seen < end and seen + n > offset:
+            recs = page.iter_records()
+            out.extend(recs[max(offset - seen, 0): end - seen])
+        seen += n
+        if seen >= end and not with_count:
+            break
 
     execution_time_ms = (time.perf_counter() - start_time) * 1000
 
-    return {
-        "rows": out[offset: offset + limit],
-        "count": len(out),
+    return AppJSONResponse({
+        "rows": out,
+        "count": seen if with_count else None,
         "execution_time_ms": round(execution_time_ms, 2),
         "metrics": {
-            "page_scans": pc,
-            "disk_reads": pc
+            "page_scans": pages_read,
+            "disk_reads": stats.get_counter("disk.reads")
         }
-    }
+    }, headers={"ETag": etag})
+
+
+def _stream_records(t, limit: int, offset: int) -> Iterator[bytes]:
+    """Genera el JSON de la ventana por trozos; Starlette lo itera en el threadpool."""
+    yield b'{"rows":['
+    end = offset + limit
+    seen = 0
+    sep = b""
+    for _pid, page in t.datafile.iter_pages(prefetch=_PREFETCH_PAGES):
+        n = page.record_count()
+        if seen + n > offset:
+            recs = page.iter_records()[max(offset - seen, 0): end - seen]
+            if recs:
+                # Un solo dumps por página: la lista ya viene con sus comas
+                yield sep + dumps_json(recs)[1:-1]
+                sep = b","
+        seen += n
+        if seen >= end:
+            break
+    yield b"]}"
 
 
 @router.get("/search")
-def search_by_column(
+async def search_by_column(
         user_id: str,
         db_name: str,
         table_name: str,
         column: str = Query(..., description="Columna a buscar"),
         key: str = Query(..., description="Valor a buscar"),
+        if_none_match: Optional[str] = Header(None),
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
-    """Búsqueda exacta por columna usando índices disponibles."""
+    """Búsqueda exacta por columna usando índices disponibles (con ETag)."""
+    return await anyio.to_thread.run_sync(_search_by_column, engine, user_id, db_name, table_name, column, key, if_none_match)
+
+
+def _search_by_column(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str, column: str, key: str, if_none_match: Optional[str]) -> Response:
     start_time = time.perf_counter()
     stats.reset()
 
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
-
-    rows = t.search(column, key)
+    t, version = get_table_with_version(engine, user_id, db_name, table_name)
+    etag = table_etag(version, "search", column, key)
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+
+    # En un acierto no se toca el índice ni se re-serializan las filas; las
+    # métricas reflejan el trabajo de esta petición (cero accesos a disco).
+    hit = _search_cache_get(t.base_dir, version, column, key)
+    if hit is None:
+        rows = t.search(column, key)
+        rows_json, count = dumps_json(rows), len(rows)
+        _search_cache_put(t.base_dir, version, column, key, rows_json, count)
+    else:
+        rows_json, count = hit
     execution_time_ms = (time.perf_counter() - start_time) * 1000
     index_metrics = t.get_query_stats()
 
-    return {
-        "rows": rows,
-        "count": len(rows),
+    tail = dumps_json({
+        "count": count,
         "execution_time_ms": round(execution_time_ms, 2),
-        "metrics": {
-            "total_disk_accesses": stats.get_counter("disk.reads") + stats.get_counter("disk.writes"),
-            "disk_reads": stats.get_counter("disk.reads"),
-            "disk_writes": stats.get_counter("disk.writes"),
-            "indexes": index_metrics
-        }
-    }
+        "metrics": disk_metrics(index_metrics)
+    })
+    return Response(b'{"rows":' + rows_json + b"," + tail[1:], media_type="application/json", headers={"ETag": etag})
 
 
 @router.get("/range")
-def range_search(
+async def range_search(
         user_id: str,
         db_name: str,
         table_name: str,
         column: str = Query(...),
         begin_key: str = Query(...),
         end_key: str = Query(...),
+        if_none_match: Optional[str] = Header(None),
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
-    """Búsqueda por rango de valores en una columna."""
+    """Búsqueda por rango de valores en una columna (con ETag)."""
+    return await anyio.to_thread.run_sync(_range_search, engine, user_id, db_name, table_name, column, begin_key, end_key, if_none_match)
+
+
+def _range_search(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str, column: str, begin_key: str, end_key: str, if_none_match: Optional[str]) -> Response:
     start_time = time.perf_counter()
     stats.reset()
 
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
+    t, version = get_table_with_version(engine, user_id, db_name, table_name)
+    etag = table_etag(version, "range", column, begin_key, end_key)
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
 
     rows = t.range_search(column, begin_key, end_key)
     execution_time_ms = (time.perf_counter() - start_time) * 1000
     index_metrics = t.get_query_stats()
 
-    return {
+    return AppJSONResponse({
         "rows": rows,
         "count": len(rows),
         "execution_time_ms": round(execution_time_ms, 2),
-        "metrics": {
-            "total_disk_accesses": stats.get_counter("disk.reads") + stats.get_counter("disk.writes"),
-            "disk_reads": stats.get_counter("disk.reads"),
-            "disk_writes": stats.get_counter("disk.writes"),
-            "indexes": index_metrics
-        }
-    }
+        "metrics": disk_metrics(index_metrics)
+    }, headers={"ETag": etag})
 
 
-@router.post("/range-radius")
-def spatial_range(
+@router.post("/range-radius", openapi_extra=json_body_openapi(SpatialRange))
+async def spatial_range(
         user_id: str,
         db_name: str,
         table_name: str,
-        payload: SpatialRange,
+        payload: SpatialRange = Depends(json_body(SpatialRange)),
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
     """Búsqueda espacial por radio usando RTree."""
+    return await anyio.to_thread.run_sync(_spatial_range, engine, user_id, db_name, table_name, payload)
+
+
+def _spatial_range(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str, payload: SpatialRange) -> AppJSONResponse:
     start_time = time.perf_counter()
     stats.reset()
 
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
+    t = get_table_or_404(engine, user_id, db_name, table_name)
 
     rows = t.range_radius(payload.column, payload.center, payload.radius)
     execution_time_ms = (time.perf_counter() - start_time) * 1000
     index_metrics = t.get_query_stats()
 
-    return {
+    return AppJSONResponse({
         "rows": rows,
         "count": len(rows),
         "execution_time_ms": round(execution_time_ms, 2),
-        "metrics": {
-            "total_disk_accesses": stats.get_counter("disk.reads") + stats.get_counter("disk.writes"),
-            "disk_reads": stats.get_counter("disk.reads"),
-            "disk_writes": stats.get_counter("disk.writes"),
-            "indexes": index_metrics
-        }
-    }
+        "metrics": disk_metrics(index_metrics)
+    })
 
 
-@router.post("/knn")
-def spatial_knn(
+@router.post("/knn", openapi_extra=json_body_openapi(SpatialKNN))
+async def spatial_knn(
         user_id: str,
         db_name: str,
         table_name: str,
-        payload: SpatialKNN,
+        payload: SpatialKNN = Depends(json_body(SpatialKNN)),
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
     """Búsqueda de k-vecinos más cercanos usando RTree."""
+    return await anyio.to_thread.run_sync(_spatial_knn, engine, user_id, db_name, table_name, payload)
+
+
+def _spatial_knn(engine: DatabaseEngine, user_id: str, db_name: str, table_name: str, payload: SpatialKNN) -> AppJSONResponse:
     start_time = time.perf_counter()
     stats.reset()
 
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
+    t = get_table_or_404(engine, user_id, db_name, table_name)
 
     rows = t.knn(payload.column, payload.center, payload.k)
     execution_time_ms = (time.perf_counter() - start_time) * 1000
     index_metrics = t.get_query_stats()
 
-    return {
+    return AppJSONResponse({
         "rows": rows,
         "count": len(rows),
         "execution_time_ms": round(execution_time_ms, 2),
-        "metrics": {
-            "total_disk_accesses": stats.get_counter("disk.reads") + stats.get_counter("disk.writes"),
-            "disk_reads": stats.get_counter("disk.reads"),
-            "disk_writes": stats.get_counter("disk.writes"),
-            "indexes": index_metrics
-        }
-    }
\ No newline at end of file
+        "metrics": disk_metrics(index_metrics)
+    })
@@ -6,7 +6,28 @@ operaciones espaciales, consultas SQL y carga de CSV.
 from __future__ import annotations
 
 from typing import Any, Dict, List, Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+__all__ = [
+    "UserCreate",
+    "UserLogin",
+    "User",
+    "Token",
+    "DatabaseCreate",
+    "DatabaseOut",
+    "IndexDecl",
+    "TableCreate",
+    "TableOut",
+    "TableSchemaOut",
+    "TableStatsOut",
+    "RecordInsert",
+    "RecordInsertBulk",
+    "RecordsQuery",
+    "SpatialRange",
+    "SpatialKNN",
+    "SQLQuery",
+    "CSVLoad",
+]
 
 
 class UserCreate(BaseModel):
@@ -53,23 +74,32 @@ class TableStatsOut(BaseModel):
     indexes: Dict[str, Any]
 
 
+# Payloads de los endpoints calientes: campos extra se rechazan (422) en
+# vez de copiarse al modelo.
 class RecordInsert(BaseModel):
+    model_config = ConfigDict(extra="forbid")
     values: Dict[str, Any]
 
+class RecordInsertBulk(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    rows: List[Dict[str, Any]] = Field(..., min_length=1)
+
 class RecordsQuery(BaseModel):
     limit: Optional[int] = 100
     offset: Optional[int] = 0
 
 
 class SpatialRange(BaseModel):
+    model_config = ConfigDict(extra="forbid")
     column: str
-    center: List[float]
-    radius: float
+    center: List[float] = Field(..., min_length=2)
+    radius: float = Field(..., ge=0)
 
 class SpatialKNN(BaseModel):
+    model_config = ConfigDict(extra="forbid")
     column: str
-    center: List[float]
-    k: int
+    center: List[float] = Field(..., min_length=2)
+    k: int = Field(..., ge=1)
 
 
 class SQLQuery(BaseModel):
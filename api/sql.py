@@ -7,21 +7,25 @@ por columna. Integra con el parser y motor de bases de datos.
 """
 from __future__ import annotations
 
-import os
+import logging
+import re
 import time
 from fastapi import APIRouter, HTTPException, Depends
 
 from .schemas import SQLQuery
-from .auth import get_current_user
+from .auth import get_current_user, same_user
 from parser import run_sql
 from metrics import stats
 from engine import DatabaseEngine
+from .deps import AppJSONResponse, disk_metrics, get_engine, get_table_or_404, open_database
 
-router = APIRouter(prefix="/users/{user_id}/databases/{db_name}", tags=["sql"])
+logger = logging.getLogger(__name__)
 
+router = APIRouter(prefix="/users/{user_id}/databases/{db_name}", tags=["sql"], default_response_class=AppJSONResponse)
 
-def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
-    if user_id != current_user:
+
+async def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
+    if not same_user(user_id, current_user):
         raise HTTPException(
             status_code=403,
             detail="You don't have permission to access this user's data"
@@ -29,98 +33,46 @@ def _verify_user_access(user_id: str, current_user: str = Depends(get_current_us
     return current_user
 
 
-def _get_active_indexes(root: str, user_id: str, db_name: str, sql: str) -> dict:
-    try:
-        # Extraer nombre de tabla de SQL (simplificado)
-        sql_upper = sql.upper()
-
-        if "FROM" in sql_upper:
-            parts = sql_upper.split("FROM")[1].strip().split()
-            table_name = parts[0].strip().rstrip(";")
-        elif "INTO" in sql_upper:
-            parts = sql_upper.split("INTO")[1].strip().split()
-            table_name = parts[0].strip().rstrip(";")
-        elif "TABLE" in sql_upper and "CREATE" not in sql_upper:
-            parts = sql_upper.split("TABLE")[1].strip().split()
-            table_name = parts[0].strip().rstrip(";")
-        else:
-            return {}
-
-        engine = DatabaseEngine(root)
-        db = engine.get_database(user_id, db_name)
-        if not db:
-            return {}
-
-        t = db.get_table(table_name.lower())
-        if not t:
-            return {}
+# Primera tabla nombrada tras FROM/INTO/UPDATE/TABLE (sin distinguir mayúsculas)
+_TBL_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
 
-        # Mapa columna -> tipo de índice
-        return {col: idx_type.name.lower() for col, idx_type in t.schema.indexes.items()}
 
+def _get_active_indexes(engine: DatabaseEngine, user_id: str, db_name: str, sql: str) -> dict:
+    m = _TBL_RE.search(sql)
+    if not m:
+        return {}
+    try:
+        t = get_table_or_404(engine, user_id, db_name, m.group(1).lower())
+    except HTTPException:
+        return {}
     except Exception as e:
-        print(f"⚠️ No se pudo detectar índices activos: {e}")
+        logger.warning("No se pudo detectar índices activos: %s", e)
         return {}
 
+    # Mapa columna -> tipo de índice
+    return {col: idx_type.name.lower() for col, idx_type in t.schema.indexes.items()}
+
+
+# Operaciones reportadas por tipo de índice (el R-Tree añade las espaciales)
+_OPS = ("search", "range", "add", "remove")
+_RTREE_OPS = ("range_radius", "knn")
+
 
 def _build_index_metrics(active_indexes: dict) -> dict:
     if not active_indexes:
         return {}
 
+    snap = stats.snapshot()
     index_metrics = {}
 
     for col_name, idx_type in active_indexes.items():
         # Recopilar métricas por operación
         operations = {}
-
-        search_count = stats.get_counter(f"index.{idx_type}.search")
-        search_time = stats.get_time_ms(f"index.{idx_type}.search.time")
-        if search_count > 0 or search_time > 0:
-            operations["search"] = {
-                "count": search_count,
-                "time_ms": round(search_time, 3)
-            }
-
-        range_count = stats.get_counter(f"index.{idx_type}.range")
-        range_time = stats.get_time_ms(f"index.{idx_type}.range.time")
-        if range_count > 0 or range_time > 0:
-            operations["range"] = {
-                "count": range_count,
-                "time_ms": round(range_time, 3)
-            }
-
-        add_count = stats.get_counter(f"index.{idx_type}.add")
-        add_time = stats.get_time_ms(f"index.{idx_type}.add.time")
-        if add_count > 0 or add_time > 0:
-            operations["add"] = {
-                "count": add_count,
-                "time_ms": round(add_time, 3)
-            }
-
-        remove_count = stats.get_counter(f"index.{idx_type}.remove")
-        remove_time = stats.get_time_ms(f"index.{idx_type}.remove.time")
-        if remove_count > 0 or remove_time > 0:
-            operations["remove"] = {
-                "count": remove_count,
-                "time_ms": round(remove_time, 3)
-            }
-
-        if idx_type == "rtree":
-            radius_count = stats.get_counter(f"index.{idx_type}.range_radius")
-            radius_time = stats.get_time_ms(f"index.{idx_type}.range_radius.time")
-            if radius_count > 0 or radius_time > 0:
-                operations["range_radius"] = {
-                    "count": radius_count,
-                    "time_ms": round(radius_time, 3)
-                }
-
-            knn_count = stats.get_counter(f"index.{idx_type}.knn")
-            knn_time = stats.get_time_ms(f"index.{idx_type}.knn.time")
-            if knn_count > 0 or knn_time > 0:
-                operations["knn"] = {
-                    "count": knn_count,
-                    "time_ms": round(knn_time, 3)
-                }
+        ops = _OPS + _RTREE_OPS if idx_type == "rtree" else _OPS
+        for op in ops:
+            count, time_ms = snap.get(f"index.{idx_type}.{op}", (0, 0.0))
+            if count or time_ms:
+                operations[op] = {"count": count, "time_ms": round(time_ms, 3)}
 
         if operations:
             index_metrics[col_name] = {
@@ -136,54 +88,45 @@ def sql_query(
         user_id: str,
         db_name: str,
         payload: SQLQuery,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ):
-    root = os.path.dirname(os.path.dirname(__file__))
+    root = engine.root_dir
 
     start_time = time.perf_counter()
     stats.reset()
 
-    # Log básico de ejecución
-    print(f"🔍 SQL: Ejecutando query: {payload.sql}")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("SQL: ejecutando query: %s", payload.sql)
 
     try:
-        active_indexes = _get_active_indexes(root, user_id, db_name, payload.sql)
-        print(f"🔍 SQL: Índices activos detectados: {active_indexes}")
+        active_indexes = _get_active_indexes(engine, user_id, db_name, payload.sql)
+        if debug:
+            logger.debug("SQL: índices activos detectados: %s", active_indexes)
 
-        out = run_sql(root, user_id, db_name, payload.sql)
+        db = open_database(engine, user_id, db_name)
+        out = run_sql(root, user_id, db_name, payload.sql, engine=engine, db=db)
 
         execution_time_ms = (time.perf_counter() - start_time) * 1000
 
-        print(f"🔍 SQL: Query ejecutada exitosamente")
-        print(f"🔍 SQL: stats.counters = {stats.counters}")
+        if debug:
+            logger.debug("SQL: stats.counters = %s", stats.counters)
 
         index_metrics = _build_index_metrics(active_indexes)
 
         if isinstance(out, dict):
             out["execution_time_ms"] = round(execution_time_ms, 2)
-            out["metrics"] = {
-                "total_disk_accesses": stats.get_counter("disk.reads") + stats.get_counter("disk.writes"),
-                "disk_reads": stats.get_counter("disk.reads"),
-                "disk_writes": stats.get_counter("disk.writes"),
-                "indexes": index_metrics
-            }
+            out["metrics"] = disk_metrics(index_metrics)
         else:
             out = {
                 "result": out,
                 "execution_time_ms": round(execution_time_ms, 2),
-                "metrics": {
-                    "total_disk_accesses": stats.get_counter("disk.reads") + stats.get_counter("disk.writes"),
-                    "disk_reads": stats.get_counter("disk.reads"),
-                    "disk_writes": stats.get_counter("disk.writes"),
-                    "indexes": index_metrics
-                }
+                "metrics": disk_metrics(index_metrics)
             }
 
-        print(f"🔍 SQL: Respuesta final: {out}")
         return out
 
     except Exception as e:
-        print(f"❌ SQL ERROR: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.debug("SQL error", exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
@@ -5,21 +5,22 @@ incluida la configuración de columnas e índices.
 """
 from __future__ import annotations
 
-import os
 from typing import Any, Dict, List
 from fastapi import APIRouter, HTTPException, Depends, status
 
 from .schemas import TableCreate, TableOut, TableSchemaOut, TableStatsOut
-from .auth import get_current_user
+from .auth import get_current_user, same_user
 from engine import DatabaseEngine
+from .deps import AppJSONResponse, get_engine, get_table_or_404, invalidate_tables
 from core.schema import Column, TableSchema
 from core.types import ColumnType, IndexType
+from indexes.ISAM import ISAM
 
-router = APIRouter(prefix="/users/{user_id}/databases/{db_name}/tables", tags=["tables"])
+router = APIRouter(prefix="/users/{user_id}/databases/{db_name}/tables", tags=["tables"], default_response_class=AppJSONResponse)
 
 
-def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
-    if user_id != current_user:
+async def _verify_user_access(user_id: str, current_user: str = Depends(get_current_user)):
+    if not same_user(user_id, current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have permission to access this user's data"
@@ -32,10 +33,10 @@ def create_table(
         user_id: str,
         db_name: str,
         payload: TableCreate,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ) -> TableOut:
     """Crea una nueva tabla con el esquema e índices especificados."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
     db = engine.get_database(user_id, db_name)
 
     if db is None:
@@ -91,6 +92,8 @@ def create_table(
                 schema.add_index(idx.column, IndexType.BTREE)
 
     table = db.create_table(schema)
+    # Una tabla recreada con el mismo nombre no debe servirse desde la caché
+    invalidate_tables(table.base_dir)
     return TableOut(name=table.schema.name)
 
 
@@ -98,10 +101,10 @@ def create_table(
 def list_tables(
         user_id: str,
         db_name: str,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ) -> List[TableOut]:
     """Lista todas las tablas de una base de datos."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
     db = engine.get_database(user_id, db_name)
 
     if db is None:
@@ -115,18 +118,11 @@ def get_table(
         user_id: str,
         db_name: str,
         table_name: str,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ) -> TableOut:
     """Obtiene información de una tabla específica."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
+    t = get_table_or_404(engine, user_id, db_name, table_name)
 
     return TableOut(name=t.schema.name)
 
@@ -136,18 +132,11 @@ def get_schema(
         user_id: str,
         db_name: str,
         table_name: str,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ) -> TableSchemaOut:
     """Obtiene el esquema completo de una tabla (columnas e índices)."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
+    t = get_table_or_404(engine, user_id, db_name, table_name)
 
     cols = []
     for c in t.schema.columns:
@@ -168,83 +157,73 @@ def get_stats(
         user_id: str,
         db_name: str,
         table_name: str,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(_verify_user_access)
 ) -> TableStatsOut:
     """Obtiene estadísticas de los índices de una tabla."""
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
-
-    t = db.get_table(table_name)
-    if t is None:
-        raise HTTPException(status_code=404, detail="Table not found")
+    t = get_table_or_404(engine, user_id, db_name, table_name)
 
     idx_stats: Dict[str, Any] = {}
-    for name, idx in t.indexes.items():
-        try:
-            idx_stats[name] = idx.get_stats()
-        except Exception:
-            idx_stats[name] = {"error": "no stats"}
+    with t.lock:
+        for name, idx in t.indexes.items():
+            try:
+                idx_stats[name] = idx.get_stats()
+            except Exception:
+                idx_stats[name] = {"error": "no stats"}
 
     return TableStatsOut(name=table_name, indexes=idx_stats)
 
 
 @router.get("/{table_name}/indexes/{column_name}/stats")
-async def get_index_stats(
+def get_index_stats(
         user_id: str,
         db_name: str,
         table_name: str,
         column_name: str,
+        engine: DatabaseEngine = Depends(get_engine),
         current_user: str = Depends(get_current_user)
 ):
     """Obtiene estadísticas detalladas de un índice específico."""
-    if user_id != current_user:
+    if not same_user(user_id, current_user):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    db = engine.get_database(user_id, db_name)
-    if not db:
-        raise HTTPException(status_code=404, detail="Database not found")
-
-    table = db.get_table(table_name)
-    if not table:
-        raise HTTPException(status_code=404, detail="Table not found")
+    table = get_table_or_404(engine, user_id, db_name, table_name)
 
     if column_name not in table.indexes:
         raise HTTPException(status_code=404, detail=f"No index found for column '{column_name}'")
 
     idx = table.indexes[column_name]
 
-    stats = idx.get_stats()
-
-    # Info adicional para ISAM
-    if hasattr(idx, 'keys') and hasattr(idx, 'pages'):
-        from indexes.ISAM import ISAM
-        if isinstance(idx, ISAM):
-            stats['index_keys_sample'] = idx.keys[:10]
-            stats['page_details'] = []
-
-            for i, page in enumerate(idx.pages[:5]):
-                page_info = {
-                    'page_index': i,
-                    'records_count': len(page.records),
-                    'is_full': page.is_full(),
-                    'sample_records': page.records[:3]
-                }
-                stats['page_details'].append(page_info)
-            stats['overflow_details'] = {}
-            for page_idx, overflow_head in list(idx.overflow_chains.items())[:3]:
-                chain_length = 0
-                current = overflow_head
-                while current:
-                    chain_length += 1
-                    current = current.next_overflow
-                stats['overflow_details'][f'page_{page_idx}'] = {
-                    'chain_length': chain_length,
-                    'records_in_first': len(overflow_head.records)
-                }
+    # Los índices se leen bajo el lock de la tabla (ver Table.lock); por eso
+    # este handler es síncrono y no bloquea el event loop esperándolo
+    with table.lock:
+        stats = idx.get_stats()
+
+        # Info adicional para ISAM
+        if hasattr(idx, 'keys') and hasattr(idx, 'pages'):
+            if isinstance(idx, ISAM):
+                stats['index_keys_sample'] = idx.keys[:10]
+                stats['page_details'] = []
+
+                for i, page in enumerate(idx.pages[:5]):
+                    page_info = {
+                        'page_index': i,
+                        'records_count': len(page.records),
+                        'is_full': page.is_full(),
+                        'sample_records': page.records[:3]
+                    }
+                    stats['page_details'].append(page_info)
+                stats['overflow_details'] = {}
+                for page_idx, overflow_head in list(idx.overflow_chains.items())[:3]:
+                    chain_length = 0
+                    current = overflow_head
+                    while current:
+                        chain_length += 1
+                        current = current.next_overflow
+                    stats['overflow_details'][f'page_{page_idx}'] = {
+                        'chain_length': chain_length,
+                        'records_in_first': len(overflow_head.records)
+                    }
 
     return {
         "column": column_name,
@@ -9,27 +9,30 @@ from __future__ import annotations
 
 import os
 import json
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional
 from fastapi import APIRouter, HTTPException, Depends, status
 from datetime import timedelta
+from starlette.concurrency import run_in_threadpool
 
 from .schemas import UserCreate, UserLogin, User, Token
 from .auth import (
-    get_password_hash,
-    verify_password,
+    aget_password_hash,
+    averify_password,
     create_access_token,
     get_current_user,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from engine import DatabaseEngine
+from .deps import AppJSONResponse, get_engine
 
-router = APIRouter(prefix="/users", tags=["users"])
+router = APIRouter(prefix="/users", tags=["users"], default_response_class=AppJSONResponse)
 
-# Funciones auxiliares de persistencia
-
-def _users_root(engine: DatabaseEngine) -> str:
-    return os.path.join(engine.root_dir, "data", "users")
+# Serializa cada lectura-modificación-escritura de users.json: sin él dos
+# registros simultáneos cargan el mismo archivo y el último pisa al otro.
+_users_lock = threading.Lock()
 
+# Funciones auxiliares de persistencia
 
 def _users_db_path(engine: DatabaseEngine) -> str:
     return os.path.join(engine.root_dir, "data", "users.json")
@@ -46,30 +49,54 @@ def _load_users_db(engine: DatabaseEngine) -> Dict:
 def _save_users_db(engine: DatabaseEngine, users_db: Dict):
     path = _users_db_path(engine)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as f:
+    # Archivo temporal + rename: los lectores sin lock nunca ven un JSON a medias
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
         json.dump(users_db, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _add_user(engine: DatabaseEngine, username: str, hashed_password: str) -> bool:
+    """Agrega el usuario si no existe; retorna False si el nombre ya está tomado."""
+    with _users_lock:
+        users_db = _load_users_db(engine)
+        if username in users_db:
+            return False
+        users_db[username] = {"username": username, "hashed_password": hashed_password}
+        _save_users_db(engine, users_db)
+        return True
+
+
+def _replace_hash(engine: DatabaseEngine, username: str, old_hash: str, new_hash: str) -> None:
+    """Reemplaza el hash del usuario solo si nadie lo cambió mientras tanto."""
+    with _users_lock:
+        users_db = _load_users_db(engine)
+        user_data = users_db.get(username)
+        if user_data and user_data.get('hashed_password') == old_hash:
+            user_data['hashed_password'] = new_hash
+            _save_users_db(engine, users_db)
+
+
+def _get_user_data(engine: DatabaseEngine, username: str) -> Optional[Dict]:
+    return _load_users_db(engine).get(username)
 
 # Endpoints públicos (sin autenticación)
 
 @router.post("/register", response_model=User, status_code=201)
-def register(payload: UserCreate) -> User:
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    users_db = _load_users_db(engine)
-
-    if payload.username in users_db:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already exists"
-        )
+async def register(payload: UserCreate, engine: DatabaseEngine = Depends(get_engine)) -> User:
+    taken = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Username already exists"
+    )
+    # Chequeo temprano para no pagar el hash; el definitivo va bajo el lock
+    if await run_in_threadpool(_get_user_data, engine, payload.username) is not None:
+        raise taken
 
-    hashed_password = get_password_hash(payload.password)
-    users_db[payload.username] = {
-        "username": payload.username,
-        "hashed_password": hashed_password
-    }
-    _save_users_db(engine, users_db)
+    hashed_password = await aget_password_hash(payload.password)
+    if not await run_in_threadpool(_add_user, engine, payload.username, hashed_password):
+        raise taken
 
-    user_dir = os.path.join(_users_root(engine), payload.username)
+    user_dir = os.path.join(engine.users_root, payload.username)
     os.makedirs(os.path.join(user_dir, "databases"), exist_ok=True)
 
     default_db_dir = os.path.join(user_dir, "databases", "default")
@@ -79,22 +106,25 @@ def register(payload: UserCreate) -> User:
 
 
 @router.post("/login", response_model=Token)
-def login(payload: UserLogin) -> Token:
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
-    users_db = _load_users_db(engine)
-
-    user_data = users_db.get(payload.username)
+async def login(payload: UserLogin, engine: DatabaseEngine = Depends(get_engine)) -> Token:
+    user_data = await run_in_threadpool(_get_user_data, engine, payload.username)
     if not user_data:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
 
-    if not verify_password(payload.password, user_data['hashed_password']):
+    ok, new_hash = await averify_password(payload.password, user_data['hashed_password'])
+    if not ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
+    if new_hash:
+        # Migración transparente de hashes antiguos (bcrypt -> argon2)
+        await run_in_threadpool(
+            _replace_hash, engine, payload.username, user_data['hashed_password'], new_hash
+        )
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -113,15 +143,13 @@ def get_me(current_user: str = Depends(get_current_user)) -> User:
 # Endpoints de administración (públicos)
 
 @router.get("", response_model=List[User])
-def list_users() -> List[User]:
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
+def list_users(engine: DatabaseEngine = Depends(get_engine)) -> List[User]:
     users_db = _load_users_db(engine)
     return [User(username=username) for username in users_db.keys()]
 
 
 @router.get("/{username}", response_model=User)
-def get_user(username: str) -> User:
-    engine = DatabaseEngine(os.path.dirname(os.path.dirname(__file__)))
+def get_user(username: str, engine: DatabaseEngine = Depends(get_engine)) -> User:
     users_db = _load_users_db(engine)
 
     if username not in users_db:
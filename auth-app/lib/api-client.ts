@@ -231,7 +231,7 @@ export async function uploadCSV(
   dbName: string,
   tableName: string,
   file: File,
-): Promise<{ ok: boolean; inserted: number }> {
+): Promise<{ ok: boolean; inserted: number; spimi_status?: "scheduled" | "failed" | null }> {
   const formData = new FormData()
   formData.append("file", file)
 
@@ -5,13 +5,21 @@ inserción clustered y tracking de métricas de I/O.
 """
 from __future__ import annotations
 
+import contextvars
+import functools
+import itertools
 import os
 import struct
-from typing import Any, List, Tuple, Optional, Callable
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Optional, Callable
 
+import disk_manager
 from disk_manager import (
     DiskManager,
     PAGE_SIZE_DEFAULT,
+    count_records,
     pack_record as default_pack,
     unpack_records as default_unpack,
 )
@@ -69,10 +77,17 @@ class DataPage:
 
     def iter_records(self) -> List[Any]:
         """Retorna todos los registros almacenados en la porción usada de la página."""
-        buf = bytes(self.data[: self.used_bytes])
+        # Una sola copia (vía memoryview) en vez de slice de bytearray + bytes()
+        buf = bytes(memoryview(self.data)[: self.used_bytes])
         recs, used = self.unpack(buf)
         return recs
 
+    def record_count(self) -> int:
+        """Número de registros de la página; con el formato por defecto no decodifica."""
+        if self.unpack is default_unpack:
+            return count_records(memoryview(self.data)[: self.used_bytes])
+        return len(self.iter_records())
+
     def pack_page(self) -> bytes:
         """Serializa la página completa incluyendo header y datos."""
         header = struct.pack(self.HEADER_FMT, self.used_bytes, self.next_page_id)
@@ -107,6 +122,169 @@ class DataPage:
         return page
 
 
+def _count_disk_reads(n: int) -> None:
+    """Cuenta `n` páginas leídas sin pasar por `DiskManager.read_page`.
+
+    Suma al mismo contador global de DiskManager y a la métrica
+    `disk.reads` de la petición, que es la que reportan las consultas.
+    """
+    disk_manager.disk_reads += n
+    stats.inc("disk.reads", n)
+
+
+def _file_sig(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class _PageCache:
+    """Caché LRU de páginas crudas compartida por todos los DataFile del proceso.
+
+    Guarda los bytes de cada página (inmutables: cada acierto construye su
+    propia DataPage) bajo (ruta, page_id). Las escrituras de DataFile
+    invalidan explícitamente y suben la generación del archivo, de modo que
+    una lectura que corrió en paralelo a la escritura no repuebla la caché
+    con datos viejos.
+
+    La coherencia solo está garantizada para escrituras hechas con DataFile
+    dentro de este proceso (la API corre en uno solo). La firma de `stat`
+    con la que se llenó cada archivo detecta además un archivo recreado o
+    que cambió de tamaño, pero no la reescritura en sitio de una página por
+    otro proceso dentro de la resolución del mtime.
+    """
+
+    def __init__(self, max_pages: int) -> None:
+        self.max_pages = max_pages
+        # ruta -> [firma, generación, {page_id: bytes}]
+        self._files: Dict[str, list] = {}
+        self._lru: "OrderedDict[Tuple[str, int], None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, page_id: int, sig: tuple) -> Tuple[Optional[bytes], int]:
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                entry = self._files[path] = [sig, 0, {}]
+            elif entry[0] != sig:
+                entry[0] = sig
+                entry[2].clear()
+            buf = entry[2].get(page_id)
+            if buf is not None:
+                self._lru.move_to_end((path, page_id))
+            return buf, entry[1]
+
+    def put(self, path: str, page_id: int, sig: tuple, gen: int, buf: bytes) -> None:
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None or entry[0] != sig or entry[1] != gen:
+                return
+            entry[2][page_id] = buf
+            self._lru[(path, page_id)] = None
+            self._lru.move_to_end((path, page_id))
+            while len(self._lru) > self.max_pages:
+                (old_path, old_pid), _ = self._lru.popitem(last=False)
+                old = self._files.get(old_path)
+                if old is not None:
+                    old[2].pop(old_pid, None)
+
+    def invalidate(self, path: str) -> None:
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None:
+                entry[0] = None
+                entry[1] += 1
+                entry[2].clear()
+
+
+# 2048 páginas de 16 KiB: hasta 32 MiB de datos calientes
+_PAGE_CACHE = _PageCache(max_pages=2048)
+
+
+# Páginas por lectura contigua en los recorridos (ver `DataFile.read_window`)
+_SCAN_WINDOW_PAGES = 32
+
+
+_slabs = threading.local()
+
+# Pool de hilos de E/S compartido por todos los recorridos del proceso. Sus
+# hilos viven entre recorridos, así que el slab de cada uno (a lo sumo
+# `_SCAN_WINDOW_PAGES` páginas) se reutiliza de un recorrido al siguiente.
+_IO_WORKERS = 8
+_io_pool: Optional[ThreadPoolExecutor] = None
+_io_pool_lock = threading.Lock()
+
+
+def _get_io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    pool = _io_pool
+    if pool is None:
+        with _io_pool_lock:
+            if _io_pool is None:
+                _io_pool = ThreadPoolExecutor(max_workers=_IO_WORKERS, thread_name_prefix="datafile-io")
+            pool = _io_pool
+    return pool
+
+
+def _reset_io_pool_after_fork() -> None:
+    # Un hijo de fork (pools de procesos SPIMI) hereda el objeto pero no sus
+    # hilos: con el pool heredado, el primer recorrido del hijo no avanzaría
+    global _io_pool, _io_pool_lock
+    _io_pool = None
+    _io_pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_io_pool_after_fork)
+
+
+def _window_slab(nbytes: int) -> memoryview:
+    """Buffer de lectura del hilo actual, de al menos `nbytes`.
+
+    Los hilos de `_get_io_pool` son persistentes: el mismo slab sirve a
+    todas las ventanas que lee cada hilo, en este recorrido y los siguientes.
+    """
+    slab = getattr(_slabs, "buf", None)
+    if slab is None or len(slab) < nbytes:
+        slab = _slabs.buf = bytearray(nbytes)
+    return memoryview(slab)[:nbytes]
+
+
+def _prefetched(fn: Callable[[Any], Any], items: Iterable[Any], workers: int) -> Iterator[Any]:
+    """`map(fn, items)` con hasta `workers` llamadas en vuelo, en orden.
+
+    Las llamadas corren en el pool de E/S compartido (`_get_io_pool`), cada
+    una en una copia del contexto del llamador para que sus métricas caigan
+    en el ámbito de la petición (ver metrics.stats). `fn` no debe esperar a
+    otras tareas del pool.
+    """
+    it = iter(items)
+    ex = _get_io_pool()
+
+    def submit(item: Any):
+        return ex.submit(contextvars.copy_context().run, fn, item)
+
+    futs = deque(submit(item) for item in itertools.islice(it, max(1, workers)))
+    while futs:
+        result = futs.popleft().result()
+        for item in itertools.islice(it, 1):
+            futs.append(submit(item))
+        yield result
+
+
+def _invalidates_pages(method):
+    """Invalida las páginas cacheadas del archivo al terminar una escritura."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _PAGE_CACHE.invalidate(self.path)
+    return wrapper
+
+
 class DataFile:
     """
     Abstracción de alto nivel sobre DiskManager para trabajar con
@@ -135,14 +313,89 @@ class DataFile:
                 return val
 
     def read_page(self, page_id: int) -> DataPage:
-        """Lee una página del disco y la deserializa como DataPage."""
+        """Lee una página (de la caché de páginas o del disco) como DataPage.
+
+        Cuenta como lectura de disco (`disk.reads`) también en un acierto de
+        caché: las métricas de cada consulta miden páginas accedidas.
+        """
         with stats.timer("io.read_page"):
-            with DiskManager(self.path, page_size=self.page_size) as dm:
-                stats.inc("io.diskmanager.opens")
-                buf = dm.read_page(page_id)
-                stats.inc("io.read_page.calls")
+            sig = _file_sig(self.path)
+            buf, gen = _PAGE_CACHE.get(self.path, page_id, sig) if sig else (None, 0)
+            if buf is not None:
+                # Un acierto sigue siendo una lectura lógica de página
+                stats.inc("io.page_cache.hits")
+                _count_disk_reads(1)
+            else:
+                with DiskManager(self.path, page_size=self.page_size) as dm:
+                    stats.inc("io.diskmanager.opens")
+                    buf = dm.read_page(page_id)
+                    stats.inc("io.read_page.calls")
+                stats.inc("disk.reads")
+                if sig:
+                    _PAGE_CACHE.put(self.path, page_id, sig, gen, bytes(buf))
             return DataPage.unpack_page(buf, pack=self.pack, unpack=self.unpack)
 
+    def read_window(self, start: int, stop: int) -> List[DataPage]:
+        """Lee las páginas contiguas [start, stop) con una sola lectura.
+
+        Un solo open (solo lectura, sin el fsync de cierre de DiskManager) y
+        un solo `readinto` de (stop - start) páginas sobre el slab del hilo,
+        que luego se corta en memoria: una syscall por ventana en vez de
+        varias por página, y sin asignar un buffer nuevo por ventana.
+        """
+        n = stop - start
+        if n <= 0:
+            return []
+        ps = self.page_size
+        mv = _window_slab(n * ps)
+        with stats.timer("io.read_window"):
+            with open(self.path, "rb", buffering=0) as f:
+                f.seek(start * ps)
+                got = f.readinto(mv)
+            stats.inc("io.read_window.calls")
+        if got != n * ps:
+            raise ValueError(f"page_id fuera de rango: {start + got // ps}")
+        _count_disk_reads(n)
+        # unpack_page copia cada página a su propio bytearray: el slab se
+        # puede reutilizar en la siguiente ventana de este hilo
+        return [
+            DataPage.unpack_page(mv[i * ps:(i + 1) * ps], pack=self.pack, unpack=self.unpack)
+            for i in range(n)
+        ]
+
+    def iter_pages(self, start: int = 0, stop: Optional[int] = None, prefetch: int = 0) -> Iterator[Tuple[int, DataPage]]:
+        """Itera (page_id, página) en orden sobre [start, stop).
+
+        Con `prefetch > 0` el rango se lee por ventanas contiguas de
+        min(prefetch, `_SCAN_WINDOW_PAGES`) páginas (`read_window`); dos
+        ventanas quedan en vuelo en el pool de E/S compartido mientras el
+        llamador consume la actual.
+        """
+        if stop is None:
+            stop = self.page_count()
+        if prefetch <= 0 or stop - start <= 1:
+            for pid in range(start, stop):
+                yield pid, self.read_page(pid)
+            return
+        window = max(1, min(prefetch, _SCAN_WINDOW_PAGES))
+        bounds = [(lo, min(lo + window, stop)) for lo in range(start, stop, window)]
+        pid = start
+        for pages in _prefetched(lambda b: self.read_window(*b), bounds, workers=2):
+            for page in pages:
+                yield pid, page
+                pid += 1
+
+    def read_pages(self, page_ids: Iterable[int], workers: int = 4) -> Iterator[DataPage]:
+        """Lee las páginas `page_ids` en paralelo y las entrega en el mismo orden.
+
+        Hasta `workers` lecturas quedan en vuelo en el pool de E/S (cada
+        `read_page` abre su propio descriptor y la E/S libera el GIL), así
+        que el disco trabaja mientras el llamador decodifica la página
+        actual. La cola es acotada: la memoria no crece con la tabla.
+        """
+        return _prefetched(self.read_page, page_ids, workers)
+
+    @_invalidates_pages
     def write_page(self, page_id: int, page: DataPage) -> None:
         """Escribe una página serializada al disco."""
         with stats.timer("io.write_page"):
@@ -153,6 +406,7 @@ class DataFile:
                 dm.flush()
                 stats.inc("io.flush.calls")
 
+    @_invalidates_pages
     def append_page(self, page: DataPage) -> int:
         """Añade una nueva página al final del archivo y retorna su ID."""
         with stats.timer("io.append_page"):
@@ -164,6 +418,29 @@ class DataFile:
                 stats.inc("io.flush.calls")
                 return pid
 
+    def mark(self) -> Tuple[int, Optional[bytes]]:
+        """Punto de restauración para `truncate_to`: (páginas, bytes de la última página).
+
+        Las inserciones clustered solo escriben en la última página o
+        agregan páginas nuevas, así que esto basta para deshacerlas.
+        """
+        with DiskManager(self.path, page_size=self.page_size) as dm:
+            stats.inc("io.diskmanager.opens")
+            pc = dm.page_count()
+            return pc, (dm.read_page(pc - 1) if pc else None)
+
+    @_invalidates_pages
+    def truncate_to(self, mark: Tuple[int, Optional[bytes]]) -> None:
+        """Deshace las inserciones posteriores a `mark()`."""
+        pc, last = mark
+        with open(self.path, "r+b", buffering=0) as f:
+            f.truncate(pc * self.page_size)
+            if last is not None:
+                f.seek((pc - 1) * self.page_size)
+                f.write(last)
+            os.fsync(f.fileno())
+
+    @_invalidates_pages
     def insert_clustered(self, record: Any) -> Tuple[int, int]:
         """
         Inserta un registro usando estrategia clustered: intenta añadir
@@ -206,6 +483,57 @@ class DataFile:
                 slot = len(new_page.iter_records()) - 1
                 return pid, max(slot, 0)
 
+    @_invalidates_pages
+    def insert_many_clustered(self, records: List[Any]) -> List[Tuple[int, int]]:
+        """Como `insert_clustered` para varios registros con una sola apertura.
+
+        Las páginas se llenan en memoria y cada una se escribe una única vez
+        (al llenarse o al terminar), con un solo flush al final.
+        """
+        rids: List[Tuple[int, int]] = []
+        if not records:
+            return rids
+        with stats.timer("io.insert_many_clustered"):
+            with DiskManager(self.path, page_size=self.page_size) as dm:
+                stats.inc("io.diskmanager.opens")
+                pc = dm.page_count()
+                page: Optional[DataPage] = None
+                pid = pc
+                on_disk = False
+                slot = 0
+                if pc > 0:
+                    pid = pc - 1
+                    page = DataPage.unpack_page(dm.read_page(pid), pack=self.pack, unpack=self.unpack)
+                    on_disk = True
+                    slot = page.record_count()
+
+                def write_current() -> None:
+                    nonlocal pc
+                    if on_disk:
+                        dm.write_page(pid, page.pack_page())
+                        stats.inc("io.write_page.calls")
+                    else:
+                        dm.append_page(page.pack_page())
+                        stats.inc("io.append_page.calls")
+                        pc += 1
+
+                dirty = False
+                for record in records:
+                    if page is None or not page.append_record(record):
+                        if page is not None and dirty:
+                            write_current()
+                        page = DataPage(page_size=self.page_size, pack=self.pack, unpack=self.unpack)
+                        if not page.append_record(record):
+                            raise ValueError("Registro demasiado grande para una página")
+                        pid, on_disk, slot = pc, False, 0
+                    rids.append((pid, slot))
+                    slot += 1
+                    dirty = True
+                write_current()
+                dm.flush()
+                stats.inc("io.flush.calls")
+        return rids
+
     def insert_unclustered(self, record: Any) -> Tuple[int, int]:
         """Placeholder: actualmente delega a insert_clustered."""
         return self.insert_clustered(record)
@@ -152,6 +152,23 @@ def unpack_records(buffer: bytes) -> Tuple[List[Any], int]:
     return records, offset
 
 
+def count_records(buffer: bytes) -> int:
+    """Cuenta los registros del buffer recorriendo solo los prefijos de longitud.
+
+    Mismas reglas de corte que `unpack_records`, pero sin decodificar JSON.
+    """
+    count = 0
+    offset = 0
+    total = len(buffer)
+    while offset + 4 <= total:
+        (length,) = struct.unpack_from("<I", buffer, offset)
+        if length == 0 or offset + 4 + length > total:
+            break
+        offset += 4 + length
+        count += 1
+    return count
+
+
 def get_io_counters() -> Tuple[int, int]:
     """Retorna tupla (lecturas, escrituras) de las operaciones de disco realizadas."""
     return disk_reads, disk_writes
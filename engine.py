@@ -9,7 +9,9 @@ import os
 import json
 from typing import Dict, Optional
 
+from core.schema import TableSchema
 from storage.database import Database
+from storage.table import Table
 from metrics import stats
 
 
@@ -22,14 +24,20 @@ class DatabaseEngine:
         """Inicializa el motor con un directorio raíz para almacenar todas las bases de datos."""
         self.root_dir = os.path.abspath(root_dir)
         os.makedirs(self.root_dir, exist_ok=True)
+        # Prefijo absoluto de los datos de usuario, calculado una sola vez
+        self.users_root = os.path.join(self.root_dir, "data", "users")
 
     def _user_dir(self, user_id: str) -> str:
         """Retorna el directorio del usuario."""
-        return os.path.join(self.root_dir, "data", "users", user_id)
+        return os.path.join(self.users_root, user_id)
+
+    def databases_dir(self, user_id: str) -> str:
+        """Retorna el directorio que contiene las bases de datos del usuario."""
+        return os.path.join(self.users_root, user_id, "databases")
 
     def _db_dir(self, user_id: str, db_name: str) -> str:
         """Retorna el directorio de una base de datos específica."""
-        return os.path.join(self._user_dir(user_id), "databases", db_name)
+        return os.path.join(self.users_root, user_id, "databases", db_name)
 
     def create_database(self, user_id: str, db_name: str) -> Database:
         """Crea una nueva base de datos con su estructura de directorios y metadatos."""
@@ -48,6 +56,25 @@ class DatabaseEngine:
             return None
         return Database(db_dir, db_name)
 
+    def get_table(self, user_id: str, db_name: str, table_name: str) -> Optional[Table]:
+        """Abre solo la tabla pedida, sin cargar el resto del catálogo.
+
+        Retorna None si la base de datos no la registra en metadata.json.
+        """
+        db_dir = self._db_dir(user_id, db_name)
+        try:
+            with open(os.path.join(db_dir, "metadata.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if table_name not in meta.get("tables", []):
+            return None
+        tdir = os.path.join(db_dir, "tables", table_name)
+        schema_path = os.path.join(tdir, "schema.json")
+        if not os.path.exists(schema_path):
+            return None
+        return Table(tdir, TableSchema.load(schema_path))
+
     def execute_query(self, user_id: str, db_name: str, action: str, payload: Dict) -> Dict:
         """
         Ejecuta una acción sobre la base de datos y retorna el resultado.
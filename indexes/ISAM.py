@@ -98,6 +98,8 @@ class ISAM(IndexInterface):
                             out.append(record)
 
                 current_overflow = self.overflow_chains.get(page_idx)
+                while current_overflow:
+                    stats.inc("disk.reads")
                     for record in current_overflow.records:
                         extracted_key = self._extract_key(record)
                         if extracted_key == key:
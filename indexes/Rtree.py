@@ -12,6 +12,8 @@ import json
 import math
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
+
 try:
     from rtree import index as rtree_index  # type: ignore[import-not-found]
 except Exception:
@@ -33,6 +35,9 @@ class RTreeIndex(IndexInterface):
         self.dimensions = int(dimensions)
         self._points: Dict[int, Tuple[List[float], Any]] = {}
         self._next_id = 1
+        # Vista (N, dims) de las coordenadas + rids en el mismo orden; se
+        # reconstruye perezosamente tras add/remove (ver `_matrix`)
+        self._mat: Optional[Tuple[np.ndarray, List[Any]]] = None
         self._rtree = None
         if rtree_index is not None:
             p = rtree_index.Property()
@@ -46,11 +51,9 @@ class RTreeIndex(IndexInterface):
 
         with stats.timer("index.rtree.search.time"):
             coords = self._coerce_point(key)
-            out: List[Any] = []
-            for _, (pt, rid) in self._points.items():
-                if self._eq_coords(pt, coords):
-                    out.append(rid)
-            return out
+            mat, rids = self._matrix()
+            hits = np.flatnonzero((mat == np.asarray(coords)).all(axis=1))
+            return [rids[i] for i in hits]
 
     def range_search(self, begin_key: Any, end_key: Any) -> List[Any]:
         """Búsqueda por rango no soportada directamente."""
@@ -68,6 +71,7 @@ class RTreeIndex(IndexInterface):
             pid = self._next_id
             self._next_id += 1
             self._points[pid] = (coords, record)
+            self._mat = None
             if self._rtree is not None:
                 bbox = self._bbox(coords)
                 self._rtree.insert(pid, bbox)
@@ -91,6 +95,8 @@ class RTreeIndex(IndexInterface):
                     self._rtree.delete(pid, self._bbox(pt))
                 del self._points[pid]
                 ok = True
+            if ok:
+                self._mat = None
             return ok
 
     def get_stats(self) -> dict:
@@ -109,10 +115,9 @@ class RTreeIndex(IndexInterface):
             c = self._coerce_point(center)
             out: List[Any] = []
             if self._rtree is None:
-                for pt, rid in self._points.values():
-                    if self._dist(c, pt) <= radius:
-                        out.append(rid)
-                return out
+                mat, rids = self._matrix()
+                d = np.sqrt(self._sq_dists(mat, c))
+                return [rids[i] for i in np.flatnonzero(d <= radius)]
             candidates = list(self._rtree.intersection(self._bbox_for_radius(c, radius)))
             for pid in candidates:
                 stats.inc("disk.reads")
@@ -133,8 +138,15 @@ class RTreeIndex(IndexInterface):
             if k <= 0:
                 return []
             if self._rtree is None:
-                arr = sorted(((self._dist(c, pt), rid) for pt, rid in self._points.values()), key=lambda x: x[0])
-                return [rid for _, rid in arr[:k]]
+                mat, rids = self._matrix()
+                d2 = self._sq_dists(mat, c)
+                if k < len(d2):
+                    # Selección O(N) de los k menores y orden solo de esos k
+                    idx = np.argpartition(d2, k - 1)[:k]
+                    idx = idx[np.argsort(d2[idx], kind="stable")]
+                else:
+                    idx = np.argsort(d2, kind="stable")
+                return [rids[i] for i in idx]
             q = self._point_bbox(c)
             ids = list(self._rtree.nearest(q, num_results=k))
             arr: List[Tuple[float, Any]] = []
@@ -177,6 +189,19 @@ class RTreeIndex(IndexInterface):
         return inst
 
     # --------- Helpers ---------
+    def _matrix(self) -> Tuple[np.ndarray, List[Any]]:
+        """Coordenadas de todos los puntos como matriz (N, dims) y sus rids."""
+        if self._mat is None:
+            pts = list(self._points.values())
+            mat = np.asarray([pt for pt, _ in pts], dtype=np.float64).reshape(len(pts), self.dimensions)
+            self._mat = (mat, [rid for _, rid in pts])
+        return self._mat
+
+    @staticmethod
+    def _sq_dists(mat: np.ndarray, c: List[float]) -> np.ndarray:
+        diff = mat - np.asarray(c, dtype=np.float64)
+        return np.einsum("ij,ij->i", diff, diff)
+
     def _coerce_point(self, v: Any) -> List[float]:
         if isinstance(v, (list, tuple)) and len(v) == self.dimensions:
             return [float(x) for x in v]
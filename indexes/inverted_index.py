@@ -12,24 +12,75 @@ from __future__ import annotations
 import json
 import os
 import re
+import threading
 import unicodedata
 from typing import Dict, Set, Tuple, List, Iterable, Any, Optional
 
 Rid = Tuple[int, int]
 
-STOPWORDS = {
+STOPWORDS: frozenset = frozenset({
     "the","a","an","and","or","in","on","at","to","of","for","is","are","was","were","be","been","by","with","from","as","that","this","these","those","it","its","into","about","over","under","than","then","there","here","up","down","out","off","so","but","not",
     "el","la","los","las","un","una","unos","unas","y","o","u","en","de","del","al","a","por","para","con","sin","sobre","entre","tras","durante","segun","según","contra","como","que","qué","se","su","sus","tu","tus","mi","mis","nuestro","nuestra","nuestros","nuestras","vuestro","vuestra","vuestros","vuestras","lo","le","les","ya","muy","más","menos","tambien","también","pero","porque","cuando","donde","dónde","cual","cuál","cuales","cuáles","quien","quién","quienes","quiénes","esto","eso","aquello","aqui","aquí","alli","allí","allá","hoy","ayer","mañana","si","sí","no","ni","cada","casi","tal","tales","otro","otros","otra","otras","donde","desde","hasta","sino","e","ademas","además","pues","ante","bajo","cabe","era","eran","es","son","ser","será","serán"
-}
+})
 
 TOKEN_RE = re.compile(r"\w+", flags=re.UNICODE)
 
+
+class _StripMarks(dict):
+    """Tabla de `str.translate` que borra las marcas combinantes (acentos).
+
+    Se llena carácter a carácter la primera vez que aparece cada uno; desde
+    entonces el quitado de acentos es una sola pasada en C por el texto.
+    """
+
+    def __missing__(self, cp: int) -> Optional[int]:
+        v = None if unicodedata.combining(chr(cp)) else cp
+        self[cp] = v
+        return v
+
+
+_STRIP_MARKS = _StripMarks()
+
 try:
     from snowballstemmer import stemmer as SnowballStemmer
     _STEMMER = SnowballStemmer("spanish")
 except Exception:
     _STEMMER = None
 
+# Memo palabra -> raíz del proceso: el vocabulario se repite mucho y el
+# stemmer de snowballstemmer es Python puro. El stemmer guarda estado por
+# palabra, así que las llamadas se serializan con un lock.
+_STEM_CACHE_MAX = 200_000
+_stem_cache: Dict[str, str] = {}
+_stem_lock = threading.Lock()
+
+
+def _reset_stem_lock_after_fork() -> None:
+    # Un hijo de fork (pools de procesos SPIMI) podría heredar el lock tomado
+    # por otro hilo del padre y quedarse bloqueado en su primer stemming. El
+    # memo sí se hereda tal cual: cada operación sobre el dict es atómica.
+    global _stem_lock
+    _stem_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_stem_lock_after_fork)
+
+
+def _stem_words(tokens: List[str]) -> List[str]:
+    """Stemming con memo: solo las palabras nunca vistas pasan por el stemmer."""
+    cache = _stem_cache
+    out = [cache.get(t) for t in tokens]
+    if None not in out:
+        return out  # type: ignore[return-value]
+    missing = list({t for t, st in zip(tokens, out) if st is None})
+    with _stem_lock:
+        stems = dict(zip(missing, _STEMMER.stemWords(missing)))
+    if len(cache) + len(stems) > _STEM_CACHE_MAX:
+        cache.clear()
+    cache.update(stems)
+    return [st if st is not None else stems[t] for t, st in zip(tokens, out)]
+
 
 def tokenize(text: Any, *, do_stem: bool = False, normalize: bool = True) -> List[str]:
     """Tokeniza texto en palabras, filtrando stopwords y aplicando stemming opcional.
@@ -45,19 +96,14 @@ def tokenize(text: Any, *, do_stem: bool = False, normalize: bool = True) -> Lis
     if text is None:
         return []
     s = str(text)
-    if normalize:
-        try:
-            s = unicodedata.normalize('NFKD', s)
-            s = ''.join(ch for ch in s if not unicodedata.combining(ch))
-        except Exception:
-            s = str(text)
-    s = s.lower()
-    tokens = TOKEN_RE.findall(s)
-    tokens = [t for t in tokens if t and t not in STOPWORDS and len(t) > 1]
+    # Texto ASCII no tiene nada que descomponer ni acentos que quitar
+    if normalize and not s.isascii():
+        s = unicodedata.normalize('NFKD', s).translate(_STRIP_MARKS)
+    tokens = [t for t in TOKEN_RE.findall(s.lower()) if len(t) > 1 and t not in STOPWORDS]
     if do_stem:
         if _STEMMER is not None:
             try:
-                return _STEMMER.stemWords(tokens)
+                return _stem_words(tokens)
             except Exception:
                 return [t.rstrip('s') for t in tokens]
         else:
@@ -146,7 +192,7 @@ class InvertedIndex:
         def stem_list(tokens: List[str]) -> List[str]:
             if _STEMMER is not None:
                 try:
-                    return _STEMMER.stemWords(tokens)
+                    return _stem_words(tokens)
                 except Exception:
                     return [t.rstrip('s') for t in tokens]
             return [t.rstrip('s') for t in tokens]
@@ -6,29 +6,126 @@ Implementa construcción de índice invertido para grandes colecciones:
 - Almacena archivos por término para búsquedas eficientes.
 - Calcula normas de documentos para ranking TF-IDF.
 - Soporta búsqueda top-k con similitud coseno.
+- Guarda los pesos normalizados en una matriz dispersa (`weights.npz`) para
+  puntuar una consulta con un producto matriz-vector.
 """
 from __future__ import annotations
 
 import json
 import math
 import os
+import shutil
 import urllib.parse
 import heapq
-from typing import Dict, Iterable, List, Tuple, Any, Set
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Any, Set, Union
 
+import numpy as np
+from scipy import sparse
+
+from datafile import DataFile
 from .inverted_index import tokenize
 
 DocID = str
 
+# Matriz documentos x términos con el peso tf-idf ya dividido por la norma
+# del documento: el coseno de una consulta es `M[:, cols] @ q / |q|`.
+# Un solo .npz (data/indices/indptr CSC + vocabulario + df + docids) se
+# reemplaza atómicamente, así que un lector nunca ve partes de dos builds.
+_WEIGHTS = "weights.npz"
+_WEIGHTS_CACHE_MAX = 8
+
+# Peso tf sublineal 1 + log(tf) precalculado (tf=0 -> 0): casi todas las
+# frecuencias de un documento caben en la tabla y no se llama a log
+_TF_LUT_SIZE = 256
+_TF_LUT = np.concatenate(([0.0], 1.0 + np.log(np.arange(1, _TF_LUT_SIZE, dtype=np.float64))))
+_TF_W = _TF_LUT.tolist()
+
 
 def _ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
 
+def _tf_weight(tf: int) -> float:
+    return _TF_W[tf] if 0 <= tf < _TF_LUT_SIZE else (1.0 + math.log(float(tf)) if tf > 0 else 0.0)
+
+
+def _tf_weights(tf: np.ndarray) -> np.ndarray:
+    """Versión vectorizada de `_tf_weight` sobre un arreglo de frecuencias."""
+    out = _TF_LUT[np.minimum(tf, _TF_LUT_SIZE - 1)]
+    big = tf >= _TF_LUT_SIZE
+    if big.any():
+        out[big] = 1.0 + np.log(tf[big].astype(np.float64))
+    return out
+
+
 def _docid_to_str(docid: Tuple[int, int]) -> DocID:
     return f"{docid[0]}_{docid[1]}"
 
 
+def docid_to_rid(docid: DocID) -> Tuple[int, int]:
+    """Inverso de `_docid_to_str`: "pid_slot" -> (pid, slot)."""
+    page, _, slot = docid.partition("_")
+    return int(page), int(slot)
+
+
+class SpimiBlockWriter:
+    """Constructor incremental de bloques SPIMI.
+
+    Versión "push" de `build_spimi_blocks`: los documentos se agregan uno a
+    uno con `add()` (por ejemplo, mientras se insertan en la tabla) y el
+    bloque en memoria se vuelca a disco al llegar a `block_max_docs`.
+    """
+
+    def __init__(self, block_dir: str, block_max_docs: int = 500, do_stem: bool = False, block_prefix: str = "block"):
+        _ensure_dir(block_dir)
+        self.block_dir = block_dir
+        # Prefijo de archivo: permite que varios escritores compartan block_dir
+        self.block_prefix = block_prefix
+        self.block_max_docs = block_max_docs
+        self.do_stem = do_stem
+        self.block: Dict[str, Dict[str, int]] = {}
+        self.docs_in_block = 0
+        self.block_id = 0
+        self.total_docs = 0
+
+    def add(self, text: Any, rid: Tuple[int, int]) -> None:
+        """Tokeniza un documento y acumula sus términos en el bloque actual."""
+        self.total_docs += 1
+        terms = tokenize(text, do_stem=self.do_stem)
+        docid = _docid_to_str(rid)
+        self.docs_in_block += 1
+
+        counts: Dict[str, int] = {}
+        for t in terms:
+            counts[t] = counts.get(t, 0) + 1
+
+        block = self.block
+        for t, tf in counts.items():
+            posting = block.setdefault(t, {})
+            posting[docid] = posting.get(docid, 0) + tf
+
+        if self.docs_in_block >= self.block_max_docs:
+            self._flush()
+
+    def _flush(self) -> None:
+        path = os.path.join(self.block_dir, f"{self.block_prefix}_{self.block_id}.json")
+        serial = {t: [[docid, tf] for docid, tf in postings.items()] for t, postings in self.block.items()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(serial, f, ensure_ascii=False)
+        self.block_id += 1
+        self.block = {}
+        self.docs_in_block = 0
+
+    def close(self) -> int:
+        """Escribe el último bloque pendiente y retorna el total de documentos."""
+        if self.block:
+            self._flush()
+        return self.total_docs
+
+
 def build_spimi_blocks(
     docs: Iterable[Tuple[Any, Tuple[int, int]]],
     block_dir: str,
@@ -48,42 +145,89 @@ def build_spimi_blocks(
     Returns:
         Número total de documentos procesados.
     """
-    _ensure_dir(block_dir)
-    block = {}
-    docs_in_block = 0
-    block_id = 0
-    total_docs = 0
-
-    def write_block(bid: int, bdata: Dict[str, Dict[str, int]]):
-        path = os.path.join(block_dir, f"block_{bid}.json")
-        serial = {t: [[docid, tf] for docid, tf in postings.items()] for t, postings in bdata.items()}
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(serial, f, ensure_ascii=False)
-
+    writer = SpimiBlockWriter(block_dir, block_max_docs=block_max_docs, do_stem=do_stem)
     for text, rid in docs:
-        total_docs += 1
-        terms = tokenize(text, do_stem=do_stem)
-        docid = _docid_to_str(rid)
-        docs_in_block += 1
+        writer.add(text, rid)
+    return writer.close()
 
-        counts: Dict[str, int] = {}
-        for t in terms:
-            counts[t] = counts.get(t, 0) + 1
 
-        for t, tf in counts.items():
-            posting = block.setdefault(t, {})
-            posting[docid] = posting.get(docid, 0) + tf
+# Páginas mínimas por rango al construir bloques desde un DataFile en paralelo
+_SHARD_PAGES = 64
 
-        if docs_in_block >= block_max_docs:
-            write_block(block_id, block)
-            block_id += 1
-            block = {}
-            docs_in_block = 0
+# Lecturas de página en vuelo mientras se tokeniza la actual
+_PREFETCH_PAGES = 8
 
-    if block:
-        write_block(block_id, block)
+# Origen del texto de un documento: una columna, o varias que se concatenan
+TextSource = Union[str, Sequence[str]]
 
-    return total_docs
+
+def _text_getter(source: TextSource) -> Callable[[Dict[str, Any]], Optional[Any]]:
+    """Devuelve la función registro -> texto a indexar, especializada una vez.
+
+    Así el bucle por registro no vuelve a decidir entre una y varias
+    columnas. Los registros vienen de JSON, por lo que `str(v)` no falla.
+    """
+    if isinstance(source, str):
+        return lambda rec: rec.get(source)
+    cols = tuple(source)
+
+    def concat(rec: Dict[str, Any], _join=" ".join) -> Optional[str]:
+        s = _join([str(v) for v in map(rec.get, cols) if v is not None]).strip()
+        return s if s else None
+    return concat
+
+
+def _build_range_blocks(data_path: str, page_size: int, targets: Dict[str, Tuple[str, TextSource]],
+                        block_max_docs: int, prefix: str, pid_lo: int, pid_hi: int) -> Dict[str, int]:
+    """Genera los bloques de las páginas [pid_lo, pid_hi) (ejecutable en otro proceso).
+
+    Cada página se lee una sola vez y alimenta a todos los índices; los
+    bloques llevan el prefijo `{prefix}{pid_lo}` para convivir con los de
+    los demás rangos en el mismo directorio. Retorna documentos por índice.
+    """
+    datafile = DataFile(data_path, page_size=page_size)
+    work = [
+        (name, SpimiBlockWriter(block_dir, block_max_docs=block_max_docs, do_stem=True,
+                                block_prefix=f"{prefix}{pid_lo}"), _text_getter(source))
+        for name, (block_dir, source) in targets.items()
+    ]
+    for pid, page in datafile.iter_pages(pid_lo, pid_hi, prefetch=_PREFETCH_PAGES):
+        for slot, rec in enumerate(page.iter_records()):
+            for _name, writer, text_of in work:
+                text = text_of(rec)
+                if text is not None:
+                    writer.add(text, (pid, slot))
+    return {name: writer.close() for name, writer, _ in work}
+
+
+def build_blocks_from_datafile(data_path: str, page_size: int, page_count: int,
+                               targets: Dict[str, Tuple[str, TextSource]],
+                               block_max_docs: int = 500, prefix: str = "shard") -> Dict[str, int]:
+    """Construye bloques SPIMI desde las páginas de un DataFile.
+
+    `targets` mapea un nombre de índice a (directorio de bloques, origen del
+    texto). Tokenizar y stemmizar es CPU puro: las páginas se reparten en
+    rangos contiguos (de al menos `_SHARD_PAGES`) entre procesos, y
+    `merge_blocks` fusiona luego todos los bloques de cada directorio.
+    Retorna el número de documentos por índice.
+    """
+    totals = {name: 0 for name in targets}
+    if page_count <= 0:
+        return totals
+    workers = max(1, min(os.cpu_count() or 1, -(-page_count // _SHARD_PAGES)))
+    step = -(-page_count // workers)
+    ranges = [(lo, min(lo + step, page_count)) for lo in range(0, page_count, step)]
+    args = (data_path, page_size, targets, int(block_max_docs), prefix)
+    if len(ranges) == 1:
+        results = [_build_range_blocks(*args, *ranges[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as ex:
+            futures = [ex.submit(_build_range_blocks, *args, lo, hi) for lo, hi in ranges]
+            results = [f.result() for f in futures]
+    for counts in results:
+        for name, n in counts.items():
+            totals[name] += n
+    return totals
 
 
 def merge_blocks(block_dir: str, index_dir: str, total_docs: int | None = None) -> None:
@@ -172,24 +316,44 @@ def merge_blocks(block_dir: str, index_dir: str, total_docs: int | None = None)
     else:
         N = int(total_docs)
 
-    doc_sumsq: Dict[DocID, float] = {}
-    num_terms = 0
-    for fname in os.listdir(terms_dir):
+    # Una pasada por los términos, que salen en orden de columna: cada lista
+    # de postings se agrega como un trozo de la matriz CSC (fila=doc,
+    # columna=término) en arreglos NumPy que crecen por duplicación, sin
+    # acumular objetos de Python por posting.
+    row_of: Dict[DocID, int] = {}
+    terms: List[str] = []
+    dfs: List[int] = []
+    indptr: List[int] = [0]
+    indices = _GrowingArray(np.int64)
+    data = _GrowingArray(np.float64)
+    for fname in sorted(os.listdir(terms_dir)):
         pf = os.path.join(terms_dir, fname)
         with open(pf, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        df = int(data.get('df', 0))
+            data_json = json.load(f)
+        df = int(data_json.get('df', 0))
         if df == 0:
             continue
-        num_terms += 1
-        idf = math.log((N + 1) / df)
-        for docid, tf in data.get('postings', []):
-            tfv = int(tf)
-            tfw = 1.0 + math.log(float(tfv)) if tfv > 0 else 0.0
-            w = tfw * idf
-            doc_sumsq[docid] = doc_sumsq.get(docid, 0.0) + w * w
-
-    doc_norms = {docid: math.sqrt(s) for docid, s in doc_sumsq.items()}
+        postings = data_json.get('postings', [])
+        terms.append(urllib.parse.unquote_plus(fname[:-len('.json')]))
+        dfs.append(df)
+        indices.extend(np.fromiter((row_of.setdefault(docid, len(row_of)) for docid, _ in postings),
+                                   dtype=np.int64, count=len(postings)))
+        data.extend(_tf_weights(np.fromiter((tf for _, tf in postings), dtype=np.int64, count=len(postings))))
+        indptr.append(len(indices))
+    num_terms = len(terms)
+
+    # Filas en orden de docid: los empates salen en el mismo orden que las postings
+    docids = sorted(row_of)
+    remap = np.empty(len(docids), dtype=np.int64)
+    remap[[row_of[d] for d in docids]] = np.arange(len(docids))
+    del row_of
+    r = remap[indices.view()]
+    idf = np.log((N + 1) / np.asarray(dfs, dtype=np.float64))
+    w = data.view()
+    w *= np.repeat(idf, np.diff(indptr))
+    norms = np.sqrt(np.bincount(r, weights=w * w, minlength=len(docids)))
+    doc_norms = {docid: float(norms[i]) for i, docid in enumerate(docids)}
+    _write_weights(index_dir, N, terms, dfs, docids, r, np.asarray(indptr, dtype=np.int64), w, norms)
 
     SHARD_THRESHOLD = 50000
     if len(doc_norms) > SHARD_THRESHOLD:
@@ -224,6 +388,186 @@ def merge_blocks(block_dir: str, index_dir: str, total_docs: int | None = None)
             json.dump(meta, f, ensure_ascii=False)
 
 
+def replace_dir(tmp: str, target: str) -> None:
+    """Reemplaza `target` por `tmp` con renombrados atómicos (`os.replace`)."""
+    old = target + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    try:
+        os.replace(target, old)
+    except FileNotFoundError:
+        pass
+    os.replace(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def merge_blocks_atomic(block_dir: str, index_dir: str, total_docs: int | None = None) -> None:
+    """`merge_blocks` en un directorio nuevo que luego reemplaza a `index_dir`.
+
+    Los lectores nunca ven un índice a medias, y los archivos previos, que
+    pueden estar enlazados (hardlinks) desde otro índice, no se truncan en
+    sitio: `merge_blocks` reescribe con `open(..., 'w')`.
+    """
+    tmp = index_dir + ".new"
+    shutil.rmtree(tmp, ignore_errors=True)
+    merge_blocks(block_dir, tmp, total_docs=total_docs)
+    replace_dir(tmp, index_dir)
+
+
+def _write_weights(index_dir: str, N: int, terms: List[str], dfs: List[int], docids: List[DocID],
+                   rows: np.ndarray, indptr: np.ndarray, w: np.ndarray, norms: np.ndarray) -> None:
+    """Escribe `weights.npz`: pesos tf-idf / norma del documento en CSC.
+
+    `rows`/`w` vienen agrupados por columna según `indptr`.
+    """
+    inv = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    w *= inv[rows]
+    mat = sparse.csc_matrix((w, rows, indptr), shape=(len(docids), len(terms)))
+    mat.eliminate_zeros()
+    mat.sort_indices()
+    tmp = os.path.join(index_dir, _WEIGHTS + ".tmp")
+    with open(tmp, 'wb') as f:
+        np.savez(f, data=mat.data, indices=mat.indices, indptr=mat.indptr,
+                 shape=np.asarray(mat.shape, dtype=np.int64), N=np.int64(N),
+                 terms=np.asarray(terms, dtype=str), df=np.asarray(dfs, dtype=np.int64),
+                 docids=np.asarray(docids, dtype=str))
+    os.replace(tmp, os.path.join(index_dir, _WEIGHTS))
+
+
+class _GrowingArray:
+    """Arreglo NumPy de una dimensión que crece por duplicación al agregar trozos."""
+
+    def __init__(self, dtype: Any, capacity: int = 1024) -> None:
+        self._buf = np.empty(capacity, dtype=dtype)
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def extend(self, chunk: np.ndarray) -> None:
+        end = self._n + len(chunk)
+        if end > len(self._buf):
+            buf = np.empty(max(end, 2 * len(self._buf)), dtype=self._buf.dtype)
+            buf[:self._n] = self._buf[:self._n]
+            self._buf = buf
+        self._buf[self._n:end] = chunk
+        self._n = end
+
+    def view(self) -> np.ndarray:
+        return self._buf[:self._n]
+
+
+class _Weights:
+    """`weights.npz` ya cargado: matriz CSC y vocabulario término -> columna."""
+    __slots__ = ("matrix", "col", "df", "N", "docids", "colmax")
+
+    def __init__(self, path: str):
+        with np.load(path, allow_pickle=False) as z:
+            self.matrix = sparse.csc_matrix((z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"]))
+            self.col = {t: j for j, t in enumerate(z["terms"].tolist())}
+            self.df = z["df"]
+            self.N = int(z["N"])
+            self.docids = z["docids"]
+        # Cota superior por término (peso máximo de su columna) para MaxScore
+        m = self.matrix
+        nonempty = np.diff(m.indptr) > 0
+        self.colmax = np.zeros(m.shape[1], dtype=np.float64)
+        if nonempty.any():
+            self.colmax[nonempty] = np.maximum.reduceat(m.data, m.indptr[:-1][nonempty])
+
+
+# Índices cargados: index_dir -> (firma de weights.npz, _Weights)
+_weights_cache: "OrderedDict[str, Tuple[tuple, _Weights]]" = OrderedDict()
+_weights_lock = threading.Lock()
+
+
+def _load_weights(index_dir: str) -> Optional[_Weights]:
+    """Carga (o toma de caché) la matriz del índice; None si no existe."""
+    path = os.path.join(index_dir, _WEIGHTS)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _weights_lock:
+        hit = _weights_cache.get(index_dir)
+        if hit is not None and hit[0] == sig:
+            _weights_cache.move_to_end(index_dir)
+            return hit[1]
+    weights = _Weights(path)
+    with _weights_lock:
+        _weights_cache[index_dir] = (sig, weights)
+        _weights_cache.move_to_end(index_dir)
+        while len(_weights_cache) > _WEIGHTS_CACHE_MAX:
+            _weights_cache.popitem(last=False)
+    return weights
+
+
+def _search_weights(weights: _Weights, q_tf: Dict[str, int], k: int) -> List[Tuple[DocID, float]]:
+    """Top-k coseno sobre la matriz con poda MaxScore.
+
+    Los términos se recorren de mayor a menor cota (peso de la consulta por
+    el máximo de su columna). Cuando la suma de las cotas que faltan queda
+    bajo el k-ésimo puntaje, ningún documento nuevo puede entrar al top-k:
+    las listas restantes solo se consultan para los candidatos vivos
+    (`searchsorted`) en vez de recorrerse enteras. El resultado es exacto.
+    """
+    cols: List[int] = []
+    q: List[float] = []
+    for t, tf in q_tf.items():
+        j = weights.col.get(t)
+        if j is None:
+            continue
+        cols.append(j)
+        q.append(_tf_weight(tf) * math.log((weights.N + 1) / int(weights.df[j])))
+    if not cols:
+        return []
+    q_norm = math.sqrt(sum(v * v for v in q))
+    if q_norm == 0:
+        return []
+
+    m = weights.matrix
+    indptr, indices, data = m.indptr, m.indices, m.data
+    qv = np.asarray(q, dtype=np.float64)
+    # Holgura relativa: el redondeo de las sumas nunca poda de más
+    ub = qv * weights.colmax[cols] * (1.0 + 1e-9)
+    order = np.argsort(-ub, kind="stable")
+    rest = np.cumsum(ub[order][::-1])[::-1] - ub[order]  # cotas de los términos siguientes
+
+    acc = np.zeros(m.shape[0], dtype=np.float64)
+    live = np.empty(0, dtype=indices.dtype)
+    pruned = False
+    for i, o in enumerate(order):
+        j = cols[o]
+        idx = indices[indptr[j]:indptr[j + 1]]
+        val = data[indptr[j]:indptr[j + 1]]
+        if not pruned:
+            acc[idx] += qv[o] * val
+            live = np.union1d(live, idx)
+        elif idx.shape[0]:
+            pos = np.minimum(np.searchsorted(idx, live), idx.shape[0] - 1)
+            hit = idx[pos] == live
+            acc[live[hit]] += qv[o] * val[pos[hit]]
+        if live.shape[0] > k and rest[i] > 0:
+            theta = np.partition(acc[live], live.shape[0] - k)[live.shape[0] - k]
+            if rest[i] < theta:
+                pruned = True
+                live = live[acc[live] + rest[i] >= theta]
+
+    cand = live
+    scores = acc[cand] / q_norm
+    # Empates por docid: se ordena sobre el puntaje redondeado para que el
+    # orden de suma (ulps) no decida entre documentos con el mismo coseno
+    key = -np.round(scores, 12)
+    if k < cand.shape[0]:
+        top = np.argpartition(key, k - 1)[:k]
+        boundary = key[top].max()
+        top = np.flatnonzero(key <= boundary)
+        cand, scores, key = cand[top], scores[top], key[top]
+    order = np.lexsort((cand, key))[:k]
+    docids = weights.docids
+    return [(str(docids[i]), float(scores[o])) for o, i in zip(order, cand[order])]
+
+
 def load_term_postings(index_dir: str, term: str) -> Tuple[int, List[Tuple[DocID, int]]]:
     """Carga las postings de un término desde el índice en disco.
     
@@ -245,7 +589,8 @@ def load_term_postings(index_dir: str, term: str) -> Tuple[int, List[Tuple[DocID
 def search_topk(index_dir: str, query: str, k: int = 10, do_stem: bool = False) -> List[Tuple[DocID, float]]:
     """Calcula los top-k documentos más relevantes usando similitud coseno.
 
-    Lee solo las postings de los términos de la consulta desde disco.
+    Con `weights.npz` puntúa con la matriz dispersa en memoria; índices
+    anteriores a ella leen solo las postings de los términos de la consulta.
     
     Args:
         index_dir: Directorio del índice SPIMI.
@@ -256,6 +601,18 @@ def search_topk(index_dir: str, query: str, k: int = 10, do_stem: bool = False)
     Returns:
         Lista de tuplas (docid, score) ordenada por score descendente.
     """
+    q_terms = tokenize(query, do_stem=do_stem)
+    if not q_terms or k <= 0:
+        return []
+
+    q_tf: Dict[str, int] = {}
+    for t in q_terms:
+        q_tf[t] = q_tf.get(t, 0) + 1
+
+    weights = _load_weights(index_dir)
+    if weights is not None:
+        return _search_weights(weights, q_tf, k) if weights.N else []
+
     meta_path = os.path.join(index_dir, 'meta.json')
     if not os.path.exists(meta_path):
         return []
@@ -265,37 +622,22 @@ def search_topk(index_dir: str, query: str, k: int = 10, do_stem: bool = False)
     if N == 0:
         return []
 
-    q_terms = tokenize(query, do_stem=do_stem)
-    if not q_terms:
-        return []
-
-    q_tf: Dict[str, int] = {}
-    for t in q_terms:
-        q_tf[t] = q_tf.get(t, 0) + 1
-
     q_weights: Dict[str, float] = {}
+    scores: Dict[DocID, float] = {}
     for t, tf in q_tf.items():
         df, postings = load_term_postings(index_dir, t)
         if df == 0:
             continue
         idf = math.log((N + 1) / df)
-        tfw = 1.0 + math.log(float(tf)) if tf > 0 else 0.0
-        q_weights[t] = tfw * idf
+        qw = _tf_weight(tf) * idf
+        q_weights[t] = qw
+        qwi = qw * idf
+        for docid, dtf in postings:
+            scores[docid] = scores.get(docid, 0.0) + qwi * _tf_weight(dtf)
 
     if not q_weights:
         return []
 
-    scores: Dict[DocID, float] = {}
-    for t, qw in q_weights.items():
-        df, postings = load_term_postings(index_dir, t)
-        if df == 0:
-            continue
-        idf = math.log((N + 1) / df)
-        for docid, tf in postings:
-            tfw = 1.0 + math.log(float(tf)) if tf > 0 else 0.0
-            w = tfw * idf
-            scores[docid] = scores.get(docid, 0.0) + qw * w
-
     doc_norms = meta.get('doc_norms', {})
     if meta.get('doc_norms_sharded'):
         import hashlib
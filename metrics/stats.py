@@ -6,8 +6,22 @@ tablas y accesos a disco, con capacidad de reportar estadísticas agregadas.
 from __future__ import annotations
 
 import time
-from typing import Dict, Any
+from collections import defaultdict
+from typing import Dict, Any, Tuple
 from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class _State:
+    """Contadores y temporizadores de un ámbito (una petición, o el global)."""
+    __slots__ = ("counters", "timers", "timer_calls", "active_timers")
+
+    def __init__(self):
+        # defaultdict: `inc` es un solo `+=` (sin get + set) en el camino caliente
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.timers: Dict[str, float] = {}  # Acumulado en segundos
+        self.timer_calls: Dict[str, int] = {}  # Número de llamadas
+        self.active_timers: Dict[str, float] = {}  # Timers activos (para contexto)
 
 
 class StatsManager:
@@ -15,23 +29,38 @@ class StatsManager:
     
     Mantiene contadores acumulativos y temporizadores para diferentes operaciones,
     permitiendo análisis de rendimiento granular.
+
+    El estado vive en un `ContextVar`: `reset()` instala un estado nuevo solo
+    en el contexto actual (cada petición corre en su propia copia), así que
+    peticiones concurrentes no se pisan los contadores. Fuera de una
+    petición (scripts, benchmarks) todos comparten el estado por defecto.
     """
     def __init__(self):
-        self.counters: Dict[str, int] = {}
-        self.timers: Dict[str, float] = {}  # Acumulado en segundos
-        self.timer_calls: Dict[str, int] = {}  # Número de llamadas
-        self._active_timers: Dict[str, float] = {}  # Timers activos (para contexto)
+        self._state: ContextVar[_State] = ContextVar(f"stats_{id(self)}", default=_State())
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        return self._state.get().counters
+
+    @property
+    def timers(self) -> Dict[str, float]:
+        return self._state.get().timers
+
+    @property
+    def timer_calls(self) -> Dict[str, int]:
+        return self._state.get().timer_calls
+
+    @property
+    def _active_timers(self) -> Dict[str, float]:
+        return self._state.get().active_timers
 
     def reset(self):
-        """Reinicia todos los contadores y temporizadores."""
-        self.counters.clear()
-        self.timers.clear()
-        self.timer_calls.clear()
-        self._active_timers.clear()
+        """Empieza un ámbito de métricas vacío para el contexto actual."""
+        self._state.set(_State())
 
     def inc(self, key: str, amount: int = 1):
         """Incrementa un contador por la cantidad especificada."""
-        self.counters[key] = self.counters.get(key, 0) + amount
+        self._state.get().counters[key] += amount
 
     def get_counter(self, key: str) -> int:
         """Obtiene el valor actual de un contador."""
@@ -40,13 +69,14 @@ class StatsManager:
     @contextmanager
     def timer(self, key: str):
         """Context manager para medir tiempo de ejecución de un bloque de código."""
+        st = self._state.get()
         start = time.perf_counter()
         try:
             yield
         finally:
             elapsed = time.perf_counter() - start
-            self.timers[key] = self.timers.get(key, 0.0) + elapsed
-            self.timer_calls[key] = self.timer_calls.get(key, 0) + 1
+            st.timers[key] = st.timers.get(key, 0.0) + elapsed
+            st.timer_calls[key] = st.timer_calls.get(key, 0) + 1
 
     def get_time(self, key: str) -> float:
         """Obtiene el tiempo total acumulado en segundos."""
@@ -78,6 +108,19 @@ class StatsManager:
             }
         }
 
+    def snapshot(self) -> Dict[str, Tuple[int, float]]:
+        """Copia plana `{clave: (contador, ms)}` del ámbito actual.
+
+        El tiempo de `clave` es el del timer `clave.time` (convención de los
+        índices); así quien lee muchas métricas hace una sola pasada.
+        """
+        st = self._state.get()
+        snap = {k: (v, 0.0) for k, v in st.counters.items()}
+        for k, secs in st.timers.items():
+            base = k[:-5] if k.endswith(".time") else k
+            snap[base] = (snap.get(base, (0, 0.0))[0], secs * 1000)
+        return snap
+
     def get_index_stats(self, index_name: str) -> Dict[str, Any]:
         """Retorna estadísticas detalladas para un índice específico."""
         prefix = f"{index_name}."
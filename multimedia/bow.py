@@ -6,17 +6,28 @@ visuales. Incluye ponderación TF-IDF para mejorar la discriminación entre docu
 """
 
 import logging
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pickle
-from sklearn.metrics import pairwise_distances
 
 
 logger = logging.getLogger(__name__)
 
 
-def quantize_descriptors(descriptors: np.ndarray, centroids: np.ndarray, top_m: int = 3, sigma: float = 1.0) -> np.ndarray:
+def centroid_half_norms(centroids: np.ndarray) -> np.ndarray:
+    """Precalcula 0.5*||c||² por centroide (reutilizable mientras no cambie el codebook)."""
+    c = centroids.astype(np.float32, copy=False)
+    return 0.5 * np.einsum("ij,ij->i", c, c)
+
+
+def quantize_descriptors(
+    descriptors: np.ndarray,
+    centroids: np.ndarray,
+    top_m: int = 3,
+    sigma: float = 1.0,
+    c_half: Optional[np.ndarray] = None,
+) -> np.ndarray:
     """Cuantiza descriptores locales en un histograma de palabras visuales.
     
     Utiliza asignación suave (soft-assignment) con pesos gaussianos para asignar
@@ -27,31 +38,76 @@ def quantize_descriptors(descriptors: np.ndarray, centroids: np.ndarray, top_m:
         centroids: Centroides del codebook (k, dim)
         top_m: Número de centroides más cercanos a considerar
         sigma: Parámetro de escala para la función gaussiana
+        c_half: 0.5*||c||² precalculado (ver `centroid_half_norms`)
         
     Returns:
         Histograma normalizado de palabras visuales (k,)
     """
     if descriptors.shape[0] == 0:
         return np.zeros((centroids.shape[0],), dtype=np.float32)
-    dists = pairwise_distances(descriptors, centroids, metric="euclidean")
-    k = centroids.shape[0]
-    hist = np.zeros((k,), dtype=np.float32)
-    m = max(1, min(top_m, k))
-    # For each descriptor, find m smallest distances
-    idx = np.argpartition(dists, m - 1, axis=1)[:, :m]
-    # Gather distances for those indices
-    rows = np.arange(dists.shape[0])[:, None]
-    selected = dists[rows, idx]
+    return quantize_batch([descriptors], centroids, top_m=top_m, sigma=sigma, c_half=c_half)[0]
+
+
+def _soft_assign(
+    X: np.ndarray, centroids: np.ndarray, c_half: np.ndarray, m: int, sigma: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Índices de los m centroides más cercanos a cada fila de X y sus pesos gaussianos.
+
+    Usa ||x-c||² = ||x||² + ||c||² - 2x·c: el ranking sale de
+    argmax(x·c - 0.5||c||²) (un solo SGEMM) y solo para los m elegidos se
+    reconstruye la distancia que necesitan los pesos.
+    """
+    X = X.astype(np.float32, copy=False)
+    S = X @ centroids.T
+    S -= c_half
+    # For each descriptor, find m largest scores (= m smallest distances)
+    idx = np.argpartition(S, S.shape[1] - m, axis=1)[:, -m:]
+    selected = np.take_along_axis(S, idx, axis=1)
+    x_sq = np.einsum("ij,ij->i", X, X)[:, None]
+    d2 = np.maximum(x_sq - 2.0 * selected, 0.0)
     # Convert to weights: w = exp(-d^2 / (2*sigma^2)); normalize per descriptor
-    w = np.exp(- (selected ** 2) / (2.0 * (sigma ** 2) + 1e-12)).astype(np.float32)
+    w = np.exp(-d2 / (2.0 * (sigma ** 2) + 1e-12)).astype(np.float32)
     norm = np.sum(w, axis=1, keepdims=True)
     norm[norm == 0.0] = 1.0
-    w = w / norm
-    # Accumulate into histogram
-    for i in range(idx.shape[0]):
-        for j in range(m):
-            hist[idx[i, j]] += w[i, j]
-    return hist
+    return idx, w / norm
+
+
+def quantize_batch(
+    descriptor_lists: List[np.ndarray],
+    centroids: np.ndarray,
+    top_m: int = 3,
+    sigma: float = 1.0,
+    chunk_rows: int = 4096,
+    c_half: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Cuantiza los descriptores de varios documentos en una sola pasada.
+
+    Equivale a llamar `quantize_descriptors` por documento, pero todos los
+    descriptores se concatenan y se asignan por bloques de `chunk_rows`
+    filas (memoria acotada, una llamada BLAS por bloque); los pesos se
+    acumulan en la matriz de histogramas con `np.add.at`. `c_half` evita
+    recalcular las normas de los centroides en cada llamada.
+
+    Returns:
+        Matriz (n_docs, k) con un histograma por documento.
+    """
+    k = centroids.shape[0]
+    n_docs = len(descriptor_lists)
+    hists = np.zeros((n_docs, k), dtype=np.float32)
+    lens = np.array([d.shape[0] for d in descriptor_lists], dtype=np.int64)
+    if n_docs == 0 or lens.sum() == 0:
+        return hists
+    X = np.concatenate([d for d in descriptor_lists if d.shape[0] > 0])
+    doc_ix = np.repeat(np.arange(n_docs), lens)
+    m = max(1, min(top_m, k))
+    C = centroids.astype(np.float32, copy=False)
+    if c_half is None:
+        c_half = centroid_half_norms(C)
+    for start in range(0, X.shape[0], chunk_rows):
+        stop = start + chunk_rows
+        idx, w = _soft_assign(X[start:stop], C, c_half, m, sigma)
+        np.add.at(hists, (doc_ix[start:stop, None], idx), w)
+    return hists
 
 
 def compute_df(histograms: List[np.ndarray]) -> np.ndarray:
@@ -98,6 +154,10 @@ def save_bow_artifacts(out_dir: str, histograms: List[np.ndarray], doc_ids: List
         histograms: Lista de histogramas BoW
         doc_ids: Identificadores de documentos
         df: Vector de frecuencia de documento
+
+    Además de los histogramas guarda `idf.npy`, la matriz `tfidf.npy`
+    (log1p(h)·idf por documento) y `doc_norms.npy` para que la búsqueda
+    secuencial no tenga que recalcularlos.
     """
     import os
     os.makedirs(out_dir, exist_ok=True)
@@ -107,6 +167,21 @@ def save_bow_artifacts(out_dir: str, histograms: List[np.ndarray], doc_ids: List
         pickle.dump(doc_ids, f)
     with open(os.path.join(out_dir, "df.pkl"), "wb") as f:
         pickle.dump(df, f)
+    # Artefactos precalculados para la búsqueda secuencial (se cargan con mmap)
+    n_docs = len(doc_ids)
+    idf = (np.log((n_docs + 1) / (np.asarray(df) + 1)) + 1.0).astype(np.float32)
+    W = np.log1p(np.vstack(histograms).astype(np.float32)) * idf if n_docs else np.zeros((0, idf.shape[0]), np.float32)
+    _save_npy(os.path.join(out_dir, "idf.npy"), idf)
+    _save_npy(os.path.join(out_dir, "doc_norms.npy"), np.linalg.norm(W, axis=1).astype(np.float32))
+    _save_npy(os.path.join(out_dir, "tfidf.npy"), np.ascontiguousarray(W, dtype=np.float32))
+
+
+def _save_npy(path: str, arr: np.ndarray) -> None:
+    # Escribe aparte y reemplaza: el archivo anterior puede estar mapeado por un lector
+    import os
+    tmp = path[:-4] + ".tmp.npy"
+    np.save(tmp, arr)
+    os.replace(tmp, path)
 
 
 def load_bow_artifacts(out_dir: str) -> Tuple[List[str], List[np.ndarray], np.ndarray]:
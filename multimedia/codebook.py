@@ -5,7 +5,8 @@ para cuantizar descriptores locales (SIFT, MFCC) en un vocabulario de palabras v
 """
 
 import logging
-from typing import Dict, List, Tuple
+import os
+from typing import Dict, Iterable, List, Tuple
 
 import numpy as np
 from sklearn.cluster import MiniBatchKMeans
@@ -61,6 +62,69 @@ def train_codebook(samples: np.ndarray, k: int = 512, batch_size: int = 1000, se
     return km
 
 
+def train_codebook_streaming(
+    descriptor_blocks: Iterable[np.ndarray],
+    k: int = 512,
+    per_object_cap: int = 2000,
+    global_cap: int = 200000,
+    batch_size: int = 1024,
+    seed: int = 42,
+) -> MiniBatchKMeans:
+    """Entrena el codebook con `partial_fit` a medida que llegan los descriptores.
+
+    A diferencia de `sample_descriptors` + `train_codebook`, nunca se
+    materializa la matriz completa de muestras: cada bloque (un objeto) se
+    submuestrea a `per_object_cap` filas y se acumula hasta completar un
+    mini-batch, que se entrega a `partial_fit` y se descarta. La memoria
+    pico queda en torno a `batch_size + per_object_cap` filas.
+
+    Args:
+        descriptor_blocks: Iterable de matrices de descriptores por objeto
+        k: Número de clusters (tamaño del vocabulario)
+        per_object_cap: Máximo de descriptores a tomar por objeto
+        global_cap: Máximo total de descriptores a consumir
+        batch_size: Tamaño del mini-batch (se fuerza >= k)
+        seed: Semilla aleatoria para reproducibilidad
+
+    Returns:
+        Modelo K-Means entrenado
+    """
+    rng = np.random.default_rng(seed)
+    batch_size = max(batch_size, k)
+    km = MiniBatchKMeans(
+        n_clusters=k, batch_size=batch_size, random_state=seed, n_init=3, reassignment_ratio=0.01
+    )
+    pending: List[np.ndarray] = []
+    n_pending = 0
+    total = 0
+    fitted = False
+    for d in descriptor_blocks:
+        if d.shape[0] == 0:
+            continue
+        take = min(d.shape[0], per_object_cap, global_cap - total)
+        idx = rng.choice(d.shape[0], size=take, replace=False)
+        pending.append(d[idx].astype(np.float32, copy=False))
+        n_pending += take
+        total += take
+        if n_pending >= batch_size:
+            buf = np.vstack(pending)
+            rng.shuffle(buf)
+            full = (buf.shape[0] // batch_size) * batch_size
+            for start in range(0, full, batch_size):
+                km.partial_fit(buf[start:start + batch_size])
+            fitted = True
+            pending = [buf[full:]] if full < buf.shape[0] else []
+            n_pending = buf.shape[0] - full
+        if total >= global_cap:
+            break
+    if n_pending and (fitted or n_pending >= k):
+        km.partial_fit(np.vstack(pending))
+        fitted = True
+    if not fitted:
+        raise ValueError(f"Not enough samples for codebook training ({total} < k={k})")
+    return km
+
+
 def save_codebook(km: MiniBatchKMeans, path: str, modality: str, dim: int):
     """Guarda el codebook entrenado con metadatos.
     
@@ -78,6 +142,20 @@ def save_codebook(km: MiniBatchKMeans, path: str, modality: str, dim: int):
     }
     with open(path, "wb") as f:
         pickle.dump({"model": km, "meta": meta}, f)
+    _save_centroids(path, km.cluster_centers_)
+
+
+def _centroids_path(path: str) -> str:
+    return os.path.splitext(path)[0] + "_centroids_T.npy"
+
+
+def _save_centroids(path: str, centers: np.ndarray) -> None:
+    # Se guarda Cᵀ (dim, k) contiguo. Se escribe aparte y se reemplaza:
+    # otro proceso puede tener el .npy mapeado
+    out = _centroids_path(path)
+    tmp = out + ".tmp.npy"
+    np.save(tmp, np.ascontiguousarray(np.asarray(centers, dtype=np.float32).T))
+    os.replace(tmp, out)
 
 
 def load_codebook(path: str) -> Tuple[MiniBatchKMeans, Dict]:
@@ -92,3 +170,28 @@ def load_codebook(path: str) -> Tuple[MiniBatchKMeans, Dict]:
     with open(path, "rb") as f:
         obj = pickle.load(f)
     return obj["model"], obj["meta"]
+
+
+def load_centroids(path: str) -> np.ndarray:
+    """Carga solo los centroides (k, dim) float32 de un codebook.
+
+    Usa el `.npy` guardado junto al pickle con `mmap_mode="r"` (sin copia,
+    respaldado por el page cache) si es al menos tan reciente como el
+    pickle; si no existe, deserializa el modelo y lo genera.
+
+    En disco está Cᵀ contiguo; se retorna su vista `.T` (k, dim), de modo
+    que `X @ centroids.T` recibe la matriz (dim, k) contigua sin copiarla.
+    """
+    npy = _centroids_path(path)
+    try:
+        if os.stat(npy).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return np.load(npy, mmap_mode="r").T
+    except FileNotFoundError:
+        pass
+    km, _ = load_codebook(path)
+    centers = np.ascontiguousarray(km.cluster_centers_, dtype=np.float32)
+    try:
+        _save_centroids(path, centers)
+    except OSError as e:
+        logger.warning("Could not write %s: %s", npy, e)
+    return centers
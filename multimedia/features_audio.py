@@ -5,7 +5,9 @@ desde archivos de audio utilizando librosa. Los MFCCs son características ampli
 utilizadas en tareas de recuperación y clasificación de audio.
 """
 
+import io
 import logging
+import tempfile
 from typing import List, Tuple
 
 import numpy as np
@@ -34,7 +36,27 @@ def extract_mfcc_descriptors(audio_path: str, sr: int = 22050, duration: float =
     except Exception as e:
         logger.warning("Failed to read audio: %s (%s)", audio_path, e)
         return np.empty((0, n_mfcc), dtype=np.float32)
+    return _mfcc_from_signal(y, sr, n_mfcc, hop_length)
 
+
+def extract_mfcc_descriptors_from_bytes(buf: bytes, suffix: str = "", sr: int = 22050, duration: float = 10.0, n_mfcc: int = 20, hop_length: int = 512) -> np.ndarray:
+    """Igual que `extract_mfcc_descriptors`, pero lee el audio desde memoria.
+
+    soundfile decodifica WAV/FLAC/OGG (y MP3 con libsndfile >= 1.1) desde un
+    buffer; solo si falla se recurre a un archivo temporal con `suffix`
+    para que audioread/ffmpeg pueda abrirlo.
+    """
+    try:
+        y, _sr = librosa.load(io.BytesIO(buf), sr=sr, mono=True, duration=duration)
+    except Exception:
+        with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+            tmp.write(buf)
+            tmp.flush()
+            return extract_mfcc_descriptors(tmp.name, sr=sr, duration=duration, n_mfcc=n_mfcc, hop_length=hop_length)
+    return _mfcc_from_signal(y, sr, n_mfcc, hop_length)
+
+
+def _mfcc_from_signal(y: np.ndarray, sr: int, n_mfcc: int, hop_length: int) -> np.ndarray:
     if y is None or y.size == 0:
         return np.empty((0, n_mfcc), dtype=np.float32)
 
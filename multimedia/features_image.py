@@ -6,6 +6,7 @@ y rotación, ideales para tareas de recuperación de imágenes por contenido.
 """
 
 import logging
+import threading
 from typing import List, Tuple
 
 import cv2
@@ -14,6 +15,18 @@ import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Un detector SIFT por hilo: SIFT_create reserva la pirámide y tablas internas
+# y las instancias de OpenCV no son seguras para compartir entre hilos.
+_local = threading.local()
+
+
+def _get_sift():
+    sift = getattr(_local, "sift", None)
+    if sift is None:
+        sift = cv2.SIFT_create()
+        _local.sift = sift
+    return sift
+
 
 def extract_sift_descriptors(image_path: str, max_keypoints: int = 2000) -> np.ndarray:
     """Extrae descriptores SIFT de una imagen.
@@ -33,9 +46,24 @@ def extract_sift_descriptors(image_path: str, max_keypoints: int = 2000) -> np.n
     if img is None:
         logger.warning("Failed to read image: %s", image_path)
         return np.empty((0, 128), dtype=np.float32)
+    return _sift_from_gray(img, max_keypoints)
+
+
+def extract_sift_descriptors_from_bytes(buf: bytes, max_keypoints: int = 2000) -> np.ndarray:
+    """Igual que `extract_sift_descriptors`, pero decodifica la imagen desde memoria.
+
+    Evita escribir y releer un archivo temporal para las queries de /search.
+    """
+    img = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        logger.warning("Failed to decode image from %d bytes", len(buf))
+        return np.empty((0, 128), dtype=np.float32)
+    return _sift_from_gray(img, max_keypoints)
+
 
+def _sift_from_gray(img: np.ndarray, max_keypoints: int) -> np.ndarray:
     try:
-        sift = cv2.SIFT_create()
+        sift = _get_sift()
     except Exception as e:
         logger.error("SIFT_create failed: %s", e)
         return np.empty((0, 128), dtype=np.float32)
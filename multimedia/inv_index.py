@@ -8,7 +8,7 @@ para acelerar la búsqueda por similitud coseno.
 import logging
 import os
 import pickle
-from typing import Dict, List, Tuple
+from typing import List, Tuple
 
 import numpy as np
 
@@ -16,11 +16,49 @@ import numpy as np
 logger = logging.getLogger(__name__)
 
 
+# Formato en disco (un directorio por índice):
+#   doc_ids.pkl   lista de ids de documento
+#   idf.pkl       vector idf (k,)
+#   offsets.npy   int64 (k, 3): [inicio en postings.bin, bytes de doc ids, df]
+#   scales.npy    float32 (k,): escala de cuantización de cada lista
+#   postings.bin  por palabra: doc ids ascendentes en delta + VByte y luego
+#                 los pesos TF-IDF normalizados cuantizados a uint8
+#                 (peso ≈ q * scale, con q >= 1 para no perder documentos)
+_OFFSETS = "offsets.npy"
+_SCALES = "scales.npy"
+_POSTINGS = "postings.bin"
+
+
+def _vbyte_encode(values: np.ndarray) -> np.ndarray:
+    """Codifica enteros no negativos en VByte (7 bits por byte, bit alto = último byte)."""
+    v = values.astype(np.uint64)
+    nb = 1 + (v >= 1 << 7).astype(np.int64) + (v >= 1 << 14) + (v >= 1 << 21) + (v >= 1 << 28)
+    starts = np.cumsum(nb) - nb
+    vi = np.repeat(np.arange(v.shape[0]), nb)
+    pos = np.arange(vi.shape[0]) - starts[vi]
+    out = ((v[vi] >> (7 * pos).astype(np.uint64)) & 0x7F).astype(np.uint8)
+    out[pos == nb[vi] - 1] |= 0x80
+    return out
+
+
+def _vbyte_decode(buf: np.ndarray) -> np.ndarray:
+    """Inverso de `_vbyte_encode`, vectorizado (sin bucles por valor)."""
+    if buf.shape[0] == 0:
+        return np.empty((0,), dtype=np.int64)
+    ends = (buf & 0x80) != 0
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    gid = np.cumsum(np.concatenate(([0], ends[:-1].astype(np.int64))))
+    pos = np.arange(buf.shape[0]) - starts[gid]
+    payload = (buf & 0x7F).astype(np.int64) << (7 * pos)
+    return np.add.reduceat(payload, starts)
+
+
 def build_inverted_index(doc_ids: List[str], histograms: List[np.ndarray], out_dir: str):
     """Construye un índice invertido a partir de histogramas BoW.
     
     Calcula pesos TF-IDF normalizados y crea listas de posting para cada
-    palabra visual, permitiendo búsquedas KNN eficientes.
+    palabra visual, permitiendo búsquedas KNN eficientes. Todas las listas
+    se guardan comprimidas en un único `postings.bin` (ver formato arriba).
     
     Args:
         doc_ids: Identificadores de documentos
@@ -30,39 +68,87 @@ def build_inverted_index(doc_ids: List[str], histograms: List[np.ndarray], out_d
     os.makedirs(out_dir, exist_ok=True)
     n_docs = len(doc_ids)
     k = histograms[0].shape[0]
-    postings: Dict[int, List[Tuple[int, float]]] = {i: [] for i in range(k)}
     df = np.zeros((k,), dtype=np.int32)
     for d_i, h in enumerate(histograms):
         active = np.where(h > 0)[0]
         df[active] += 1
     idf = np.log((n_docs + 1) / (df + 1)) + 1.0
+    docs_parts: List[np.ndarray] = []
+    words_parts: List[np.ndarray] = []
+    weights_parts: List[np.ndarray] = []
     for d_i, h in enumerate(histograms):
         w = h * idf
         norm = np.linalg.norm(w)
         if norm > 0:
             w = w / norm
         active = np.where(w > 0)[0]
-        for cw in active:
-            postings[cw].append((d_i, float(w[cw])))
+        docs_parts.append(np.full(active.shape[0], d_i, dtype=np.int64))
+        words_parts.append(active)
+        weights_parts.append(w[active])
+    docs = np.concatenate(docs_parts)
+    words = np.concatenate(words_parts)
+    weights = np.concatenate(weights_parts).astype(np.float32)
+    # Agrupar por palabra; el orden estable deja los doc ids ascendentes
+    order = np.argsort(words, kind="stable")
+    docs, words, weights = docs[order], words[order], weights[order]
+    bounds = np.searchsorted(words, np.arange(k + 1))
+
+    offsets = np.zeros((k, 3), dtype=np.int64)
+    scales = np.zeros((k,), dtype=np.float32)
+    chunks: List[bytes] = []
+    pos = 0
+    for cw in range(k):
+        lo, hi = bounds[cw], bounds[cw + 1]
+        d = docs[lo:hi]
+        enc = _vbyte_encode(np.diff(d, prepend=0)).tobytes()
+        w = weights[lo:hi]
+        if hi > lo:
+            scales[cw] = w.max() / 255.0
+            q = np.clip(np.rint(w / scales[cw]), 1, 255).astype(np.uint8)
+        else:
+            q = np.empty((0,), dtype=np.uint8)
+        offsets[cw] = (pos, len(enc), hi - lo)
+        chunks.append(enc + q.tobytes())
+        pos += len(chunks[-1])
+
     with open(os.path.join(out_dir, "doc_ids.pkl"), "wb") as f:
         pickle.dump(doc_ids, f)
     with open(os.path.join(out_dir, "idf.pkl"), "wb") as f:
         pickle.dump(idf, f)
-    term_to_block = {}
-    for cw, plist in postings.items():
-        path = os.path.join(out_dir, f"cw_{cw}.pkl")
-        with open(path, "wb") as f:
-            pickle.dump(plist, f)
-        term_to_block[cw] = path
-    with open(os.path.join(out_dir, "term_to_block.pkl"), "wb") as f:
-        pickle.dump(term_to_block, f)
+    # Reemplazo atómico: un lector puede tener postings.bin mapeado
+    tmp = os.path.join(out_dir, _POSTINGS + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(b"".join(chunks))
+    os.replace(tmp, os.path.join(out_dir, _POSTINGS))
+    tmp = os.path.join(out_dir, "scales.tmp.npy")
+    np.save(tmp, scales)
+    os.replace(tmp, os.path.join(out_dir, _SCALES))
+    tmp = os.path.join(out_dir, "offsets.tmp.npy")
+    np.save(tmp, offsets)
+    os.replace(tmp, os.path.join(out_dir, _OFFSETS))
+
+
+def read_posting(postings: np.ndarray, offsets: np.ndarray, cw: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Decodifica la lista de la palabra `cw`: (doc ids int64, pesos cuantizados uint8).
+
+    El peso real es `q * scales[cw]`; quien acumula puntajes aplica la
+    escala una sola vez por lista.
+    """
+    start, nbytes, df = (int(x) for x in offsets[cw])
+    if df == 0:
+        return np.empty((0,), dtype=np.int64), np.empty((0,), dtype=np.uint8)
+    docs = np.cumsum(_vbyte_decode(postings[start:start + nbytes]))
+    wstart = start + nbytes
+    return docs, postings[wstart:wstart + df]
 
 
 def search_inverted(query_hist: np.ndarray, index_dir: str, top_k: int = 10) -> List[Tuple[str, float]]:
     """Busca los K documentos más similares usando el índice invertido.
     
     Calcula la similitud coseno entre la consulta y los documentos indexados
-    usando acceso eficiente mediante listas de posting.
+    usando acceso eficiente mediante listas de posting.  `postings.bin` se
+    mapea en memoria y solo se decodifican las listas de las palabras
+    activas de la consulta, en orden de df ascendente.
     
     Args:
         query_hist: Histograma BoW de la consulta
@@ -72,40 +158,37 @@ def search_inverted(query_hist: np.ndarray, index_dir: str, top_k: int = 10) ->
     Returns:
         Lista de tuplas (doc_id, score) ordenadas por similitud descendente
     """
+    offsets_path = os.path.join(index_dir, _OFFSETS)
+    if not os.path.exists(offsets_path):
+        raise ValueError(
+            f"Inverted index at {index_dir} uses an old format or is incomplete. "
+            f"Rebuild it via /multimedia/index?index_type=inverted."
+        )
     with open(os.path.join(index_dir, "doc_ids.pkl"), "rb") as f:
         doc_ids = pickle.load(f)
     with open(os.path.join(index_dir, "idf.pkl"), "rb") as f:
         idf = pickle.load(f)
-    with open(os.path.join(index_dir, "term_to_block.pkl"), "rb") as f:
-        t2b = pickle.load(f)
     if idf.shape[0] != query_hist.shape[0]:
         raise ValueError(
             f"Codebook dimensionality mismatch: query_hist has {query_hist.shape[0]} bins "
             f"but index was built with {idf.shape[0]} bins. Rebuild BoW and inverted index "
             f"using the same codebook size."
         )
+    offsets = np.load(offsets_path)
+    scales = np.load(os.path.join(index_dir, _SCALES))
+    postings = np.memmap(os.path.join(index_dir, _POSTINGS), dtype=np.uint8, mode="r") \
+        if offsets[:, 1].any() else np.empty((0,), dtype=np.uint8)
     wq = query_hist * idf
     nq = np.linalg.norm(wq)
     if nq > 0:
         wq = wq / nq
-    scores = {}
+    scores = np.zeros((len(doc_ids),), dtype=np.float64)
     active = np.where(wq > 0)[0]
-    for cw in active:
-        path = t2b.get(int(cw))
-        if not path:
-            continue
-        with open(path, "rb") as f:
-            plist = pickle.load(f)
-        wq_cw = float(wq[cw])
-        for d_i, w_doc in plist:
-            scores[d_i] = scores.get(d_i, 0.0) + wq_cw * w_doc
-    import heapq
-    heap = []
-    for d_i, s in scores.items():
-        if len(heap) < top_k:
-            heapq.heappush(heap, (s, d_i))
-        else:
-            if s > heap[0][0]:
-                heapq.heapreplace(heap, (s, d_i))
-    result = sorted(heap, key=lambda x: -x[0])
-    return [(doc_ids[d_i], float(s)) for s, d_i in result]
+    for cw in active[np.argsort(offsets[active, 2], kind="stable")]:
+        docs, q_doc = read_posting(postings, offsets, int(cw))
+        scores[docs] += (float(wq[cw]) * float(scales[cw])) * q_doc.astype(np.float32)
+    touched = np.flatnonzero(scores)
+    if touched.shape[0] > top_k:
+        touched = touched[np.argpartition(-scores[touched], top_k - 1)[:top_k]]
+    result = sorted(touched.tolist(), key=lambda d_i: -scores[d_i])
+    return [(doc_ids[d_i], float(scores[d_i])) for d_i in result]
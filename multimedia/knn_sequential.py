@@ -7,10 +7,9 @@ Sirve como baseline para comparar con métodos indexados.
 
 import os
 import pickle
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
-from .bow import compute_df
 
 
 def load_bow(out_dir: str):
@@ -69,23 +68,71 @@ def search_sequential(query_hist: np.ndarray, bow_dir: str, top_k: int = 10) ->
     Returns:
         Lista de tuplas (doc_id, score) ordenadas por similitud descendente
     """
+    pre = _load_precomputed(bow_dir)
+    if pre is not None and pre[1].shape[1] == query_hist.shape[0]:
+        doc_ids, W, norms, idf = pre
+        if not doc_ids:
+            return []
+        wq = np.log1p(query_hist).astype(np.float32) * idf
+        nq = np.linalg.norm(wq)
+        if nq > 0:
+            wq /= nq
+        safe = np.where(norms == 0.0, 1.0, norms)
+        scores = (W @ wq) / safe
+        return _top_k(doc_ids, scores, top_k)
+
     doc_ids, hists = load_bow(bow_dir)
     n_docs = len(doc_ids)
+    if n_docs == 0:
+        return []
 
     k = query_hist.shape[0]
-    hists = [h if h.shape[0] == k else (h[:k] if h.shape[0] > k else np.pad(h, (0, k - h.shape[0]), constant_values=0.0)) for h in hists]
+    H = np.zeros((n_docs, k), dtype=np.float32)
+    for i, h in enumerate(hists):
+        m = min(k, h.shape[0])
+        H[i, :m] = h[:m]
 
-    df = compute_df(hists)
+    df = (H > 0).sum(axis=0).astype(np.int32)
     wq = tfidf_normalize(query_hist, df, n_docs)
-    import heapq
-    heap = []
-    for i, h in enumerate(hists):
-        wd = tfidf_normalize(h, df, n_docs)
-        s = float(np.dot(wq, wd))
-        if len(heap) < top_k:
-            heapq.heappush(heap, (s, i))
-        else:
-            if s > heap[0][0]:
-                heapq.heapreplace(heap, (s, i))
-    result = sorted(heap, key=lambda x: -x[0])
-    return [(doc_ids[i], float(s)) for s, i in result]
+    # Misma ponderación que tfidf_normalize, aplicada a todas las filas a la vez
+    idf = (np.log((n_docs + 1) / (df + 1)) + 1.0).astype(np.float32)
+    W = np.log1p(H, out=H)
+    W *= idf
+    norms = np.linalg.norm(W, axis=1)
+    norms[norms == 0.0] = 1.0
+    scores = (W @ wq) / norms
+    return _top_k(doc_ids, scores, top_k)
+
+
+def _top_k(doc_ids: List[str], scores: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+    top = min(top_k, len(doc_ids))
+    best = np.argpartition(-scores, top - 1)[:top]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [(doc_ids[i], float(scores[i])) for i in best]
+
+
+# bow_dir -> (mtime de tfidf.npy, doc_ids, tfidf, doc_norms, idf)
+_precomputed: Dict[str, tuple] = {}
+
+
+def _load_precomputed(bow_dir: str) -> Optional[tuple]:
+    """Carga (y cachea mientras no cambie) los artefactos de `save_bow_artifacts` con mmap."""
+    path = os.path.join(bow_dir, "tfidf.npy")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    hit = _precomputed.get(bow_dir)
+    if hit is not None and hit[0] == mtime:
+        return hit[1:]
+    with open(os.path.join(bow_dir, "doc_ids.pkl"), "rb") as f:
+        doc_ids = pickle.load(f)
+    entry = (
+        mtime,
+        doc_ids,
+        np.load(path, mmap_mode="r"),
+        np.load(os.path.join(bow_dir, "doc_norms.npy"), mmap_mode="r"),
+        np.load(os.path.join(bow_dir, "idf.npy"), mmap_mode="r"),
+    )
+    _precomputed[bow_dir] = entry
+    return entry[1:]
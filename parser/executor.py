@@ -10,7 +10,7 @@ from __future__ import annotations
 
 from typing import Any, Dict, List, Optional
 import os
-from indexes.spimi import search_topk
+from indexes.spimi import docid_to_rid, search_topk
 
 from storage.database import Database
 from .planner import Plan
@@ -71,8 +71,7 @@ class QueryExecutor:
                 out_rows = []
                 for docid, score in results:
                     try:
-                        page_str, slot_str = docid.split("_")
-                        rid = (int(page_str), int(slot_str))
+                        rid = docid_to_rid(docid)
                         rec = table.fetch_by_rid(rid)
                         # Build a result object including score and rid
                         out_rows.append({
@@ -90,8 +89,7 @@ class QueryExecutor:
             if stmt.condition is None:
                 out: List[Dict[str, Any]] = []
                 pc = table.datafile.page_count()
-                for pid in range(pc):
-                    page = table.datafile.read_page(pid)
+                for _pid, page in table.datafile.iter_pages(0, pc, prefetch=32):
                     out.extend(page.iter_records())
                 rows = out
         if stmt.columns == ['*']:
@@ -131,7 +129,8 @@ class QueryExecutor:
         positional_values = stmt.values.get("__positional__", [])
         explicit_columns = stmt.values.get("__columns__", None)
 
-        if explicit_columns:ns}")
+        if explicit_columns:
+            print(f"🔍 INSERT columnas explícitas: {explicit_columns}")
             print(f"🔍 INSERT valores posicionales: {positional_values}")
 
             if len(explicit_columns) != len(positional_values):
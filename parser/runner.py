@@ -8,15 +8,18 @@ Integra tokenización, parsing, planificación y ejecución:
 """
 from __future__ import annotations
 
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from engine import DatabaseEngine
+from storage.database import Database
 from .parser import SQLParser
 from .planner import QueryPlanner
 from .executor import QueryExecutor
 
 
-def run_sql(root_dir: str, user_id: str, db_name: str, sql: str) -> Dict[str, Any]:
+def run_sql(root_dir: str, user_id: str, db_name: str, sql: str,
+            engine: Optional[DatabaseEngine] = None,
+            db: Optional[Database] = None) -> Dict[str, Any]:
     """Ejecuta una sentencia SQL completa.
     
     Args:
@@ -24,14 +27,18 @@ def run_sql(root_dir: str, user_id: str, db_name: str, sql: str) -> Dict[str, An
         user_id: Identificador del usuario.
         db_name: Nombre de la base de datos.
         sql: Sentencia SQL a ejecutar.
+        engine: Motor ya creado (p. ej. el compartido de la API); si se
+            omite se crea uno sobre `root_dir`.
+        db: Base de datos ya abierta; si se omite se abre (o crea) con el motor.
     
     Returns:
         Diccionario con los resultados de la ejecución.
     """
-    eng = DatabaseEngine(root_dir)
-    db = eng.get_database(user_id, db_name)
     if db is None:
-        db = eng.create_database(user_id, db_name)
+        eng = engine if engine is not None else DatabaseEngine(root_dir)
+        db = eng.get_database(user_id, db_name)
+        if db is None:
+            db = eng.create_database(user_id, db_name)
 
     stmt = SQLParser(sql).parse()
     planner = QueryPlanner(db)
@@ -9,7 +9,7 @@ from __future__ import annotations
 
 import os
 import json
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
 from core.schema import TableSchema
 from .table import Table
@@ -17,9 +17,13 @@ from .table import Table
 
 class Database:
     """Representa una base de datos en disco con catálogo de tablas."""
-    def __init__(self, base_dir: str, name: str):
+    def __init__(self, base_dir: str, name: str,
+                 open_table: Optional[Callable[[str, str], Optional[Table]]] = None):
+        """`open_table(nombre, dir)` permite reutilizar tablas ya abiertas
+        (p. ej. la caché de la API) en vez de deserializar sus índices."""
         self.base_dir = os.path.abspath(base_dir)
         self.name = name
+        self._open_table = open_table
         os.makedirs(self.base_dir, exist_ok=True)
         self.meta_path = os.path.join(self.base_dir, "metadata.json")
         self.tables: Dict[str, Table] = {}
@@ -37,6 +41,11 @@ class Database:
             meta = {"tables": []}
         for tname in meta.get("tables", []):
             tdir = os.path.join(self.base_dir, "tables", tname)
+            if self._open_table is not None:
+                table = self._open_table(tname, tdir)
+                if table is not None:
+                    self.tables[tname] = table
+                continue
             schema_path = os.path.join(tdir, "schema.json")
             if os.path.exists(schema_path):
                 schema = TableSchema.load(schema_path)
@@ -10,7 +10,9 @@ from disk_manager import PAGE_SIZE_DEFAULT
 
 import os
 import json
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+from functools import cached_property, wraps
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from core.schema import TableSchema
 from core.types import convert_value
@@ -24,6 +26,15 @@ from datafile import DataFile
 from metrics import stats
 
 
+def _locked(method):
+    """Ejecuta el método con el lock de la tabla (escrituras e índices)."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class Table:
     """Tabla almacenada en disco con soporte para múltiples tipos de índices.
     
@@ -45,6 +56,14 @@ class Table:
         # Almacenamiento físico
         self.datafile = DataFile(self.data_path, page_size=self.page_size)
 
+        # La API comparte una misma Table entre peticiones concurrentes (ver
+        # api.deps): el lock serializa las escrituras y todo acceso a los
+        # índices en memoria, que no son thread-safe (p. ej. el R-Tree
+        # reconstruye su matriz al leer). Las lecturas de páginas no lo
+        # toman: la caché de páginas del DataFile tiene su propio lock.
+        # `column_type_map` tampoco: es puro y cualquier carrera calcula lo mismo.
+        self.lock = threading.RLock()
+
         # Índices por columna
         self.indexes: Dict[str, Any] = {}
         self._initialize_indexes()
@@ -53,6 +72,11 @@ class Table:
         if not os.path.exists(self.schema_path):
             self.schema.save(self.schema_path)
 
+    @cached_property
+    def column_type_map(self) -> Dict[str, str]:
+        """Mapa columna -> nombre del tipo (p. ej. 'INT'), calculado una vez por tabla."""
+        return {c.name: c.col_type.name for c in self.schema.columns}
+
     def _initialize_indexes(self):
         """Carga índices existentes desde disco o crea nuevos según el esquema."""
         for col_name, idx_type in self.schema.indexes.items():
@@ -79,28 +103,35 @@ class Table:
                     idx_obj = None
 
             if idx_obj is None:
-                is_clustered = self.schema.get_column(col_name).primary_key
-                if idx_type.name.lower() == 'btree':
-                    idx_obj = BPlusTree(degree=5, is_clustered=is_clustered)
-                elif idx_type.name.lower() == 'isam':
-                    idx_obj = ISAM(page_size=10, is_clustered=is_clustered)
-                    print(f"🔨 ISAM creado para '{col_name}' (page_size=10)")
-                elif idx_type.name.lower() == 'hash':
-                    idx_obj = ExtHashing(is_clustered=is_clustered)
-                elif idx_type.name.lower() == 'rtree':
-                    idx_obj = RTreeIndex(dimensions=self._infer_dimensions_for(col_name))
-                elif idx_type.name.lower() in ('fulltext', 'inverted'):
-                    idx_obj = InvertedIndex(do_stem=True)
-                else:
-                    idx_obj = AVL(is_clustered=is_clustered)
+                idx_obj = self._new_index(col_name, idx_type)
 
             self.indexes[col_name] = idx_obj
 
+    def _new_index(self, col_name: str, idx_type: Any) -> Any:
+        """Crea un índice vacío del tipo declarado para la columna."""
+        is_clustered = self.schema.get_column(col_name).primary_key
+        if idx_type.name.lower() == 'btree':
+            return BPlusTree(degree=5, is_clustered=is_clustered)
+        elif idx_type.name.lower() == 'isam':
+            print(f"🔨 ISAM creado para '{col_name}' (page_size=10)")
+            return ISAM(page_size=10, is_clustered=is_clustered)
+        elif idx_type.name.lower() == 'hash':
+            return ExtHashing(is_clustered=is_clustered)
+        elif idx_type.name.lower() == 'rtree':
+            return RTreeIndex(dimensions=self._infer_dimensions_for(col_name))
+        elif idx_type.name.lower() in ('fulltext', 'inverted'):
+            return InvertedIndex(do_stem=True)
+        else:
+            return AVL(is_clustered=is_clustered)
+
+    @_locked
     def build_indexes_from_datafile(self):
-        """Reconstruye todos los índices leyendo los registros completos del DataFile."""
-        print(f"🔨 Construyendo índices desde datafile para '{self.schema.name}'...")
+        """Reconstruye todos los índices leyendo los registros completos del DataFile.
 
-        all_records: List[Tuple[Tuple[int, int], Dict[str, Any]]] = []
+        Parte de índices vacíos: los registros que ya estaban indexados no
+        quedan duplicados.
+        """
+        print(f"🔨 Construyendo índices desde datafile para '{self.schema.name}'...")
 
         try:
             pc = self.datafile.page_count()
@@ -108,70 +139,64 @@ class Table:
             print("⚠️ No hay páginas en el datafile")
             return
 
-        for page_id in range(pc):
-            page = self.datafile.read_page(page_id)
-            records = page.iter_records()
-            for slot, rec_dict in enumerate(records):
+        self.indexes = {col: self._new_index(col, self.schema.indexes[col]) for col in self.indexes}
+
+        # Un solo recorrido secuencial del DataFile: cada registro se reparte
+        # a todos los índices. ISAM e InvertedIndex se construyen en bloque
+        # y acumulan pares; el resto recibe `add` directamente.
+        idx_types = {col: self.schema.indexes[col].name.lower() for col in self.indexes}
+        pairs: Dict[str, List[Tuple[Any, Tuple[int, int]]]] = {
+            col: [] for col, t in idx_types.items() if t in ('isam', 'fulltext', 'inverted')
+        }
+        direct = [(col, idx, idx_types[col] == 'rtree') for col, idx in self.indexes.items() if col not in pairs]
+
+        total = 0
+        for page_id, page in self.datafile.iter_pages(0, pc, prefetch=8):
+            for slot, rec_dict in enumerate(page.iter_records()):
                 rid = (page_id, slot)
-                all_records.append((rid, rec_dict))
+                total += 1
+                for col_name, acc in pairs.items():
+                    key = rec_dict.get(col_name)
+                    if key is not None:
+                        acc.append((key, rid))
+                for col_name, idx, is_rtree in direct:
+                    key = rec_dict.get(col_name)
+                    if key is not None:
+                        if is_rtree and isinstance(key, str):
+                            key = [float(p.strip()) for p in key.split(',')]
+                        idx.add(key, rid)
 
-        print(f"📊 Total de registros en datafile: {len(all_records)}")
+        print(f"📊 Total de registros en datafile: {total}")
 
         for col_name, idx in self.indexes.items():
-            idx_type = self.schema.indexes[col_name].name.lower()
+            idx_type = idx_types[col_name]
 
             if idx_type == 'isam':
-                pairs = []
-                for rid, rec_dict in all_records:
-                    key = rec_dict.get(col_name)
-                    if key is not None:
-                        pairs.append((key, rid))
-
-                if pairs:
-                    print(f"🔨 Construyendo ISAM para '{col_name}' con {len(pairs)} pares...")
-                    idx.build_from_pairs(pairs)
+                col_pairs = pairs[col_name]
+                if col_pairs:
+                    print(f"🔨 Construyendo ISAM para '{col_name}' con {len(col_pairs)} pares...")
+                    idx.build_from_pairs(col_pairs)
                     stats_info = idx.get_stats()
                     print(f"✅ ISAM construido: {stats_info}")
                 else:
                     print(f"⚠️ No hay datos para ISAM en '{col_name}'")
 
             elif idx_type == 'btree':
-                for rid, rec_dict in all_records:
-                    key = rec_dict.get(col_name)
-                    if key is not None:
-                        idx.add(key, rid)
-                print(f"✅ BTree construido para '{col_name}' con {len(all_records)} registros")
+                print(f"✅ BTree construido para '{col_name}' con {total} registros")
 
             elif idx_type == 'rtree':
-                for rid, rec_dict in all_records:
-                    key = rec_dict.get(col_name)
-                    if key is not None:
-                        if not isinstance(key, (list, tuple)):
-                            if isinstance(key, str):
-                                parts = [p.strip() for p in key.split(',')]
-                                key = [float(p) for p in parts]
-                        idx.add(key, rid)
-                print(f"✅ RTree construido para '{col_name}' con {len(all_records)} registros")
+                print(f"✅ RTree construido para '{col_name}' con {total} registros")
 
             elif idx_type in ('fulltext', 'inverted'):
-                pairs = []
-                for rid, rec_dict in all_records:
-                    key = rec_dict.get(col_name)
-                    if key is not None:
-                        pairs.append((key, rid))
-
-                if pairs:
-                    print(f"🔨 Construyendo InvertedIndex para '{col_name}' con {len(pairs)} documentos...")
-                    idx.build_from_pairs(pairs)
+                col_pairs = pairs[col_name]
+                if col_pairs:
+                    print(f"🔨 Construyendo InvertedIndex para '{col_name}' con {len(col_pairs)} documentos...")
+                    idx.build_from_pairs(col_pairs)
                     print(f"✅ InvertedIndex construido para '{col_name}' (terms={len(idx.get_terms())})")
                 else:
                     print(f"⚠️ No hay datos para InvertedIndex en '{col_name}'")
 
             else:
-                for rid, rec_dict in all_records:
-                    key = rec_dict.get(col_name)
-                    if key is not None:
-                        idx.add(key, rid)
                 print(f"✅ {idx_type.upper()} construido para '{col_name}'")
 
         for col_name, idx in self.indexes.items():
@@ -206,37 +231,66 @@ class Table:
 
     def insert(self, values: Dict[str, Any]) -> Tuple[int, int]:
         """Inserta un registro validado en la tabla y actualiza todos los índices."""
+        return self.insert_returning(values)[0]
+
+    @_locked
+    def insert_returning(self, values: Dict[str, Any]) -> Tuple[Tuple[int, int], Dict[str, Any]]:
+        """Como `insert`, pero retorna también el registro normalizado tal como se escribió.
+
+        Evita releer la página (`fetch_by_rid`) para devolver el registro.
+        """
         stats.inc("table.insert.calls")
         with stats.timer("table.insert.time"):
             rec = Record(self.schema, values)
             rec_dict = rec.to_dict()
 
             rid = self.datafile.insert_clustered(rec_dict)
-
-            for col in self.schema.columns:
-                if col.name in self.indexes:
-                    key = rec.values[col.name]
-                    if key is None:
-                        continue
-
-                    tree = self.indexes[col.name]
-
-                    try:
-                        if isinstance(tree, RTreeIndex):
-                            if not isinstance(key, (list, tuple)):
-                                if isinstance(key, str):
-                                    parts = [p.strip() for p in key.split(',')]
-                                    key = [float(p) for p in parts]
-                            tree.add(key, rid)
-                        elif isinstance(tree, InvertedIndex):
-                            tree.add(key, rid)
-                        else:
-                            tree.add(key, rid)
-                    except Exception as e:
-                        print(f"⚠️ Error actualizando índice {col.name}: {e}")
+            self._index_record(rec.values, rid)
 
             self._save_indexes()
-            return rid
+            return rid, rec_dict
+
+    @_locked
+    def insert_many(self, values_list: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+        """Inserta varios registros actualizando los índices incrementalmente.
+
+        Valida todos los registros antes de escribir (un error no deja
+        inserciones a medias), los escribe al DataFile con una sola
+        apertura y guarda los índices una única vez al final.
+        """
+        stats.inc("table.insert_many.calls")
+        with stats.timer("table.insert_many.time"):
+            recs = [Record(self.schema, values) for values in values_list]
+            rids = self.datafile.insert_many_clustered([rec.to_dict() for rec in recs])
+            for rec, rid in zip(recs, rids):
+                self._index_record(rec.values, rid)
+            if rids:
+                self._save_indexes()
+            return rids
+
+    def _index_record(self, values: Dict[str, Any], rid: Tuple[int, int]) -> None:
+        """Agrega un registro recién escrito a todos los índices de la tabla."""
+        for col in self.schema.columns:
+            if col.name in self.indexes:
+                key = values[col.name]
+                if key is None:
+                    continue
+
+                tree = self.indexes[col.name]
+
+                try:
+                    if isinstance(tree, RTreeIndex):
+                        if not isinstance(key, (list, tuple)):
+                            if isinstance(key, str):
+                                parts = [p.strip() for p in key.split(',')]
+                                key = [float(p) for p in parts]
+                        tree.add(key, rid)
+                    elif isinstance(tree, InvertedIndex):
+                        tree.add(key, rid)
+                    else:
+                        tree.add(key, rid)
+                except Exception as e:
+                    print(f"⚠️ Error actualizando índice {col.name}: {e}")
 
     def insert_bulk(self, values_list: List[Dict[str, Any]], rebuild_indexes: bool = True) -> List[Tuple[int, int]]:
         """Inserta múltiples registros en lote, reconstruyendo índices al final si rebuild_indexes es True."""
@@ -246,16 +300,7 @@ class Table:
 
             if rebuild_indexes:
                 print(f"🔨 Insertando {len(values_list)} registros en modo BULK...")
-                original_indexes = self.indexes
-                self.indexes = {}  # Desactivar índices
-
-                for values in values_list:
-                    rec = Record(self.schema, values)
-                    rec_dict = rec.to_dict()
-                    rid = self.datafile.insert_clustered(rec_dict)
-                    rids.append(rid)
-
-                self.indexes = original_indexes
+                rids = self.append_records(values_list)
 
                 print(f"✅ {len(rids)} registros insertados en datafile")
                 print(f"🔨 Reconstruyendo índices desde datafile...")
@@ -270,6 +315,37 @@ class Table:
             return rids
 
 
+    def append_records(self, values_list: Iterable[Dict[str, Any]]) -> List[Tuple[int, int]]:
+        """Escribe registros validados en el DataFile sin actualizar los índices.
+
+        Pensado para cargas por lotes: tras el último lote se debe llamar a
+        `build_indexes_from_datafile()` una sola vez.
+        """
+        return [rid for rid, _ in self.append_records_iter(values_list)]
+
+    def append_records_iter(self, values_list: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        """Como `append_records`, pero entrega cada `(rid, registro)` al escribirlo.
+
+        Permite alimentar otras estructuras (p. ej. bloques SPIMI) en la
+        misma pasada de inserción, sin releer el DataFile.
+        """
+        for values in values_list:
+            rec_dict = Record(self.schema, values).to_dict()
+            with self.lock:
+                rid = self.datafile.insert_clustered(rec_dict)
+            yield rid, rec_dict
+
+    @_locked
+    def rollback_to(self, mark: Tuple[int, Optional[bytes]], reindex: bool = False) -> None:
+        """Deshace las escrituras posteriores a `datafile.mark()` (carga fallida).
+
+        Con `reindex` los índices, que ya habían recibido esas filas, se
+        reconstruyen desde el DataFile restaurado.
+        """
+        self.datafile.truncate_to(mark)
+        if reindex:
+            self.build_indexes_from_datafile()
+
     def _pick_index(self, column: str) -> Optional[Any]:
         """Retorna el índice asociado a una columna, si existe."""
         return self.indexes.get(column)
@@ -293,8 +369,7 @@ class Table:
                     pc = self.datafile.page_count()
                 except Exception:
                     return []
-                for pid in range(pc):
-                    page = self.datafile.read_page(pid)
+                for _pid, page in self.datafile.iter_pages(0, pc, prefetch=32):
                     recs = page.iter_records()
                     for r in recs:
                         if r.get(column) == key:
@@ -302,7 +377,8 @@ class Table:
                 return out
 
             print(f"🔍 Buscando en {type(tree).__name__} columna='{column}', key={key}")
-            rids = tree.search(key)
+            with self.lock:
+                rids = tree.search(key)
             print(f"🔍 Índice retornó {len(rids)} RIDs")
 
             results = [self.fetch_by_rid(rid) for rid in rids]
@@ -330,7 +406,8 @@ class Table:
                 rids = []
             else:
                 print(f"🔍 Range search en {type(tree).__name__}: [{begin_key}, {end_key}]")
-                rids = tree.range_search(begin_key, end_key)
+                with self.lock:
+                    rids = tree.range_search(begin_key, end_key)
                 print(f"🔍 Range retornó {len(rids)} RIDs")
 
             return [self.fetch_by_rid(rid) for rid in rids]
@@ -344,7 +421,8 @@ class Table:
             if isinstance(center, str):
                 parts = [p.strip() for p in center.split(',')]
                 center = [float(p) for p in parts]
-        rids = tree.range_search_radius(center, float(radius))
+        with self.lock:
+            rids = tree.range_search_radius(center, float(radius))
         return [self.fetch_by_rid(rid) for rid in rids]
 
     def knn(self, column: str, center: Any, k: int) -> List[Dict[str, Any]]:
@@ -356,9 +434,11 @@ class Table:
             if isinstance(center, str):
                 parts = [p.strip() for p in center.split(',')]
                 center = [float(p) for p in parts]
-        rids = tree.knn(center, int(k))
+        with self.lock:
+            rids = tree.knn(center, int(k))
         return [self.fetch_by_rid(rid) for rid in rids]
 
+    @_locked
     def delete(self, column: str, key: Any) -> int:
         """Elimina registros que coincidan con una clave en una columna indexada."""
         stats.inc("table.delete.calls")
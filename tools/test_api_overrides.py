@@ -0,0 +1,44 @@
+"""Los tests de la API sustituyen el motor y la autenticación con
+`app.dependency_overrides`; esto verifica que las rutas lo respetan."""
+from __future__ import annotations
+
+from fastapi.testclient import TestClient
+
+from api.app import create_app
+from api.auth import get_current_user
+from api.deps import get_engine
+from engine import DatabaseEngine
+
+
+def test_dependency_overrides_apply(tmp_path):
+    app = create_app()
+    engine = DatabaseEngine(str(tmp_path))
+    app.dependency_overrides[get_engine] = lambda: engine
+    app.dependency_overrides[get_current_user] = lambda: "tester"
+    c = TestClient(app)
+
+    r = c.post("/users/tester/databases", json={"name": "db1"})
+    assert r.status_code == 201, r.text
+    assert (tmp_path / "data" / "users" / "tester" / "databases" / "db1").is_dir()
+    assert [d["name"] for d in c.get("/users/tester/databases").json()] == ["db1"]
+    # Sin token: la autenticación sustituida también cubre el control de acceso
+    assert c.get("/users/otro/databases").status_code == 403
+
+
+def test_concurrent_registrations_keep_every_user(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    app = create_app()
+    engine = DatabaseEngine(str(tmp_path))
+    app.dependency_overrides[get_engine] = lambda: engine
+    c = TestClient(app)
+    names = [f"user{i}" for i in range(8)]
+
+    def register(name):
+        return c.post("/users/register", json={"username": name, "password": "secreto123"}).status_code
+
+    with ThreadPoolExecutor(len(names)) as ex:
+        assert list(ex.map(register, names)) == [201] * len(names)
+    assert sorted(u["username"] for u in c.get("/users").json()) == names
+    assert register("user0") == 400
+    login = c.post("/users/login", json={"username": "user3", "password": "secreto123"})
+    assert login.status_code == 200 and login.json()["access_token"]
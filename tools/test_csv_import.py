@@ -0,0 +1,148 @@
+"""Carga CSV: una fila inválida a mitad de archivo no deja filas escritas
+(la carga es todo o nada)."""
+from __future__ import annotations
+
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api.csv_import as csv_import
+from api.app import create_app
+from api.auth import get_current_user
+from api.deps import get_engine
+from engine import DatabaseEngine
+
+
+@pytest.mark.parametrize("bulk", ["true", "false"])
+def test_bad_row_after_first_batch_rolls_back(tmp_path, monkeypatch, bulk):
+    monkeypatch.setattr(csv_import, "_CSV_BATCH", 2)
+    app = create_app()
+    engine = DatabaseEngine(str(tmp_path))
+    app.dependency_overrides[get_engine] = lambda: engine
+    app.dependency_overrides[get_current_user] = lambda: "tester"
+    c = TestClient(app)
+    base = "/users/tester/databases/db/tables/t"
+
+    assert c.post("/users/tester/databases", json={"name": "db"}).status_code == 201
+    r = c.post("/users/tester/databases/db/tables", json={
+        "name": "t",
+        "columns": [{"name": "id", "type": "INT", "primary_key": True},
+                    {"name": "v", "type": "ARRAY_FLOAT", "nullable": True}],
+        "indexes": [{"type": "BTREE", "column": "id"}],
+    })
+    assert r.status_code in (200, 201), r.text
+    load = lambda text: c.post(base + "/load-csv", params={"bulk": bulk},
+                               files={"file": ("a.csv", text, "text/csv")})
+    assert load('id,v\n100,"[0,0]"\n').status_code == 200
+
+    # Filas 1-4 llenan dos lotes; la 5 tiene un vector inválido
+    csv_text = 'id,v\n1,"[1,2]"\n2,"[3,4]"\n3,"[5,6]"\n4,"[7,8]"\n5,"[9,x]"\n6,"[1,1]"\n'
+    r = load(csv_text)
+    assert r.status_code == 400
+    assert "row 6" in r.json()["detail"]
+    # Nada de la carga fallida queda en el DataFile ni en los índices
+    assert [row["id"] for row in c.get(base + "/records").json()["rows"]] == [100]
+    assert c.get(base + "/records/search", params={"column": "id", "key": "1"}).json()["rows"] == []
+
+    # Reintentar con el archivo corregido no duplica filas
+    assert load(csv_text.replace("[9,x]", "[9,9]")).status_code == 200
+    assert c.get(base + "/records").json()["count"] == 7
+    for key in (1, 5, 6, 100):
+        rows = c.get(base + "/records/search", params={"column": "id", "key": str(key)}).json()["rows"]
+        assert [row["id"] for row in rows] == [key]
+
+
+def test_spimi_build_keeps_published_column_index(tmp_path):
+    # spimi_index se publica con hardlinks a spimi_index_<col>: un build
+    # posterior no debe reescribir esos archivos en sitio
+    app = create_app()
+    engine = DatabaseEngine(str(tmp_path))
+    app.dependency_overrides[get_engine] = lambda: engine
+    app.dependency_overrides[get_current_user] = lambda: "tester"
+    c = TestClient(app)
+    base = "/users/tester/databases/db/tables/t"
+
+    c.post("/users/tester/databases", json={"name": "db"})
+    c.post("/users/tester/databases/db/tables", json={
+        "name": "t",
+        "columns": [{"name": "id", "type": "INT", "primary_key": True},
+                    {"name": "a", "type": "VARCHAR", "length": 60},
+                    {"name": "b", "type": "VARCHAR", "length": 60}],
+        "indexes": [{"type": "FULLTEXT", "column": "a"}],
+    })
+    csv_text = "id,a,b\n1,gato negro,luna llena\n2,perro blanco,sol rojo\n"
+    assert c.post(base + "/load-csv", files={"file": ("a.csv", csv_text, "text/csv")}).status_code == 202
+
+    col_meta = tmp_path / "data/users/tester/databases/db/tables/t/spimi_index_a/meta.json"
+    before = col_meta.read_bytes()
+    assert c.post(base + "/spimi/build", params={"column": "b"}).status_code == 200
+    assert col_meta.read_bytes() == before
+    assert [x["record"]["id"] for x in c.get(base + "/spimi/search", params={"query": "luna"}).json()["results"]] == [1]
+
+
+def test_arrow_stream_handles_late_type_change_and_ragged_row(tmp_path, monkeypatch):
+    # Bloques de Arrow chicos: los problemas aparecen después del primer bloque
+    monkeypatch.setattr(csv_import, "_ARROW_BLOCK", 1 << 10)
+    app = create_app()
+    engine = DatabaseEngine(str(tmp_path))
+    app.dependency_overrides[get_engine] = lambda: engine
+    app.dependency_overrides[get_current_user] = lambda: "tester"
+    c = TestClient(app)
+    base = "/users/tester/databases/db/tables/t"
+
+    c.post("/users/tester/databases", json={"name": "db"})
+    c.post("/users/tester/databases/db/tables", json={
+        "name": "t",
+        "columns": [{"name": "id", "type": "INT", "primary_key": True},
+                    {"name": "name", "type": "VARCHAR", "length": 20}],
+        "indexes": [{"type": "BTREE", "column": "id"}],
+    })
+    # 'extra' no está en el esquema y pasa de entero a texto; la fila 400 es corta
+    lines = ["id,name,extra"]
+    for i in range(1, 501):
+        if i == 400:
+            lines.append(f"{i}")
+        else:
+            lines.append(f"{i},n{i},{i if i < 300 else 'x' + str(i)}")
+    csv_text = "\n".join(lines) + "\n"
+    r = c.post(base + "/load-csv", files={"file": ("a.csv", csv_text, "text/csv")})
+    assert r.status_code == 200, r.text
+    assert r.json()["inserted"] == 500
+    rows = c.get(base + "/records/search", params={"column": "id", "key": "400"}).json()["rows"]
+    assert [(row["id"], row["name"]) for row in rows] == [(400, "")]
+    rows = c.get(base + "/records/search", params={"column": "id", "key": "450"}).json()["rows"]
+    assert [row["name"] for row in rows] == ["n450"]
+
+
+def test_load_blocks_do_not_clobber_pending_merge(tmp_path):
+    # Una carga nueva no debe borrar los bloques que otra sigue fusionando
+    app = create_app()
+    engine = DatabaseEngine(str(tmp_path))
+    app.dependency_overrides[get_engine] = lambda: engine
+    app.dependency_overrides[get_current_user] = lambda: "tester"
+    c = TestClient(app)
+    c.post("/users/tester/databases", json={"name": "db"})
+    c.post("/users/tester/databases/db/tables", json={
+        "name": "t",
+        "columns": [{"name": "id", "type": "INT", "primary_key": True},
+                    {"name": "a", "type": "VARCHAR", "length": 60}],
+        "indexes": [{"type": "FULLTEXT", "column": "a"}],
+    })
+    table = engine.get_database("tester", "db").get_table("t")
+    table.append_records([{"id": 1, "a": "gato negro"}])
+    first = csv_import._open_spimi_writers(table, ["a"])
+    first_jobs = csv_import._spimi_jobs(table, first)
+    first_seq = csv_import._next_ft_load(table.base_dir)
+    second = csv_import._open_spimi_writers(table, ["a"])
+    assert os.listdir(first_jobs[0][0])  # bloques de la primera carga intactos
+    second_jobs = csv_import._spimi_jobs(table, second)
+    second_seq = csv_import._next_ft_load(table.base_dir)
+
+    canonical = os.path.join(table.base_dir, "spimi_index")
+    csv_import._build_ft_indexes(second_jobs, canonical, table.base_dir, second_seq)
+    published = os.path.getmtime(os.path.join(canonical, "meta.json"))
+    # La fusión de la carga anterior llega tarde: no pisa la publicada
+    csv_import._build_ft_indexes(first_jobs, canonical, table.base_dir, first_seq)
+    assert os.path.getmtime(os.path.join(canonical, "meta.json")) == published
+    assert not any(n.startswith("spimi_blocks_") for n in os.listdir(table.base_dir))
@@ -0,0 +1,107 @@
+from datafile import DataFile
+
+
+def test_insert_many_matches_single_inserts(tmp_path):
+    # Batched clustered insert must assign the same (page, slot) RIDs as one-by-one inserts
+    recs = [{"id": i, "txt": "x" * (i % 40)} for i in range(200)]
+    single = DataFile(str(tmp_path / "single.dat"), page_size=512)
+    batched = DataFile(str(tmp_path / "batched.dat"), page_size=512)
+    rids_single = [single.insert_clustered(r) for r in recs[:7]] + [single.insert_clustered(r) for r in recs[7:]]
+    rids_batched = [batched.insert_clustered(r) for r in recs[:7]] + batched.insert_many_clustered(recs[7:])
+    assert rids_batched == rids_single
+    assert batched.page_count() == single.page_count() > 1
+    for (pid, slot), rec in zip(rids_batched, recs):
+        assert batched.read_record(pid, slot) == rec
+
+
+def test_read_pages_preserves_order(tmp_path):
+    df = DataFile(str(tmp_path / "t.dat"), page_size=256)
+    df.insert_many_clustered([{"id": i, "pad": "y" * 30} for i in range(120)])
+    pc = df.page_count()
+    order = list(range(pc))[::-1] + [0]
+    pages = list(df.read_pages(order, workers=3))
+    assert [p.iter_records() for p in pages] == [df.read_page(pid).iter_records() for pid in order]
+
+
+def test_page_cache_sees_writes(tmp_path):
+    df = DataFile(str(tmp_path / "c.dat"), page_size=256)
+    df.insert_clustered({"id": 0})
+    assert df.read_page(0).iter_records() == [{"id": 0}]
+    assert df.read_page(0).iter_records() == [{"id": 0}]
+    df.insert_clustered({"id": 1})
+    assert df.read_page(0).iter_records() == [{"id": 0}, {"id": 1}]
+    # Otro DataFile (p. ej. otra Table abierta) sobre el mismo archivo
+    DataFile(df.path, page_size=256).insert_many_clustered([{"id": 2}])
+    assert df.read_page(0).iter_records() == [{"id": 0}, {"id": 1}, {"id": 2}]
+
+
+def test_page_cache_hits_count_disk_reads(tmp_path):
+    from metrics import stats
+    df = DataFile(str(tmp_path / "h.dat"), page_size=256)
+    df.insert_clustered({"id": 0})
+    stats.reset()
+    df.read_page(0)
+    df.read_page(0)
+    assert stats.get_counter("io.page_cache.hits") == 1
+    assert stats.get_counter("disk.reads") == 2
+
+
+def test_iter_pages_windows_match_read_page(tmp_path):
+    df = DataFile(str(tmp_path / "w.dat"), page_size=256)
+    df.insert_many_clustered([{"id": i, "pad": "z" * 20} for i in range(300)])
+    pc = df.page_count()
+    expected = [(pid, df.read_page(pid).iter_records()) for pid in range(pc)]
+    for prefetch in (1, 3, 8, 64):
+        got = [(pid, page.iter_records()) for pid, page in df.iter_pages(prefetch=prefetch)]
+        assert got == expected
+    assert [p.iter_records() for p in df.read_window(2, 5)] == [r for _, r in expected[2:5]]
+
+
+def test_scans_reuse_pool_slabs(tmp_path, monkeypatch):
+    import datafile
+    df = DataFile(str(tmp_path / "s.dat"), page_size=256)
+    df.insert_many_clustered([{"id": i, "pad": "z" * 20} for i in range(300)])
+    slabs = []
+    real = datafile._window_slab
+
+    def spy(nbytes):
+        mv = real(nbytes)
+        slabs.append(mv.obj)
+        return mv
+    monkeypatch.setattr(datafile, "_window_slab", spy)
+    list(df.iter_pages(prefetch=4))
+    first = {id(s) for s in slabs}
+    slabs.clear()
+    list(df.iter_pages(prefetch=4))
+    # Los hilos del pool persisten: el segundo recorrido no asigna slabs nuevos
+    assert {id(s) for s in slabs} <= first
+    assert len(first) <= datafile._IO_WORKERS
+
+
+def test_iter_pages_in_forked_child(tmp_path):
+    import multiprocessing
+    df = DataFile(str(tmp_path / "f.dat"), page_size=256)
+    df.insert_many_clustered([{"id": i, "pad": "z" * 20} for i in range(300)])
+    list(df.iter_pages(prefetch=4))  # el padre ya tiene el pool de E/S creado
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(1) as pool:
+        n = pool.apply_async(_count_records, (df.path,)).get(timeout=30)
+    assert n == 300
+
+
+def _count_records(path):
+    return sum(len(p.iter_records()) for _, p in DataFile(path, page_size=256).iter_pages(prefetch=4))
+
+
+def test_scan_windows_count_disk_reads(tmp_path):
+    import disk_manager
+    from metrics import stats
+    df = DataFile(str(tmp_path / "r.dat"), page_size=256)
+    df.insert_many_clustered([{"id": i, "pad": "r" * 20} for i in range(300)])
+    pc = df.page_count()
+    stats.reset()
+    before = disk_manager.disk_reads
+    assert sum(1 for _ in df.iter_pages(prefetch=4)) == pc
+    # Las ventanas no pasan por DiskManager pero cuentan igual que read_page
+    assert stats.get_counter("disk.reads") == pc
+    assert disk_manager.disk_reads - before == pc
@@ -1,6 +1,6 @@
 import numpy as np
-from multimedia.bow import compute_tfidf
-from multimedia.codebook import train_codebook, save_codebook, load_codebook
+from multimedia.bow import compute_tfidf, quantize_batch, quantize_descriptors
+from multimedia.codebook import train_codebook, train_codebook_streaming, save_codebook, load_codebook, load_centroids
 
 
 def test_tfidf_weighting_vector_norm():
@@ -34,3 +34,31 @@ def test_codebook_save_load_roundtrip(tmp_path):
     c1 = km.cluster_centers_.astype(np.float32)
     c2 = km2.cluster_centers_.astype(np.float32)
     assert np.allclose(c1, c2)
+    # The sidecar .npy is memory-mapped and matches the pickled centroids
+    c3 = load_centroids(str(path))
+    assert isinstance(c3, np.memmap) and c3.dtype == np.float32
+    assert np.allclose(c1, c3)
+
+
+def test_quantize_batch_matches_per_document():
+    # Batched quantization (chunked, with empty docs) must match the per-doc histograms
+    rng = np.random.default_rng(0)
+    centroids = rng.normal(size=(16, 8)).astype(np.float32)
+    descs = [rng.normal(size=(n, 8)).astype(np.float32) for n in (50, 0, 300, 1)]
+    batch = quantize_batch(descs, centroids, chunk_rows=64)
+    assert batch.shape == (4, 16)
+    for d, h in zip(descs, batch):
+        assert np.allclose(quantize_descriptors(d, centroids), h, atol=1e-5)
+    assert np.allclose(batch[1], 0.0)
+    assert np.isclose(batch[0].sum(), 50.0, atol=1e-3)
+
+
+def test_streaming_codebook_respects_caps():
+    # Per-object and global caps bound what partial_fit sees; centroids recover the blobs
+    rng = np.random.default_rng(1)
+    centers = np.eye(4, 8, dtype=np.float32) * 10
+    blocks = (centers[i % 4] + rng.normal(scale=0.1, size=(400, 8)).astype(np.float32) for i in range(40))
+    km = train_codebook_streaming(blocks, k=4, per_object_cap=100, global_cap=3000, batch_size=256, seed=0)
+    assert km.cluster_centers_.shape == (4, 8)
+    nearest = np.linalg.norm(centers[:, None, :] - km.cluster_centers_[None], axis=2).min(axis=1)
+    assert np.all(nearest < 1.0)
@@ -0,0 +1,31 @@
+"""Caché de resultados de /records/search: acotada por bytes y solo para
+la versión más reciente de cada tabla."""
+from __future__ import annotations
+
+import api.records as records
+
+
+def test_search_cache_bounds_bytes_and_drops_old_versions(monkeypatch):
+    monkeypatch.setattr(records, "_search_cache", {})
+    monkeypatch.setattr(records, "_search_lru", records.OrderedDict())
+    monkeypatch.setattr(records, "_search_cache_bytes", 0)
+    monkeypatch.setattr(records, "_SEARCH_CACHE_BUDGET", 1000)
+
+    records._search_cache_put("/t", (1,), "id", "1", b"x" * 300, 1)
+    records._search_cache_put("/t", (1,), "id", "2", b"x" * 300, 1)
+    assert records._search_cache_get("/t", (1,), "id", "1") == (b"x" * 300, 1)
+
+    # Una versión nueva de la tabla descarta las entradas de la anterior
+    records._search_cache_put("/t", (2,), "id", "1", b"y" * 100, 1)
+    assert records._search_cache_get("/t", (1,), "id", "2") is None
+    assert records._search_cache_bytes == 100
+
+    # El presupuesto se respeta por bytes, desalojando lo menos usado
+    for i in range(5):
+        records._search_cache_put("/u", (1,), "id", str(i), b"z" * 300, 1)
+    assert records._search_cache_bytes <= 1000
+    assert records._search_cache_get("/u", (1,), "id", "4") is not None
+    assert records._search_cache_get("/t", (2,), "id", "1") is None
+
+    records._search_cache_drop("/u")
+    assert records._search_cache_bytes == 0 and not records._search_lru
@@ -8,7 +8,7 @@ import os
 import shutil
 import json
 
-from indexes.spimi import build_spimi_blocks, merge_blocks
+from indexes.spimi import build_spimi_blocks, merge_blocks, search_topk
 from indexes.inverted_index import tokenize
 
 
@@ -50,6 +50,40 @@ def test_merge(tmpdir: str):
     print("Basic checks OK")
 
 
+def test_matrix_matches_postings(tmp_path):
+    # La búsqueda con weights.npz (y poda MaxScore) debe dar los mismos
+    # puntajes que el camino por archivos de términos
+    import random
+    random.seed(5)
+    words = "sol luna mar rio monte flor libro mesa gato perro casa pan".split()
+    docs = [(" ".join(random.choices(words[:random.randint(2, 12)], k=random.randint(1, 15))), (i // 10, i % 10))
+            for i in range(400)]
+    block_dir, index_dir = str(tmp_path / 'blocks'), str(tmp_path / 'index')
+    total = build_spimi_blocks(docs, block_dir, block_max_docs=64)
+    merge_blocks(block_dir, index_dir, total_docs=total)
+    queries = ["sol", "sol luna", "pan casa perro gato", "mar mar rio libro", "nada"]
+    fast = {(q, k): search_topk(index_dir, q, k=k) for q in queries for k in (1, 5, 40)}
+    os.remove(os.path.join(index_dir, 'weights.npz'))
+    for (q, k), got in fast.items():
+        slow = search_topk(index_dir, q, k=k)
+        assert [round(s, 9) for _, s in got] == [round(s, 9) for _, s in slow], (q, k)
+
+
+def test_stem_in_forked_child_while_lock_held():
+    import multiprocessing
+    from indexes import inverted_index
+    # Simula otro hilo del padre a mitad de un stemming en el momento del fork
+    with inverted_index._stem_lock:
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(1) as pool:
+            toks = pool.apply_async(_stem_tokens, ("guisandera acogedoramente",)).get(timeout=30)
+    assert toks == inverted_index.tokenize("guisandera acogedoramente", do_stem=True)
+
+
+def _stem_tokens(text):
+    return tokenize(text, do_stem=True)
+
+
 if __name__ == '__main__':
     import tempfile
     tempdir = tempfile.mkdtemp(prefix='spimi_test_')